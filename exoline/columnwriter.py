@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''Binary, columnar output for read --format=parquet|arrow|npz.
+
+Timestamps are stored as int64 unix seconds, and each dataport as a
+column typed by its format (integer: int64, float: float64, anything
+else: string), with nulls where a row has no value for the dataport.
+parquet and arrow need pyarrow, and npz needs numpy. They're imported
+only when one of these formats is used.'''
+from __future__ import unicode_literals
+import os
+import shutil
+import zipfile
+import tempfile
+
+import six
+
+try:
+    from ..exoline.exocommon import ExoException
+except:
+    from exoline.exocommon import ExoException
+
+FORMATS = ['parquet', 'arrow', 'npz']
+
+# rows to collect before writing a parquet row group or arrow record
+# batch
+ROWS_PER_GROUP = 100000
+
+
+def _import(name, fmt):
+    try:
+        return __import__(name, fromlist=[str('_')])
+    except ImportError:
+        raise ExoException(
+            '--format={0} requires the {1} module. Install it with: pip install {1}'.format(
+                fmt, name.split('.')[0]))
+
+
+def column_type(dataport_format):
+    '''Returns 'int64', 'float64' or 'string' for a dataport format'''
+    return {'integer': 'int64', 'float': 'float64'}.get(dataport_format, 'string')
+
+
+def column_names(headers):
+    '''Make headers unique, since columns are looked up by name'''
+    names = []
+    for h in headers:
+        name = h
+        i = 2
+        while name in names:
+            name = '{0}_{1}'.format(h, i)
+            i += 1
+        names.append(name)
+    return names
+
+
+class ColumnWriter:
+    '''Writes read output to a file in a binary columnar format. Like
+    SeriesWriter, it takes rows a chunk at a time with write_many, so
+    memory use doesn't grow with the number of points read.'''
+
+    def __init__(self, filename, headers, formats, fmt):
+        '''filename - file to write
+           headers - column names, starting with timestamp
+           formats - dataport format for each column after timestamp
+           fmt - parquet, arrow or npz'''
+        if fmt not in FORMATS:
+            raise ExoException('Unknown columnar format {0}'.format(fmt))
+        self.filename = os.path.expanduser(filename)
+        self.names = column_names(headers)
+        self.types = ['int64'] + [column_type(f) for f in formats]
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == 'npz':
+            self._writer = _NpzWriter(self.filename, self.names, self.types)
+        else:
+            self._writer = _ArrowWriter(self.filename, self.names, self.types, fmt)
+
+    def write_many(self, timestamps, columns):
+        '''Write a chunk of rows. timestamps is a list of timestamps and
+        columns has a list of values for each column after the timestamp.
+        None is written as null.'''
+        self.rows += len(timestamps)
+        try:
+            self._writer.write([timestamps] + list(columns))
+        except (ValueError, TypeError, OverflowError) as ex:
+            raise ExoException('Unable to write --format={0}: {1}'.format(self.fmt, ex))
+
+    def write_headers(self):
+        '''Column names are always included'''
+        pass
+
+    def close(self):
+        self._writer.close()
+
+
+class _ArrowWriter:
+    '''Writes parquet row groups or arrow IPC file record batches with
+    pyarrow'''
+
+    def __init__(self, filename, names, types, fmt):
+        self.pa = _import('pyarrow', fmt)
+        pa = self.pa
+        self.arrowtypes = [{'int64': pa.int64(), 'float64': pa.float64(), 'string': pa.string()}[t]
+                           for t in types]
+        # timestamp is never null
+        self.schema = pa.schema([pa.field(n, t, nullable=(i > 0))
+                                 for i, (n, t) in enumerate(zip(names, self.arrowtypes))])
+        self.types = types
+        if fmt == 'parquet':
+            pq = _import('pyarrow.parquet', fmt)
+            self.writer = pq.ParquetWriter(filename, self.schema)
+            self.writebatch = lambda batch: self.writer.write_table(
+                pa.Table.from_batches([batch], schema=self.schema))
+        else:
+            self.writer = pa.ipc.new_file(filename, self.schema)
+            self.writebatch = self.writer.write_batch
+        self.pending = [[] for t in types]
+        self.count = 0
+
+    def write(self, columns):
+        for pending, column in zip(self.pending, columns):
+            pending.extend(column)
+        self.count += len(columns[0])
+        if self.count >= ROWS_PER_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+        arrays = []
+        for values, t, arrowtype in zip(self.pending, self.types, self.arrowtypes):
+            if t == 'float64':
+                values = [None if v is None else float(v) for v in values]
+            elif t == 'string':
+                values = [v if v is None or isinstance(v, six.string_types) else six.text_type(v)
+                          for v in values]
+            arrays.append(self.pa.array(values, type=arrowtype))
+        self.writebatch(self.pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.pending = [[] for t in self.types]
+        self.count = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+
+
+class _NpzWriter:
+    '''Writes a .npz file with an array for each column and a boolean
+    <name>.mask array for each value column, True where the row has no
+    value (as in numpy.ma). Chunks are saved to temporary files as they
+    arrive and put together when the writer is closed, so only a chunk
+    is in memory at once. String columns are fixed width unicode, as
+    wide as the longest value.'''
+
+    def __init__(self, filename, names, types):
+        self.np = _import('numpy', 'npz')
+        self.filename = filename
+        self.names = names
+        self.types = types
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = [open(os.path.join(self.tmpdir, str(i)), 'w+b') for i in range(len(names))]
+        self.maskfiles = [open(os.path.join(self.tmpdir, '{0}.mask'.format(i)), 'w+b')
+                          for i in range(len(names))]
+        self.width = [1] * len(names)
+        self.rows = 0
+
+    def write(self, columns):
+        np = self.np
+        for i, (column, t) in enumerate(zip(columns, self.types)):
+            mask = [v is None for v in column]
+            if t == 'string':
+                values = ['' if v is None else six.text_type(v) for v in column]
+                self.width[i] = max([self.width[i]] + [len(v) for v in values])
+                # widths vary between chunks, so save each with its own
+                np.save(self.files[i], np.array(values, dtype='U'))
+            else:
+                fill = 0 if t == 'int64' else float('nan')
+                values = [fill if v is None else v for v in column]
+                self.files[i].write(np.array(values, dtype=t).tobytes())
+            if i > 0:
+                self.maskfiles[i].write(np.array(mask, dtype='bool').tobytes())
+        self.rows += len(columns[0])
+
+    def _save(self, zf, name, dtype, f, chunked):
+        '''Add an array to zf from the temporary file f'''
+        np = self.np
+        npy = os.path.join(self.tmpdir, 'array.npy')
+        with open(npy, 'wb') as out:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                'fortran_order': False,
+                'shape': (self.rows,)})
+            f.seek(0)
+            if chunked:
+                while True:
+                    try:
+                        chunk = np.load(f)
+                    except (IOError, ValueError, EOFError):
+                        break
+                    out.write(chunk.astype(dtype).tobytes())
+            else:
+                shutil.copyfileobj(f, out)
+        zf.write(npy, name + '.npy')
+        os.remove(npy)
+
+    def close(self):
+        try:
+            zf = zipfile.ZipFile(self.filename, 'w', zipfile.ZIP_STORED, allowZip64=True)
+            try:
+                for i, (name, t) in enumerate(zip(self.names, self.types)):
+                    if t == 'string':
+                        self._save(zf, name, 'U{0}'.format(self.width[i]), self.files[i], True)
+                    else:
+                        self._save(zf, name, t, self.files[i], False)
+                    if i > 0:
+                        self._save(zf, name + '.mask', 'bool', self.maskfiles[i], False)
+            finally:
+                zf.close()
+        finally:
+            for f in self.files + self.maskfiles:
+                f.close()
+            shutil.rmtree(self.tmpdir)
@@ -13,6 +13,21 @@ Options:
   --port=<port>          OneP port. Default is $EXO_PORT or 443
   -c --config=<file>     Config file Default is $EXO_CONFIG or ~/.exoline
   --httptimeout=<sec>    HTTP timeout [default: 60] (default for copy is 480)
+  --parallel=<n>         Number of batched RPC requests to keep in flight at
+                         once. Default is $EXO_PARALLEL or 1
+  --infocache=<sec>      Seconds to remember info, listing and lookup
+                         responses. Calls that change resources clear
+                         them. Default is $EXO_INFOCACHE or 0 (off)
+  --infocachefile=<file> Save remembered responses to <file> for use by later
+                         commands (with --infocache). Default is
+                         $EXO_INFOCACHEFILE
+  --recordrpc=<file>     Append RPC requests and responses to <file>
+  --replayrpc=<file>     Answer RPC requests from <file> (as saved by
+                         recordrpc) instead of sending them
+  --perf                 Show a report of RPC requests made and time spent
+                         after the command runs
+  --perf-out=<file>      Append the report to <file> as a line of JSON.
+                         Default is $EXO_PERF_OUT
   --https                Enable HTTPS (deprecated, HTTPS is default)
   --http                 Disable HTTPS
   --useragent=<ua>       Set User-Agent Header for outgoing requests
@@ -36,6 +51,18 @@ See 'exo <command> --help' for more information on a specific command.
 from __future__ import unicode_literals
 import sys
 import os
+
+# hand the command to a running exo daemon, if there is one, before
+# spending time on the imports below
+if __name__ == '__main__' and os.environ.get('EXO_DAEMON_SOCKET'):
+    try:
+        from exoline import exodaemon
+    except ImportError:
+        import exodaemon
+    _exitcode = exodaemon.forward(os.environ['EXO_DAEMON_SOCKET'], sys.argv)
+    if _exitcode is not None:
+        sys.exit(_exitcode)
+
 import json
 if sys.version_info < (3, 0):
     import unicodecsv as csv
@@ -43,15 +70,18 @@ else:
     import csv
 import platform
 import re
+import calendar
 from datetime import datetime
+from datetime import date
 from datetime import timedelta
 import time
 from pprint import pprint
 from operator import itemgetter
 import logging
 from collections import defaultdict
+import collections
+import heapq
 import copy
-import difflib
 import warnings
 
 import six
@@ -66,15 +96,14 @@ except ImportError:
 import itertools
 import math
 import glob
+import threading
 
+# dateutil, requests, ruamel.yaml, humanize, blessings, difflib and
+# multiprocessing are imported where they're used, since most commands
+# don't need them all
 from docopt import docopt
-from dateutil import parser
 from dotenv import Dotenv
-import requests
-import ruamel.yaml as yaml
 import importlib
-import humanize
-import blessings
 
 from pyonep import onep
 from pyonep import provision
@@ -85,21 +114,52 @@ try:
     from ..exoline.exocommon import ExoException
     from ..exoline import exocommon
     from ..exoline import serieswriter
+    from ..exoline import seriescache
+    from ..exoline import exodaemon
+    from ..exoline import columnwriter
 except:
     from exoline import __version__
     from exoline.exocommon import ExoException
     from exoline import exocommon
     from exoline import serieswriter
+    from exoline import seriescache
+    from exoline import exodaemon
+    from exoline import columnwriter
 
 DEFAULT_HOST = 'm2.exosite.com'
 DEFAULT_PORT = '80'
 DEFAULT_PORT_HTTPS = '443'
 DEFAULT_CONFIG = '~/.exoline'
 SCRIPT_LIMIT_BYTES = 16 * 1024
+# rows read writes at a time
+READ_WRITE_ROWS = 1000
+# most points record sends in one request, unless --chunksize is larger
+RECORD_MAX_POINTS = 10000
+# clients tree requests the children of at once
+TREE_PREFETCH_CLIENTS = 200
+# tree lines up columns for this many children of a client at a time
+TREE_ALIGN_ROWS = 1000
+# info saved by the snapshot command, as search and dump use it
+SNAPSHOT_INFO_OPTIONS = {'description': True, 'key': True, 'basic': True, 'aliases': True}
 
 PERF_DATA = []
 
-colored_terminal = blessings.Terminal()
+# ExoRPC objects kept between commands by exo daemon, keyed by their
+# options. None when not running as a daemon.
+daemon_rpcs = None
+
+class LazyTerminal(object):
+    '''blessings.Terminal, created the first time it's used'''
+    def __init__(self):
+        self._terminal = None
+
+    def __getattr__(self, name):
+        if self._terminal is None:
+            import blessings
+            self._terminal = blessings.Terminal()
+        return getattr(self._terminal, name)
+
+colored_terminal = LazyTerminal()
 
 cmd_doc = OrderedDict([
     ('read',
@@ -114,18 +174,35 @@ Command options:
     --tz=<TZ>                Olson TZ name
     --sort=<order>           asc or desc [default: desc]
     --selection=all|autowindow|givenwindow  downsample method [default: all]
-    --format=csv|raw         output format [default: csv]
+    --format=csv|raw|parquet|arrow|npz
+                             output format [default: csv]
+    --outfile=<file>         file for parquet, arrow or npz output
     --timeformat=unix|human|iso8601|excel
                              unix timestamp, human-readable, or spreadsheet-
                              compatible? [default: human]
     --header=name|rid        include a header row
     --chunksize=<size>       [default: 212] break read into requests of
                              length <size>, printing data as it is received.
+    --parallel-ranges=<n>    split the time range into <n> windows and read
+                             up to --parallel of them at the same time
+    --balance-ranges         size --parallel-ranges windows to hold about
+                             the same amount of data
+    --cache                  keep data in a local cache in ~/.exoline-cache
+                             and read only newer data from the server next
+                             time. On by default if $EXO_CACHE or cache in
+                             the config file is true
+    --no-cache               don't use the local cache
     {{ helpoption }}
 
     If <rid> is omitted, reads all datasources and datarules under <auth>.
     All output is in UTC.
 
+    parquet, arrow (IPC file) and npz formats store timestamps as unix
+    time in an int64 column and each dataport as a column typed by its
+    format (int64, float64 or string), with nulls for rows where it
+    has no value. In npz files nulls are in a <column>.mask array.
+    parquet and arrow need pyarrow, and npz needs numpy.
+
     {{ startend }}'''),
     ('write',
         '''Write data at the current time.\n\nUsage:
@@ -156,6 +233,15 @@ The - form takes the value to write from stdin. For example:
 Command options:
     --interval generates timestamps at a regular interval into the past.
     --chunksize=<lines>       [default: 212] break record into requests of length <lines>
+    --parallel=<n>            number of requests to keep in flight at once
+    --checkpoint=<file>       save how much of the CSV on stdin has been
+                              recorded to <file>, and skip that much when
+                              run again with the same <file>
+
+    Requests that fail because of a connection problem are retried a few
+    times, waiting longer each time. Recording a point again is harmless,
+    so after a failure, running the same command with --checkpoint
+    resumes after the last chunk known to be recorded.
 
     '''),
     ('create',
@@ -269,14 +355,25 @@ Command options:
     exo [options] tree [--verbose] [--values] <auth>
 
 Command options:
-    --level=<num>  depth to traverse, omit or -1 for no limit [default: -1]'''),
+    --level=<num>         depth to traverse, omit or -1 for no limit [default: -1]
+    --max-children=<n>    show at most <n> children of each client, and how
+                          many more there are
+
+    Lines are printed as soon as they're known, and columns line up for up
+    to 1000 children of a client at a time. With --max-children, the
+    children shown are the first <n> the One Platform lists (dataports,
+    then datarules, dispatches and clients), sorted by name. Info is only
+    requested for those, so output starts quickly however large the
+    clients are.'''),
     ('twee', '''Display a resource's descendants. Like tree, but more wuvable.\n\nUsage:
     exo [options] twee <auth>
 
 Command options:
-    --nocolor      don't use color in output (color is always off in Windows)
-    --level=<num>  depth to traverse, omit or -1 for no limit [default: -1]
-    --rids         show RIDs instead CIKs below the top level
+    --nocolor             don't use color in output (color is always off in Windows)
+    --level=<num>         depth to traverse, omit or -1 for no limit [default: -1]
+    --rids                show RIDs instead CIKs below the top level
+    --max-children=<n>    show at most <n> children of each client, and how
+                          many more there are (see exo tree --help)
 
 Example:
 
@@ -397,6 +494,26 @@ Command options:
     --full         compare all info, even usage, data counts, etc.
     --no-children  don't compare children
     {{ helpoption }}'''),
+    ('snapshot', '''Save a client's info tree to a file, or update a saved one.\n\nUsage:
+    exo [options] snapshot <auth> <file>
+
+    Saves the description, key, basic info and aliases of <auth> and all of
+    its descendants to <file>, as JSON, and prints how many resources were
+    added, removed or changed since <file> was last saved.
+
+    If <file> has a snapshot of <auth> already, info for a client's dataports,
+    datarules and dispatches is reused unless the client's basic.modified time
+    or listing has changed. Info for clients is always requested. So a change
+    to a dataport, datarule or dispatch that doesn't change its client's
+    modified time or listing is only seen with --full.
+
+    The dump command takes --snapshot=<file> to use and update a snapshot this
+    way instead of requesting every resource's info. search --snapshot=<file>
+    searches a snapshot, and updates it with --refresh.
+
+Command options:
+    --full  request info for every resource, ignoring the saved snapshot
+    {{ helpoption }}'''),
     ('ip', '''Get IP address of the server.\n\nUsage:
     exo [options] ip'''),
     ('data', '''Read or write with the HTTP Data API.\n\nUsage:
@@ -452,7 +569,25 @@ Command options:
      create (clone) functionality, which is more full featured.
      https://github.com/exosite/docs/tree/master/rpc#create-clone
 
-     Use the clone command except if you need to copy a device to another portal.''')
+     Use the clone command except if you need to copy a device to another portal.'''),
+    ('daemon', '''Run commands sent from other exo processes.\n\nUsage:
+    exo [options] daemon [--socket=<path>]
+
+    Keeps Exoline loaded, with its connections, and runs commands
+    sent to it over a Unix socket, one at a time. Set $EXO_DAEMON_SOCKET to
+    the socket's path to have exo send commands to the daemon instead of
+    running them itself. exo runs a command itself if no daemon is listening.
+
+    Global options passed to the daemon are ignored. Each command uses its
+    own options and $EXO_* environment variables, read in the directory exo
+    was run from. Commands that use --follow, and record commands that read
+    CSV from stdin, are always run locally. Stdin is only sent for commands
+    that read it.
+
+Command options:
+    --socket=<path>  socket to listen on. Default is $EXO_DAEMON_SOCKET
+                     or ~/.exoline.sock
+    {{ helpoption }}''')
     ])
 
 # shared sections of documentation
@@ -475,43 +610,109 @@ if os.path.exists(dotpath):
     dotenv=Dotenv(dotpath)
     os.environ.update(dotenv)
 
-plugins = []
-if platform.system() != 'Windows':
-    # load plugins. use timezone because this file may be running
+# plugin commands and the documentation for them are saved here, so that
+# plugins only need to be imported when their command is run
+PLUGIN_MANIFEST = os.path.join(seriescache.DEFAULT_CACHE_DIR, 'plugins.json')
+
+
+def import_plugin(module_name):
+    try:
+        return importlib.import_module('plugins.' + module_name)
+    except ImportError:
+        try:
+            return importlib.import_module('exoline.plugins.' + module_name, package='test')
+        except ImportError:
+            return importlib.import_module('exoline.plugins.' + module_name)
+
+
+def plugin_manifest(plugin_paths, manifest_file=PLUGIN_MANIFEST):
+    '''Returns the commands of the plugins in plugin_paths as a list of
+       [command, module name, documentation]. The list is read from
+       manifest_file if no plugin has changed since it was written, and
+       otherwise built by importing every plugin and saved there.'''
+    files = []
+    for plugin_path in [i for i in plugin_paths if len(i) > 0]:
+        files += [f for f in sorted(glob.glob(plugin_path + "/*.py"))
+                  if not os.path.basename(f).startswith('_')]
+    key = {'version': __version__,
+           'files': [[f, os.path.getmtime(f)] for f in files]}
+
+    manifest_file = os.path.expanduser(manifest_file)
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['key'] == key:
+            return manifest['commands']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    commands = []
+    for f in files:
+        module_name = os.path.basename(f)[:-3]
+        plugin = import_plugin(module_name)
+        p = plugin.Plugin()
+        command = p.command()
+        if isinstance(command, six.string_types):
+            commands.append([command, module_name, plugin.__doc__])
+        else:
+            for c in command:
+                commands.append([c, module_name, p.doc(c)])
+
+    # several exo processes may write the manifest at once, so write
+    # it to a temporary file and move it into place
+    try:
+        if not os.path.exists(os.path.dirname(manifest_file)):
+            os.makedirs(os.path.dirname(manifest_file))
+        tmp = '{0}.{1}'.format(manifest_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'commands': commands}, f)
+        os.rename(tmp, manifest_file)
+    except (IOError, OSError):
+        pass
+    return commands
+
+
+def load_plugins():
+    '''Add the commands of plugins in $EXO_PLUGIN_PATH, and their
+       documentation, to cmd_doc. This reads (and if needed writes) the
+       plugin manifest, so it's only done once a command that isn't
+       built in is looked up, or for exo --help.'''
+    global plugins_loaded
+    if plugins_loaded:
+        return
+    plugins_loaded = True
+    # find plugins. use timezone because this file may be running
     # as a script in some other location.
     default_plugin_path = os.path.join(os.path.dirname(exocommon.__file__), 'plugins')
 
     plugin_paths = os.getenv('EXO_PLUGIN_PATH', default_plugin_path).split(':')
 
-    for plugin_path in [i for i in plugin_paths if len(i) > 0]:
-        plugin_names = [os.path.basename(f)[:-3]
-            for f in glob.glob(plugin_path + "/*.py")
-            if not os.path.basename(f).startswith('_')]
+    for command, module_name, doc in plugin_manifest(plugin_paths):
+        plugin_modules[command] = module_name
+        cmd_doc[command] = format_doc(doc)
 
-        for module_name in plugin_names:
-            try:
-                plugin = importlib.import_module('plugins.' + module_name)
-            except Exception as ex:
-                # TODO: only catch the not found exception, for plugin
-                # debugging
-                #print(ex)
-                try:
-                    plugin = importlib.import_module('exoline.plugins.' + module_name, package='test')
-                except Exception as ex:
-                    plugin = importlib.import_module('exoline.plugins.' + module_name)
 
-            # instantiate plugin
-            p = plugin.Plugin()
-            plugins.append(p)
+def find_plugin(command):
+    '''Returns the plugin that handles command, importing it if needed,
+       or None if no plugin does'''
+    load_plugins()
+    for p in plugins:
+        if command in p.command():
+            return p
+    if command in plugin_modules:
+        p = import_plugin(plugin_modules[command]).Plugin()
+        plugins.append(p)
+        return p
+    return None
 
-            # get documentation
-            command = p.command()
-            if isinstance(command, six.string_types):
-                cmd_doc[command] = plugin.__doc__
-            else:
-                for c in command:
-                    cmd_doc[c] = p.doc(c)
-else:
+# plugins that have been imported
+plugins = []
+# command -> module name of plugins that haven't been imported yet
+plugin_modules = {}
+# whether load_plugins has added plugin commands to cmd_doc. The Windows
+# executable build imports its plugins up front instead.
+plugins_loaded = platform.system() == 'Windows'
+if platform.system() == 'Windows':
     # plugin support for Windows executable build
     try:
         # spec plugin
@@ -601,13 +802,17 @@ else:
         traceback.print_exc()
         pprint(ex)
 
-# perform substitutions on command documentation
-for k in cmd_doc:
+def format_doc(doc):
+    '''Perform substitutions on command documentation'''
     # helpoption is appended to any commands that don't already have it
-    if '{{ helpoption }}' not in cmd_doc[k]:
-        cmd_doc[k] += '\n\nCommand options:\n{{ helpoption }}'
+    if '{{ helpoption }}' not in doc:
+        doc += '\n\nCommand options:\n{{ helpoption }}'
     for r in doc_replace:
-        cmd_doc[k] = cmd_doc[k].replace(r, doc_replace[r])
+        doc = doc.replace(r, doc_replace[r])
+    return doc
+
+for k in cmd_doc:
+    cmd_doc[k] = format_doc(cmd_doc[k])
 
 class ExoConfig:
     '''Manages the config file, grouping all realted actions'''
@@ -649,6 +854,7 @@ class ExoConfig:
         else:
             try:
                 with open(configfile) as f:
+                    import ruamel.yaml as yaml
                     self.config = yaml.load(f, yaml.RoundTripLoader)
             except IOError as ex:
                 self.config = {}
@@ -716,14 +922,14 @@ class ExoConfig:
         Command line always overrides ENV which always overrides configfile.
         '''
         # This ONLY works with options that take a parameter.
-        toMingle = ['host', 'port', 'httptimeout', 'useragent', 'portals', 'vendortoken', 'vendor']
+        toMingle = ['host', 'port', 'httptimeout', 'parallel', 'infocache', 'infocachefile', 'recordrpc', 'replayrpc', 'perf-out', 'useragent', 'portals', 'vendortoken', 'vendor']
 
         # Precedence: ARGV then ENV then CFG
 
         # Looks for ENV vars and pull them in, unless in ARGV
         for arg in toMingle:
             if args['--'+arg] is None:
-                env = os.getenv('EXO_'+arg.upper())
+                env = os.getenv('EXO_'+arg.upper().replace('-', '_'))
                 if env is not None:
                     args['--'+arg] = env
 
@@ -742,23 +948,393 @@ class ExolineOnepV1(onep.OnepV1):
     '''Subclass that re-adds deprecated commands needed for devices created
     in Portals before the commands were deprecated.'''
 
+    def __init__(self, *args, **kwargs):
+        onep.OnepV1.__init__(self, *args, **kwargs)
+        # PERF_DATA entry for the most recent call on this connection
+        self.lastperf = None
+        self._sizes = [None, None]
+        # wrap the HTTP request so that request and response sizes can
+        # be included in PERF_DATA
+        onephttp = getattr(self, 'onephttp', None)
+        if onephttp is not None:
+            request = onephttp.request
+            def sized_request(method, path, body, *args, **kwargs):
+                self._sizes = [len(body), None]
+                r = request(method, path, body, *args, **kwargs)
+                if type(r) is tuple and isinstance(r[0], (six.string_types, six.binary_type)):
+                    self._sizes[1] = len(r[0])
+                return r
+            onephttp.request = sized_request
+
+    # RPCCache shared by all connections of an ExoRPC, or None
+    rpccache = None
+    # RPCRecording shared by all connections of an ExoRPC, or None
+    rpcrecording = None
+
     def _callJsonRPC(self, auth, callrequests, returnreq=False, notimeout=False):
+        '''Answer calls from rpccache where possible'''
+        cache = self.rpccache
+        if cache is None:
+            return self._timedJsonRPC(auth, callrequests, returnreq, notimeout)
+        # no timing for requests answered entirely from the cache
+        self.lastperf = None
+        procedures = [cr['procedure'] for cr in callrequests]
+        if len([p for p in procedures if p not in cache.procedures + cache.readprocedures]) > 0:
+            # this request may change what info, listing or lookup return
+            cache.clear()
+            return self._timedJsonRPC(auth, callrequests, returnreq, notimeout)
+
+        keys = [cache.key(auth, cr) if cr['procedure'] in cache.procedures else None
+                for cr in callrequests]
+        hits = {}
+        for i, key in enumerate(keys):
+            if key is not None:
+                found, result = cache.get(key)
+                if found:
+                    hits[i] = result
+        if not returnreq and len(callrequests) == 1:
+            if 0 in hits:
+                return True, hits[0]
+            isok, response = self._timedJsonRPC(auth, callrequests, False, notimeout)
+            if isok and keys[0] is not None:
+                cache.put(keys[0], response)
+            return isok, response
+
+        misses = [cr for i, cr in enumerate(callrequests) if i not in hits]
+        responses = {}
+        if len(misses) > 0:
+            for call, isok, response in self._timedJsonRPC(auth, misses, True, notimeout):
+                responses[call['id']] = (call, isok, response)
+        ret = []
+        for i, cr in enumerate(callrequests):
+            if i in hits:
+                ret.append((cr, True, hits[i]))
+            else:
+                call, isok, response = responses[cr['id']]
+                if isok and keys[i] is not None:
+                    cache.put(keys[i], response)
+                ret.append((call, isok, response))
+        if returnreq:
+            return ret
+        return ret[0][1:]
+
+    def _timedJsonRPC(self, auth, callrequests, returnreq=False, notimeout=False):
         '''Time all calls to _callJsonRPC'''
+        error = None
         try:
             ts = time.time()
             procedures = [cr['procedure'] for cr in callrequests]
-            r = onep.OnepV1._callJsonRPC(self, auth, callrequests, returnreq, notimeout=notimeout)
-        except:
+            self._sizes = [None, None]
+            recording = self.rpcrecording
+            if recording is None:
+                r = onep.OnepV1._callJsonRPC(self, auth, callrequests, returnreq, notimeout=notimeout)
+            else:
+                if recording.replay:
+                    r = recording.responses(auth, callrequests)
+                else:
+                    r = onep.OnepV1._callJsonRPC(self, auth, callrequests, True, notimeout=notimeout)
+                    recording.record(auth, r)
+                if not returnreq:
+                    r = r[0][1:]
+        except Exception as ex:
+            error = str(ex)
             raise
         finally:
             te = time.time()
-            PERF_DATA.append({'cik': auth, 'procedures': procedures, 'seconds': te-ts})
+            self.lastperf = {'cik': auth,
+                             'procedures': procedures,
+                             'start': ts,
+                             'seconds': te-ts,
+                             'request_bytes': self._sizes[0],
+                             'response_bytes': self._sizes[1],
+                             'error': error}
+            PERF_DATA.append(self.lastperf)
         return r
 
     def comment(self, auth, rid, visibility, comment, defer=False):
         return self._call('comment', auth, [rid, visibility, comment], defer)
 
 
+class RPCCache():
+    '''Remembers responses to info, listing and lookup calls for ttl
+    seconds, so commands that make the same calls over and over only
+    send them once. Any request with a call other than these or read and
+    wait (for example, the procedures in ExoPortals.writeprocs) may
+    change their responses, so it clears the cache.'''
+    procedures = ['info', 'listing', 'lookup']
+    readprocedures = ['read', 'wait']
+
+    def __init__(self, ttl, maxsize=10000, filename=None):
+        '''ttl - seconds to keep responses
+           maxsize - number of responses to keep. Least recently used
+                     responses are dropped first.
+           filename - file to load responses from and save them to, so
+                      they can be used by later commands'''
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.filename = filename
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if filename is not None:
+            self.load()
+
+    def key(self, auth, callrequest):
+        return json.dumps([auth, callrequest['procedure'], callrequest['arguments']],
+                          sort_keys=True)
+
+    def get(self, key):
+        '''Returns (found, response)'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                return False, None
+            # most recently used entries go at the end
+            self._entries[key] = entry
+            # callers modify responses, so give each its own copy
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(response))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self):
+        try:
+            with open(os.path.expanduser(self.filename)) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires, response in entries:
+                if expires >= now:
+                    self._entries[key] = (expires, response)
+
+    def save(self):
+        '''Save responses to filename. Responses may include client keys,
+           so the file is only readable by the user.'''
+        filename = os.path.expanduser(self.filename)
+        now = time.time()
+        with self._lock:
+            entries = [[k, e[0], e[1]] for k, e in six.iteritems(self._entries)
+                       if e[0] >= now]
+        tmp = filename + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        if platform.system() == 'Windows' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+
+
+class RPCRecording():
+    '''Saves requests and their responses to a file, one JSON object per
+    line, or answers requests from such a file instead of sending them.
+    This makes it possible to run commands offline, e.g. for tests and
+    benchmarks. Requests are matched by auth and calls, not call ids.
+    Identical requests are answered in the order they were recorded,
+    and after that with the last response recorded for them.'''
+
+    def __init__(self, filename, replay=False):
+        '''filename - file to append requests to, or to replay them from
+           replay - True to answer requests from filename'''
+        self.filename = os.path.expanduser(filename)
+        self.replay = replay
+        self._lock = threading.Lock()
+        self._recorded = {}
+        if replay:
+            try:
+                with open(self.filename) as f:
+                    for line in f:
+                        if len(line.strip()) == 0:
+                            continue
+                        entry = json.loads(line)
+                        self._recorded.setdefault(
+                            self.key(entry['auth'], entry['calls']),
+                            collections.deque()).append(entry['responses'])
+            except (IOError, OSError, ValueError, KeyError) as ex:
+                raise ExoException('Unable to replay requests from {0}: {1}'.format(filename, ex))
+
+    def key(self, auth, callrequests):
+        return json.dumps([auth, [[c['procedure'], c['arguments']] for c in callrequests]],
+                          sort_keys=True)
+
+    def record(self, auth, results):
+        '''Save a request. results is a list of (call, isok, response)'''
+        line = json.dumps({
+            'auth': auth,
+            'calls': [{'procedure': c['procedure'], 'arguments': c['arguments']}
+                      for c, isok, response in results],
+            'responses': [[isok, response] for c, isok, response in results]})
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
+
+    def responses(self, auth, callrequests):
+        '''Returns the recorded response to a request as a list of
+           (call, isok, response)'''
+        with self._lock:
+            recorded = self._recorded.get(self.key(auth, callrequests))
+            if not recorded:
+                raise pyonep.exceptions.JsonRPCRequestException(
+                    'No recorded response in {0} for {1}'.format(
+                        self.filename,
+                        [c['procedure'] for c in callrequests]))
+            responses = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        return [(call, isok, copy.deepcopy(response))
+                for call, (isok, response) in zip(callrequests, responses)]
+
+
+class PerfReport():
+    '''Summarizes the requests added to PERF_DATA while a command runs:
+    how long they took for each procedure, how many calls were in each,
+    bytes sent and received, retries and errors, and how much of the
+    command's time was spent waiting for requests versus in Exoline.'''
+
+    def __init__(self, command):
+        self.command = command
+        self.start = time.time()
+        self._first = len(PERF_DATA)
+
+    @staticmethod
+    def percentile(values, percent):
+        '''Nearest rank percentile of a sorted list'''
+        if len(values) == 0:
+            return None
+        return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+    def summary(self):
+        '''Returns the report as a dict'''
+        seconds = time.time() - self.start
+        entries = PERF_DATA[self._first:]
+        # time with at least one request in flight. Requests overlap
+        # when they're sent in parallel.
+        network = 0.0
+        end = None
+        for s, e in sorted([(p['start'], p['start'] + p['seconds']) for p in entries]):
+            if end is None or s > end:
+                network += e - s
+                end = e
+            elif e > end:
+                network += e - end
+                end = e
+        # a request counts toward each procedure it contains
+        times = defaultdict(list)
+        for p in entries:
+            for procedure in set(p['procedures']):
+                times[procedure].append(p['seconds'])
+        procedures = {}
+        for procedure, t in times.items():
+            t.sort()
+            procedures[procedure] = {
+                'requests': len(t),
+                'seconds': sum(t),
+                'p50': self.percentile(t, 50),
+                'p95': self.percentile(t, 95),
+                'p99': self.percentile(t, 99),
+                'max': t[-1]}
+        calls = sorted([len(p['procedures']) for p in entries])
+        def total(key):
+            values = [p[key] for p in entries if p.get(key) is not None]
+            return sum(values) if len(values) > 0 else None
+        return {
+            'command': self.command,
+            'exoline': __version__,
+            'time': self.start,
+            'seconds': seconds,
+            'network_seconds': network,
+            'local_seconds': max(0.0, seconds - network),
+            'requests': len(entries),
+            'calls': sum(calls),
+            'calls_per_request': {
+                'mean': float(sum(calls)) / len(calls) if len(calls) > 0 else None,
+                'p50': self.percentile(calls, 50),
+                'max': calls[-1] if len(calls) > 0 else None},
+            'request_bytes': total('request_bytes'),
+            'response_bytes': total('response_bytes'),
+            'retries': len([p for p in entries if p.get('retried')]),
+            'errors': len([p for p in entries if p.get('error') is not None]),
+            'procedures': procedures}
+
+    def write(self, summary, out):
+        '''Write summary as a table to out'''
+        def fmt(v, spec='{0}'):
+            return '-' if v is None else spec.format(v)
+        cpr = summary['calls_per_request']
+        out.write('perf: {0} took {1:.3f}s, {2:.3f}s waiting for requests and {3:.3f}s local\n'.format(
+            summary['command'], summary['seconds'], summary['network_seconds'],
+            summary['local_seconds']))
+        out.write('perf: {0} requests, {1} calls ({2} per request, max {3}), '
+                  '{4} bytes sent, {5} bytes received, {6} retries, {7} errors\n'.format(
+            summary['requests'], summary['calls'], fmt(cpr['mean'], '{0:.1f}'),
+            fmt(cpr['max']), fmt(summary['request_bytes']),
+            fmt(summary['response_bytes']), summary['retries'], summary['errors']))
+        if len(summary['procedures']) > 0:
+            out.write('perf: {0:<12} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}\n'.format(
+                'procedure', 'requests', 'p50', 'p95', 'p99', 'max', 'total'))
+        for procedure, p in sorted(summary['procedures'].items()):
+            out.write('perf: {0:<12} {1:>8} {2:>9.3f} {3:>9.3f} {4:>9.3f} {5:>9.3f} {6:>9.3f}\n'.format(
+                procedure, p['requests'], p['p50'], p['p95'], p['p99'], p['max'], p['seconds']))
+
+    def finish(self, show=False, filename=None):
+        '''Write the report to stderr if show is True, and append it
+           as a line of JSON to filename if it's not None'''
+        summary = self.summary()
+        if show:
+            self.write(summary, sys.stderr)
+        if filename is not None:
+            with open(os.path.expanduser(filename), 'a') as f:
+                f.write(json.dumps(summary, sort_keys=True) + '\n')
+
+
+class AdaptiveBatchSize():
+    '''Chooses how many commands (or data points) to put in each request
+    for a batched code path. The size grows while requests come back
+    quickly with small responses, and shrinks when they are slow, large,
+    or time out.'''
+
+    def __init__(self, size, minsize=1, maxsize=None, seconds=5.0, maxbytes=4 * 1024 * 1024):
+        '''size - initial size
+           minsize, maxsize - bounds for the size
+           seconds - target time for a request
+           maxbytes - target maximum response size'''
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.seconds = seconds
+        self.maxbytes = maxbytes
+        self.size = self._bound(size)
+        self._lock = threading.Lock()
+
+    def _bound(self, size):
+        size = max(self.minsize, int(size))
+        if self.maxsize is not None:
+            size = min(self.maxsize, size)
+        return size
+
+    def observe(self, count, seconds, response_bytes=None):
+        '''Adjust size after a request of count commands took seconds and
+           returned response_bytes.'''
+        with self._lock:
+            big = response_bytes is not None and response_bytes > self.maxbytes
+            small = response_bytes is None or response_bytes < self.maxbytes / 4
+            if seconds > self.seconds or big:
+                self.size = self._bound(min(self.size, count) // 2)
+            elif seconds < self.seconds / 4 and small and count >= self.size:
+                # only a full batch says anything about a bigger one
+                self.size = self._bound(self.size * 3 // 2 + 1)
+
+    def timedout(self, count):
+        '''Shrink size after a request of count commands timed out'''
+        with self._lock:
+            self.size = self._bound(min(self.size, count) // 2)
+
+
 class ExoRPC():
     '''Wrapper for pyonep RPC API.
     Raises exceptions on error and provides some reasonable defaults.'''
@@ -789,21 +1365,147 @@ class ExoRPC():
                  verbose=True,
                  logrequests=False,
                  user_agent=None,
-                 curldebug=False):
+                 curldebug=False,
+                 parallel=1,
+                 infocache=0,
+                 infocachefile=None,
+                 recordrpc=None,
+                 replayrpc=None):
 
         if port is None:
             port = DEFAULT_PORT_HTTPS if https else DEFAULT_PORT
         if user_agent is None:
             user_agent = "Exoline {0}".format(__version__)
-        self.exo = ExolineOnepV1(
-            host=host,
-            port=port,
-            httptimeout=httptimeout,
-            https=https,
-            agent=user_agent,
-            reuseconnection=True,
-            logrequests=logrequests,
-            curldebug=curldebug)
+        try:
+            self.parallel = 1 if parallel is None else int(parallel)
+        except ValueError:
+            self.parallel = 0
+        if self.parallel < 1:
+            raise ExoException('--parallel must be a positive integer')
+        try:
+            infocache = 0 if infocache is None else float(infocache)
+        except ValueError:
+            infocache = -1
+        if infocache < 0:
+            raise ExoException('--infocache must be a number of seconds')
+        # info, listing and lookup responses shared by all connections
+        if infocache > 0:
+            self.rpccache = RPCCache(infocache, filename=infocachefile)
+        else:
+            self.rpccache = None
+        if recordrpc is not None and replayrpc is not None:
+            raise ExoException('--recordrpc and --replayrpc may not be used together')
+        if replayrpc is not None:
+            self.rpcrecording = RPCRecording(replayrpc, replay=True)
+        elif recordrpc is not None:
+            self.rpcrecording = RPCRecording(recordrpc)
+        else:
+            self.rpcrecording = None
+        # options for creating connections. Each thread that sends
+        # requests gets its own connection (see exo property)
+        self._exo_options = {
+            'host': host,
+            'port': port,
+            'httptimeout': httptimeout,
+            'https': https,
+            'agent': user_agent,
+            'reuseconnection': True,
+            'logrequests': logrequests,
+            'curldebug': curldebug}
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._pool = None
+        # worker threads for sending batches with different auths at once
+        self._authpool = None
+        # aim for requests that take well under the HTTP timeout
+        self._target_seconds = min(5.0, float(httptimeout) / 4)
+        self._batchsizes = {}
+
+    @property
+    def exo(self):
+        '''ExolineOnepV1 instance for the calling thread. Connections
+        are reused by the thread that created them, so _exobatch worker
+        threads each keep their own connection open.'''
+        exo = getattr(self._local, 'exo', None)
+        if exo is None:
+            exo = ExolineOnepV1(**self._exo_options)
+            exo.rpccache = self.rpccache
+            exo.rpcrecording = self.rpcrecording
+            with self._connections_lock:
+                self._connections.append(exo)
+            self._local.exo = exo
+        return exo
+
+    def loggedrequests(self):
+        '''Return requests logged by all connections (see logrequests)'''
+        return list(itertools.chain(*[c.loggedrequests() for c in self._connections]))
+
+    def _batchsize(self, name, size, maxsize=None):
+        '''Return the AdaptiveBatchSize for the batched code path called
+           name, creating it with initial size the first time. Each
+           initial size gets its own, so a command asking for a
+           different size (e.g. read --chunksize) in exo daemon isn't
+           held to the one an earlier command settled on.'''
+        key = (name, size, maxsize)
+        if key not in self._batchsizes:
+            # setdefault, in case another thread got here first
+            self._batchsizes.setdefault(key, AdaptiveBatchSize(
+                size,
+                maxsize=maxsize,
+                seconds=self._target_seconds))
+        return self._batchsizes[key]
+
+    def _observe(self, batchsize, count):
+        '''Tell batchsize how the last request on this thread's
+           connection went.'''
+        perf = self.exo.lastperf
+        if perf is not None:
+            batchsize.observe(count, perf['seconds'], perf['response_bytes'])
+
+    def _retrying(self):
+        '''Note in PERF_DATA that the last request on this thread's
+           connection is being sent again'''
+        perf = self.exo.lastperf
+        if perf is not None:
+            perf['retried'] = True
+
+    def _with_retries(self, fn, retries=3, backoff=1.0):
+        '''Return fn(), calling it again up to retries times, waiting
+           backoff seconds and then twice as long each time, if it fails
+           because the request didn't go through. Errors returned by the
+           One Platform are raised right away.'''
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except (pyonep.exceptions.JsonRPCRequestException,
+                    pyonep.exceptions.JsonRPCResponseException) as ex:
+                if attempt >= retries:
+                    raise
+                self._retrying()
+                time.sleep(backoff * 2 ** attempt)
+                attempt += 1
+
+    def _is_timeout(self, ex):
+        '''Return True if exception ex is from a request timing out'''
+        return (isinstance(ex, pyonep.exceptions.JsonRPCRequestException)
+                and 'timed out' in str(ex).lower())
+
+    def save(self):
+        '''Save the info cache, if it has a file'''
+        if self.rpccache is not None and self.rpccache.filename is not None:
+            self.rpccache.save()
+
+    def close(self):
+        '''Stop worker threads used for parallel batches and save the
+           info cache, if it has a file'''
+        for pool in [self._pool, self._authpool]:
+            if pool is not None:
+                pool.terminate()
+        self._pool = None
+        self._authpool = None
+        self.save()
 
     def _raise_for_response(self, isok, response, call=None):
         if not isok:
@@ -852,6 +1554,35 @@ class ExoRPC():
         responses = self._raise_for_deferred(r)
         return responses
 
+    def _send_split(self, send, items, batchsize):
+        '''Return send(items), a list, and tell batchsize how long it took.
+           If the request times out, split items in half and send each
+           half separately.'''
+        try:
+            r = send(items)
+        except pyonep.exceptions.JsonRPCRequestException as ex:
+            if len(items) < 2 or not self._is_timeout(ex):
+                raise
+            batchsize.timedout(len(items))
+            self._retrying()
+            half = len(items) // 2
+            return (self._send_split(send, items[:half], batchsize) +
+                    self._send_split(send, items[half:], batchsize))
+        self._observe(batchsize, len(items))
+        return r
+
+    def _exomult_batched(self, auth, commands, batchsize):
+        '''Like _exomult, but breaks commands into several requests,
+           each sized by batchsize, an AdaptiveBatchSize.'''
+        responses = []
+        i = 0
+        while i < len(commands):
+            chunk = commands[i:i + batchsize.size]
+            responses += self._send_split(
+                lambda cmds: self._exomult(auth, cmds), chunk, batchsize)
+            i += len(chunk)
+        return responses
+
     def _exomult_with_responses(self, auth, commands):
         '''Like _exomult, but returns full responses and does not raise
            an exception for individual response errors. Call this if errors
@@ -866,7 +1597,7 @@ class ExoRPC():
             method = getattr(self.exo, c[0])
             method(auth, *c[1:], defer=True)
         r = self.exo.send_deferred(auth)
-        results = map(self._undo_pyonep_response_mangling, r)
+        results = [self._undo_pyonep_response_mangling(x) for x in r]
         return results
 
     def _undo_pyonep_response_mangling(self, pyonep_response):
@@ -886,22 +1617,53 @@ class ExoRPC():
              commands - a list of commandset objects like this:
                       {'commands': [['info', rid, options]],
                        'callback': lambda(commandset, result)}
-             batchsize - the maximum number of commands/command objects to include
-                       in each RPC request.
+             batchsize - the number of command objects to include in the
+                       first RPC request. Later requests are sized to
+                       complete well within the HTTP timeout.
            Returns a list of responses in the form {'status': !'ok'} on failure or
                 {'status': 'ok', 'result': result}
-           If any overall failures occur, an exception is raised.'''
-        # break calls into chunks to prevent timeout
-        def chunks(l, n):
-            '''Yield successive n-sized chunks from l.'''
-            for i in range(0, len(l), n):
-                yield l[i:i+n]
-        for commandchunk in chunks(commands, batchsize):
+           If any overall failures occur, an exception is raised.
+
+           If parallel was set greater than 1, up to that many requests are
+           sent at once, each on its own connection. Callbacks are still
+           called in order, from the calling thread.'''
+        commands = list(commands)
+        # batchsize is where sizing starts. Later chunks grow or shrink
+        # with how long requests take, and a chunk that times out is split.
+        sizer = self._batchsize('exobatch', batchsize)
+
+        def send_once(commandsets):
             cmds = []
-            for commandset in commandchunk:
+            for commandset in commandsets:
                 cmds = cmds + commandset['commands']
             #sys.stderr.write('_exomult_with_responses with {0} commands.\n'.format(len(cmds)))
-            cmd_responses = self._exomult_with_responses(auth, cmds)
+            return self._exomult_with_responses(auth, cmds)
+
+        def send(commandchunk):
+            return self._send_split(send_once, commandchunk, sizer)
+
+        use_pool = self.parallel > 1 and len(commands) > sizer.size
+        if use_pool and self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.parallel)
+
+        # chunks in flight, oldest first
+        pending = collections.deque()
+        start = 0
+        while start < len(commands) or pending:
+            while start < len(commands) and len(pending) < self.parallel:
+                # size each chunk as it's formed, so it reflects the
+                # requests that have completed so far
+                commandchunk = commands[start:start + sizer.size]
+                start += len(commandchunk)
+                if use_pool:
+                    job = self._pool.apply_async(send, (commandchunk,))
+                else:
+                    job = None
+                pending.append((commandchunk, job))
+            commandchunk, job = pending.popleft()
+            cmd_responses = send(commandchunk) if job is None else job.get()
+
             result_index = 0
             # stitch the flattened result list into command sets
             # and call the command set callbacks
@@ -1019,7 +1781,7 @@ class ExoRPC():
                 parents = []
             results = {'__matches':[], '__shows':[], "__children":[], "__output":[]}
             if type(node) == type({}):
-                for k,v in node.iteritems():
+                for k,v in iteritems(node):
                     #print "\t"*level, k
                     if type(v) == type({}):
                         res = match_node(v, level+1, parents+[k])
@@ -1084,7 +1846,42 @@ class ExoRPC():
         print("\n".join(output))
 
 
-    def _combinereads(self, reads, sort):
+    def _mergereads(self, reads, sort):
+        '''Generates combined [timestamp, values] rows from reads, a list of
+           iterables of [timestamp, value] points, each ordered by sort
+           ('asc' or 'desc'). Each row has one value per read, None where
+           a read has no point at that timestamp. Points are taken from
+           the reads as needed, and a row is generated as soon as every
+           read has moved past its timestamp.'''
+        # heap keys are negated for desc, so the heap always pops the
+        # next timestamp in sort order
+        sign = -1 if sort == 'desc' else 1
+        iters = [iter(r) for r in reads]
+        heap = []
+
+        def push(i):
+            for point in iters[i]:
+                heapq.heappush(heap, (sign * point[0], i, point[1]))
+                break
+
+        for i in range(len(iters)):
+            push(i)
+        while heap:
+            key, i, value = heapq.heappop(heap)
+            values = [None] * len(iters)
+            values[i] = value
+            taken = [i]
+            # each read has at most one point in the heap, so this
+            # takes at most one point per read for this row
+            while heap and heap[0][0] == key:
+                _, i, value = heapq.heappop(heap)
+                values[i] = value
+                taken.append(i)
+            yield [sign * key, values]
+            for i in taken:
+                push(i)
+
+    def _combinereads(self, reads, sort='desc'):
         '''
         >>> exo = ExoRPC()
         >>> exo._combinereads([[[2, 'a'], [1, 'b']]])
@@ -1093,50 +1890,12 @@ class ExoRPC():
         [[3, ['a', 77]], [2, ['b', None]], [1, [None, 78]]]
         >>> exo._combinereads([[[5, 'a'], [4, 'b']], [[2, 'd'], [1, 'e']]])
         [[5, ['a', None]], [4, ['b', None]], [2, [None, 'd']], [1, [None, 'e']]]
+        >>> exo._combinereads([[[1, 'a'], [2, 'b']], [[2, 77], [3, 78]]], 'asc')
+        [[1, ['a', None]], [2, ['b', 77]], [3, [None, 78]]]
         >>> exo._combinereads([])
         []
         '''
-        if len(reads) == 0:
-            return []
-        else:
-            combined = []
-
-            # indexes into each list indicating the next
-            # unprocessed value
-            curi = [len(l) - 1 for l in reads]
-            #print(reads)
-
-            # loop until we've processed every element
-            while curi != [-1] * len(curi):
-                # minimum timestamp from unprocessed entries
-                timestamp = min([reads[i][ci] for i, ci in enumerate(curi) if ci is not -1],
-                        key=itemgetter(0))[0]
-
-                # list of points we haven't processed in each read result
-                # (or None, if all have been processed)
-                unprocessed = [r[i] if i > -1 else None for i, r in zip(curi, reads)]
-
-                # list of values corresponding to timestamp t
-                values = [None if p is None or p[0] != timestamp else p[1]
-                        for p in unprocessed]
-
-                #print('curi {}, values {}, unprocessed: {}'.format(curi, values, unprocessed))
-
-                # add to combined results
-                combined.append([timestamp, values])
-
-                # update curi based on which values were processed
-                for i, v in enumerate(values):
-                    if v is not None:
-                        curi[i] -= 1
-
-            if sort == 'desc':
-                reverse = True
-            else:
-                reverse = False
-
-            combined.sort(key=itemgetter(0), reverse=reverse)
-            return combined
+        return list(self._mergereads(reads, sort))
 
     def readmult(self,
                  auth,
@@ -1152,9 +1911,16 @@ class ExoRPC():
                [12314, [1, 77, 'a']
                [12315, [2, 78, None]]
            Where 1, 77, 'a' is the order rids were passed, and None represents
-           no data in that dataport for that timestamp.'''
+           no data in that dataport for that timestamp.
+
+           Rows are generated as chunks arrive, so memory use depends on
+           chunksize rather than limit.'''
         options = self._readoptions(limit, sort, starttime, endtime, selection)
 
+        # number of points to request per RID when reading in chunks.
+        # This starts at chunksize and adapts to how long reads take.
+        readsize = self._batchsize('read', chunksize, maxsize=10000)
+
         count = [0]
         def _read(auth, rids, rid_options):
             '''Returns a list of lists.  Each of the inner lists is the
@@ -1168,144 +1934,288 @@ class ExoRPC():
         # Each RID needs to keep track of its stating point for each
         # seperately.  If all of the datapoints requested were not created
         # at the same time,we'll get out of step and skip data.
-        ridOptions = []
+        ridOptions = [options.copy() for r in rids]
 
-        for r in rids:
-            # Create a copy of the options that will be sent along with
-            # each RID
-            ridOptions.append(options.copy())
-
-        # Create a list of empty lists to hold the results for each RID
-        totals = [[] for i in range(len(rids))]
+        # points read for each RID that haven't been merged yet
+        buffers = [collections.deque() for r in rids]
+        # RIDs that may still have points to read
+        active = [True for r in rids]
 
         # Check if the limit is smaller than the chunksize, if so we can read
-        # it in a single slurp.  Otherwise we need to read the results from
-        # each RID into memory and then merge them and turncage the resuling
-        # list to the limit.
-        if limit <= chunksize :
-            responses = _read(auth, rids, ridOptions)
-
-            # Add the set of responses to the result
-            i = 0
-            for r in responses:
-                totals[i].extend(r)
-                i += 1
+        # it in a single slurp.  Otherwise read in chunks, each time one of
+        # the RIDs runs out of points to merge.
+        if limit <= chunksize:
+            def fetch():
+                for i, r in enumerate(_read(auth, rids, ridOptions)):
+                    buffers[i].extend(r)
+                    active[i] = False
         else:
-            # Each RID also needs a list to track the number of items remaining
+            # Each RID also needs to track the number of items remaining
             # to read as one RID may run out of data before another.
-            ridMaxLimits = []
-
-            for r in rids:
-                # Create another copy of the options told hold the current
-                # value of the limit (since it'll be larger than the chunksize)
-                ridMaxLimits.append(options.copy())
+            remaining = [limit for r in rids]
 
-            if 'sort' in options and options['sort'] == 'desc':
-                # descending
+            if options['sort'] == 'desc':
+                # descending, so each chunk ends a second before the
+                # last point of the previous one
+                boundary, step = 'endtime', -1
                 if 'endtime' in options:
                     nextStart = options['endtime']
                 else:
                     nextStart = ExoUtilities.parse_ts_tuple(datetime.now().timetuple())
-
-                for o in ridOptions:
-                    o['endtime'] = nextStart
-                    o['limit'] = chunksize
-
-                done = False
-                while not done:
-                    # Read the chunk
-                    responses = _read(auth, rids, ridOptions)
-
-                    # Get the last time from the responses for each RID and
-                    # subtract a second.  This is the start time for the next
-                    # chunk.
-                    for o, m, r in zip(ridOptions, ridMaxLimits, responses):
-                        # Decrement the max to read by the amount we've read
-                        m['limit'] = m['limit'] - len(r)
-                        if m['limit'] <= 0:
-                            done = True
-                            break
-
-                        # Set the limit
-                        if m['limit'] > chunksize:
-                            o['limit'] = chunksize
-                        else:
-                            o['limit'] = m['limit']
-
-                        if len(r) > 0:
-                            # Set the next time to read from
-                            o['endtime'] = r[-1][0] - 1
-
-                    # Add the set of responses to the result
-                    i = 0
-                    for r in responses:
-                        totals[i].extend(r)
-                        i += 1
-
-                    # Check the length of all of the returned lists, when
-                    # they're all zero, we can exit
-                    length = []
-                    for r in responses:
-                        length.append(len(r))
-
-                    if max(length) == 0:
-                        break
             else:
                 # ascending
+                boundary, step = 'starttime', 1
                 if 'starttime' in options:
                     nextStart = options['starttime']
                 else:
                     nextStart = 0
 
-                for o in ridOptions:
-                    o['starttime'] = nextStart
-                    o['limit'] = chunksize
-
-                done = False
-                while not done:
-                    # Read the chunk
-                    responses = _read(auth, rids, ridOptions)
-
-                    # Get the last time from the responses for each RID and
-                    # add a second.  This is the start time for the next
-                    # chunk.
-                    for o, m, r in zip(ridOptions, ridMaxLimits, responses):
-                        # Decrement the max to read by the amount we've read
-                        m['limit'] = m['limit'] - len(r)
-                        if m['limit'] <= 0:
-                            done = True
-                            break
-
-                        # Set the limit
-                        if m['limit'] > chunksize:
-                            o['limit'] = chunksize
-                        else:
-                            o['limit'] = m['limit']
+            for o in ridOptions:
+                o[boundary] = nextStart
+
+            def fetch():
+                while True:
+                    # Read for the RIDs that have run dry or are close to it.
+                    # A round has room for readsize.size points per RID, and
+                    # RIDs that are finished or still have points buffered
+                    # leave their share to the ones being read.
+                    batch = [i for i in range(len(rids))
+                             if active[i] and len(buffers[i]) <= readsize.size // 2]
+                    share = readsize.size * len(rids) // len(batch)
+                    for i in batch:
+                        ridOptions[i]['limit'] = max(1, min(remaining[i], share, readsize.maxsize))
+                    points = sum([ridOptions[i]['limit'] for i in batch]) // len(rids)
+                    try:
+                        responses = _read(auth,
+                                          [rids[i] for i in batch],
+                                          [ridOptions[i] for i in batch])
+                        break
+                    except pyonep.exceptions.JsonRPCRequestException as ex:
+                        if readsize.size < 2 or not self._is_timeout(ex):
+                            raise
+                        readsize.timedout(max(1, points))
+                        self._retrying()
+                self._observe(readsize, points)
+
+                for i, r in zip(batch, responses):
+                    buffers[i].extend(r)
+                    # Decrement the max to read by the amount we've read
+                    remaining[i] -= len(r)
+                    if remaining[i] <= 0 or len(r) == 0:
+                        active[i] = False
+                    elif len(r) < ridOptions[i]['limit'] <= chunksize:
+                        # a short read of no more than chunksize means
+                        # the RID has no more points. Larger reads may be
+                        # cut short by the platform, so keep reading.
+                        active[i] = False
+                    else:
+                        # Set the next time to read from
+                        ridOptions[i][boundary] = r[-1][0] + step
+
+        def series(i):
+            '''Generates points for RID i, reading more as needed'''
+            while True:
+                while buffers[i]:
+                    yield buffers[i].popleft()
+                if not active[i]:
+                    return
+                fetch()
+
+        # Combine all of the data read, truncated to the requested limit
+        merged = self._mergereads([series(i) for i in range(len(rids))],
+                                  options['sort'])
+        for r in itertools.islice(merged, options['limit']):
+            yield r
 
-                        if len(r) > 0:
-                            # Set the next time to read from
-                            o['starttime'] = r[-1][0] + 1
+    def _readwindows(self, auth, rids, starttime, endtime, ranges, balance=False, samples=1000):
+        '''Returns a list of up to ranges (start, end) windows that cover
+           starttime..endtime, in ascending order. If balance is True,
+           the windows are sized to hold about the same number of points,
+           based on reading the RIDs with selection autowindow.'''
+        span = endtime - starttime + 1
+        ranges = max(1, min(ranges, span))
+        bounds = [starttime + span * i // ranges for i in range(ranges)]
+        if balance:
+            # autowindow downsamples the range to at most one point per
+            # window, so the timestamps returned show where the data is
+            reads = self._exomult(auth, [['read', r, {'starttime': starttime,
+                                                      'endtime': endtime,
+                                                      'limit': samples,
+                                                      'sort': 'asc',
+                                                      'selection': 'autowindow'}]
+                                         for r in rids])
+            stamps = sorted([p[0] for read in reads for p in read])
+            if len(stamps) >= ranges:
+                bounds = sorted(set([starttime] + [stamps[len(stamps) * i // ranges]
+                                                   for i in range(1, ranges)]))
+        bounds.append(endtime + 1)
+        return [(bounds[i], bounds[i + 1] - 1) for i in range(len(bounds) - 1)]
+
+    def readmult_ranges(self,
+                        auth,
+                        rids,
+                        limit,
+                        sort='asc',
+                        starttime=None,
+                        endtime=None,
+                        selection='all',
+                        chunksize=212,
+                        ranges=4,
+                        balance=False):
+        '''Like readmult, but splits the time range into windows and reads
+           up to self.parallel of them at the same time, each on its own
+           connection. Rows are generated in order, window by window. If
+           starttime is None, the range starts at the earliest point in
+           any of the RIDs.'''
+        if endtime is None:
+            endtime = ExoUtilities.parse_ts_tuple(datetime.now().timetuple())
+        endtime = int(endtime)
+        if starttime is None:
+            firsts = self._exomult(auth, [['read', r, {'limit': 1,
+                                                       'sort': 'asc',
+                                                       'endtime': endtime}]
+                                          for r in rids])
+            firsts = [f[0][0] for f in firsts if len(f) > 0]
+            if len(firsts) == 0:
+                return
+            starttime = min(firsts)
+        starttime = int(starttime)
+        if starttime > endtime:
+            return
 
-                    # Add the set of responses to the result
-                    i = 0
-                    for r in responses:
-                        totals[i].extend(r)
-                        i += 1
+        windows = self._readwindows(auth, rids, starttime, endtime, ranges, balance)
+        if sort == 'desc':
+            windows.reverse()
 
-                    # Check the length of all of the returned lists, when
-                    # they're all zero, we can exit
-                    length = []
-                    for r in responses:
-                        length.append(len(r))
+        # each window's rows wait in a queue until the windows before it
+        # have been generated. Queues are bounded, so a window that gets
+        # ahead waits rather than filling memory.
+        queues = [six.moves.queue.Queue(maxsize=chunksize * 4) for w in windows]
+        stop = threading.Event()
 
-                    if max(length) == 0:
-                        break
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except six.moves.queue.Full:
+                    pass
+            return False
 
-        # Combine all of the data read
-        res = self._combinereads(totals, options['sort'])
+        def readwindow(window, q):
+            try:
+                for row in self.readmult(auth,
+                                         rids,
+                                         limit,
+                                         sort=sort,
+                                         starttime=window[0],
+                                         endtime=window[1],
+                                         selection=selection,
+                                         chunksize=chunksize):
+                    if not put(q, ('row', row)):
+                        return False
+                put(q, ('done', None))
+            except Exception:
+                put(q, ('error', sys.exc_info()))
+            return True
+
+        # workers take windows in order, so the window being generated
+        # always has a worker and a worker waiting on a full queue
+        # doesn't hold up the windows before it.
+        pending = six.moves.queue.Queue()
+        for window, q in zip(windows, queues):
+            pending.put((window, q))
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    window, q = pending.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                if not readwindow(window, q):
+                    return
+
+        for i in range(min(self.parallel, len(windows))):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+
+        count = 0
+        try:
+            for q in queues:
+                while True:
+                    kind, item = q.get()
+                    if kind == 'done':
+                        break
+                    if kind == 'error':
+                        six.reraise(*item)
+                    yield item
+                    count += 1
+                    if count >= limit:
+                        return
+        finally:
+            stop.set()
+
+    def readmult_cached(self,
+                        cache,
+                        auth,
+                        rids,
+                        limit,
+                        sort='asc',
+                        starttime=None,
+                        endtime=None,
+                        chunksize=212):
+        '''Like readmult, but reads through cache, a SeriesCache, so
+           that only data that isn't cached is read from the server.'''
+        if endtime is None:
+            endtime = ExoUtilities.parse_ts_tuple(datetime.now().timetuple())
+        if starttime is None:
+            starttime = seriescache.MIN_TS
+
+        # cache by RID, so look up any aliases
+        aliases = [r['alias'] for r in rids if isinstance(r, dict)]
+        if len(aliases) > 0:
+            aliasrids = dict(zip(aliases, self._exomult(
+                auth, [['lookup', 'alias', a] for a in aliases])))
+            rids = [aliasrids[r['alias']] if isinstance(r, dict) else r for r in rids]
+
+        def fetch(requests):
+            '''Read the first chunk for all requests in one batch, then
+               page through any that have more.'''
+            def options(limit, sort, start, end):
+                return self._readoptions(limit,
+                                         sort,
+                                         None if start <= seriescache.MIN_TS else start,
+                                         end,
+                                         'all')
+            firsts = self._exomult(auth, [
+                ['read', rids[i], options(chunksize if lim is None else min(lim, chunksize), srt, s, e)]
+                for i, lim, srt, s, e in requests])
+            responses = []
+            for (i, lim, srt, s, e), points in zip(requests, firsts):
+                if len(points) == chunksize and (lim is None or lim > chunksize):
+                    if srt == 'desc':
+                        e = points[-1][0] - 1
+                    else:
+                        s = points[-1][0] + 1
+                    more = self.readmult(auth,
+                                         [rids[i]],
+                                         sys.maxsize if lim is None else lim - len(points),
+                                         sort=srt,
+                                         starttime=None if s <= seriescache.MIN_TS else s,
+                                         endtime=e,
+                                         chunksize=chunksize)
+                    points = points + [[t, v[0]] for t, v in more]
+                responses.append(points)
+            return responses
 
-        # Truncate the list to the requested limit and generate the results
-        for r in res[:options['limit']]:
+        reads = cache.read(fetch,
+                           [cache.key(auth, rid) for rid in rids],
+                           limit,
+                           sort,
+                           int(starttime),
+                           int(endtime))
+        for r in itertools.islice(self._mergereads(reads, sort), limit):
             yield r
 
     def write(self, auth, rid, value):
@@ -1316,6 +2226,44 @@ class ExoRPC():
         isok, response = self.exo.record(auth, rid, entries, {})
         self._raise_for_response_record(isok, response)
 
+    def _record_errors(self, response):
+        '''Returns a description of the errors in a record response from
+           _exomult_with_responses, or None if it succeeded. See
+           _raise_for_response_record.'''
+        if response['status'] != 'ok':
+            return str(response['status'])
+        if type(response['result']) is list:
+            return ', '.join(['{0}: {1}'.format(msg, t) for msg, t in response['result']])
+        return None
+
+    def record_multiple(self, auth, rids, points, batchsize):
+        '''Record points, a list of (index into rids, [timestamp, value]),
+           with one record call per rid in a single request. Requests
+           are sized by batchsize, an AdaptiveBatchSize, and split if
+           they time out. Raises RPCException naming each rid with errors
+           after all the calls in the request have been tried.'''
+        def send(pointchunk):
+            entries = OrderedDict()
+            for idx, point in pointchunk:
+                entries.setdefault(idx, []).append(point)
+            responses = self._exomult_with_responses(
+                auth, [['record', rids[idx], e, {}] for idx, e in entries.items()])
+            errors = []
+            for idx, response in zip(entries, responses):
+                error = self._record_errors(response)
+                if error is not None:
+                    rid = rids[idx]
+                    errors.append('{0} ({1})'.format(
+                        error, rid['alias'] if type(rid) is dict and 'alias' in rid else rid))
+            if len(errors) > 0:
+                raise ExoRPC.RPCException('; '.join(errors))
+            return []
+        i = 0
+        while i < len(points):
+            pointchunk = points[i:i + batchsize.size]
+            self._send_split(send, pointchunk, batchsize)
+            i += len(pointchunk)
+
     def create(self, auth, type, desc, name=None):
         if name is not None:
             desc['name'] = name
@@ -1469,10 +2417,10 @@ class ExoRPC():
             options = {'key': True}
         if recursive:
             rid = None if type(rid) is dict else rid
-            response = self._infotree(auth,
-                                      rid=rid,
-                                      options=options,
-                                      level=level)
+            response = self._infotree_fast(auth,
+                                           rid=rid,
+                                           options=options,
+                                           level=level)
         else:
             isok, response = self.exo.info(auth, rid, options)
             self._raise_for_response(isok, response)
@@ -1549,6 +2497,7 @@ class ExoRPC():
             diff = now - time
         elif not time:
             diff = now - now
+        import humanize
         return humanize.naturaltime(diff)
 
     def _format_timestamp(self, values):
@@ -1572,6 +2521,7 @@ class ExoRPC():
         if len(v) <= maxlen:
             return v
 
+        import difflib
         sm = difflib.SequenceMatcher(None, prev, v)
         def get_nonmatching_blocks(mb):
             lasti = 0
@@ -1836,76 +2786,254 @@ class ExoRPC():
         return ('cik' if 'cik' in auth_dict else 'token',
             auth_dict['cik'] if 'cik' in auth_dict else auth_dict['token'])
 
-    def tree(self, auth, aliases=None, cli_args={}, spacer='', level=0, info_options={}):
-        '''Print a tree of entities in OneP'''
-        max_level = int(cli_args['--level'])
-        # print root node
-        isroot = len(spacer) == 0
+    def tree(self, auth, cli_args={}):
+        '''Print a tree of entities in OneP. Lines are printed as soon as
+           they're known, depth first. The children of a client are
+           requested along with those of the next clients to be printed
+           (see _tree_prefetch), so they can share batches.'''
         if isinstance(auth, six.string_types):
-            auth_type = 'cik'
-            auth_str = auth
-        elif type(auth) is dict:
-            auth_type, auth_str = self.auth_dict_parts(auth)
-            rid = auth.get('client_id', None)
-        else:
+            auth = {'cik': auth}
+        elif type(auth) is not dict:
             raise ExoException('Unexpected auth type ' + str(type(auth)))
-        if isroot:
-            # usage and counts are slow, so omit them if we don't need them
-            exclude = ['usage', 'counts']
-            info_options = self.make_info_options(exclude=exclude)
-            rid, info = self._exomult(auth,
-                                      [['lookup', 'alias', ''],
-                                       ['info', {'alias': ''}, info_options]])
-            # info doesn't contain key
-            info['key'] = auth_str
-            aliases = info['aliases']
-            root_aliases = 'see parent'
-            self._print_node(rid,
-                             auth,
-                             info,
-                             root_aliases,
-                             cli_args,
-                             spacer,
-                             True)
-            if max_level == 0:
-                return
-            level += 1
+        max_children = cli_args.get('--max-children')
+        if max_children is not None:
+            try:
+                max_children = int(max_children)
+            except ValueError:
+                max_children = -1
+            if max_children < 0:
+                raise ExoException('--max-children must be a number')
+        auth_type, auth_str = self.auth_dict_parts(auth)
+        # usage and counts are slow, so omit them if we don't need them
+        exclude = ['usage', 'counts']
+        info_options = self.make_info_options(exclude=exclude)
+        rid, info = self._exomult(auth,
+                                  [['lookup', 'alias', ''],
+                                   ['info', {'alias': ''}, info_options]])
+        # info doesn't contain key
+        info['key'] = auth_str
+        root_aliases = 'see parent'
+        self._print_node(rid, auth, info, root_aliases, cli_args, '', True)
+        ctx = {'auth': auth,
+               'info_options': info_options,
+               'should_read': '--values' in cli_args and cli_args['--values'],
+               'max_level': int(cli_args['--level']),
+               'max_children': max_children,
+               # (node, index of its next client child) for each client
+               # whose children are being printed
+               'stack': [],
+               # clients to fetch at once. It starts small so the first
+               # lines come quickly.
+               'prefetch': 1}
+        root = self._tree_node(rid, info, auth, True, 0)
+        if ctx['max_level'] != 0:
+            self._print_tree_children(root, cli_args, '', ctx)
+
+    def _tree_node(self, rid, info, auth, batched, level):
+        '''Returns a node for _tree_fetch. Keys are:
+
+             rid, info - the client's RID and info
+             auth - auth for the client. For clients under the root it
+                    has the client's RID as client_id.
+             batched - True if the root owns the client, so calls about
+                       it can use the root's auth
+             level - depth of the client in the tree
+             fetched - True once _tree_fetch has run for the client
+             children - [(type, rid, info), ...] in the order printed
+             more - number of children left out by --max-children
+             clients - client children to print the children of, in the
+                       order printed
+             error - exception listing the children, or None'''
+        return {'rid': rid, 'info': info, 'auth': auth,
+                'batched': batched, 'level': level, 'fetched': False,
+                'children': None, 'more': 0, 'clients': [], 'error': None}
+
+    def _tree_calls(self, calls):
+        '''Send calls, a list of (node, auth, command), in batches, with
+           a set of batches for each auth. If parallel was set greater
+           than 1, batches for different auths are sent at the same time.
+           Returns a response for each call like _exomult_with_responses,
+           or the exception raised if its request failed.'''
+        groups = OrderedDict()
+        for i, (node, auth, command) in enumerate(calls):
+            key = json.dumps(auth, sort_keys=True)
+            groups.setdefault(key, (auth, []))[1].append(i)
+        responses = [None] * len(calls)
+
+        def send(auth, indices):
+            commandsets = [{'commands': [calls[i][2]]} for i in indices]
+            try:
+                for i, r in zip(indices, self._exobatch(auth, commandsets)):
+                    responses[i] = r[0]
+            except pyonep.exceptions.OnePlatformException as ex:
+                for i in indices:
+                    if responses[i] is None:
+                        responses[i] = ex
+
+        if self.parallel > 1 and len(groups) > 1:
+            # _exobatch may use _pool itself, so auths get their own pool
+            if self._authpool is None:
+                from multiprocessing.pool import ThreadPool
+                self._authpool = ThreadPool(self.parallel)
+            jobs = [self._authpool.apply_async(send, group) for group in groups.values()]
+            for job in jobs:
+                job.get()
+        else:
+            for auth, indices in groups.values():
+                send(auth, indices)
+        return responses
 
+    def _tree_fetch(self, nodes, ctx):
+        '''Get the children of client nodes for tree, sending the calls
+           for all of them together: the owned and activated listings of
+           each, and then info (and a value, for --values) for each child.
+           Calls about clients the root owns use the root's auth with the
+           client's RID as the resource. Shares, and clients under them,
+           use their own auth.'''
+        auth = ctx['auth']
+        auth_type, auth_str = self.auth_dict_parts(auth)
         types = ['dataport', 'datarule', 'dispatch', 'client']
-        try:
-            should_read = '--values' in cli_args and cli_args['--values']
-
-            #_listing_with_info() output looks like this
-            # {'client': {'<rid0>':<info0>, '<rid1>':<info1>},
-            #  'dataport': {'<rid2>':<info2>}}
-            listing = self._listing_with_info(auth,
-                types=types,
-                info_options=info_options,
-                listing_options={'owned': True},
-                read_options={'limit': 1} if should_read else None)
-            # mark as not shares
-            for t in types:
-                for info in listing[t].values():
-                    info['listing_option'] = 'owned'
-            # add annotations for shares
-            listing_shares = self._listing_with_info(auth,
-                types=types,
-                info_options=info_options,
-                listing_options={'activated': True},
-                read_options={'limit': 1} if should_read else None)
-            # mark as shares and add to listing
-            for t in types:
-                for rid, info in listing_shares[t].items():
-                    info['listing_option'] = 'activated'
+        options = ['owned', 'activated']
+        info_options = ctx['info_options']
+        should_read = ctx['should_read']
+        max_level = ctx['max_level']
+        max_children = ctx['max_children']
+        errors = dict((id(node), []) for node in nodes)
+
+        def failed(node, rank, command, response):
+            '''Note an error in response, if any, for node. Errors are
+               ranked in the order tree used to request things, one
+               client at a time: owned listing, info and values, then
+               activated listing, info and values.'''
+            if isinstance(response, Exception):
+                errors[id(node)].append((rank, response))
+            elif response['status'] != 'ok':
+                errors[id(node)].append((rank, ExoRPC.RPCException(
+                    '{0} ({1})'.format(response['status'], command))))
+            else:
+                return False
+            return True
+
+        listcalls = []
+        for node in nodes:
+            if node['batched']:
+                callauth = auth
+                resource = {'alias': ''} if node['level'] == 0 else node['rid']
+            else:
+                callauth, resource = node['auth'], {'alias': ''}
+            for option in options:
+                listcalls.append((node, callauth, ['listing', types, {option: True}, resource]))
+        listings = self._tree_calls(listcalls)
+
+        # children to get info for, (node, rank, type, rid, listing option,
+        # index into calls)
+        children = []
+        calls = []
+        listed = {}
+        for i, (node, callauth, command) in enumerate(listcalls):
+            option = options[i % len(options)]
+            rank = 3 * (i % len(options))
+            if failed(node, rank, command, listings[i]):
+                continue
+            # shares are only visible to the client that activated them
+            infoauth = callauth if option == 'owned' else node['auth']
+            owned = listed.setdefault(id(node), set())
+            for typ in types:
+                for rid in listings[i]['result'][typ]:
                     # skip any shares that are in the same listing
-                    if rid not in listing[t]:
-                        listing[t][rid] = info
-        except pyonep.exceptions.OnePlatformException:
+                    if rid in owned:
+                        continue
+                    if option == 'owned':
+                        owned.add(rid)
+                    children.append((node, rank, typ, rid, option, len(calls)))
+                    calls.append((node, infoauth, ['info', rid, info_options]))
+                    if should_read and typ in ['dataport', 'datarule']:
+                        calls.append((node, infoauth, ['read', rid, {'limit': 1}]))
+        if max_children is not None:
+            # leave out children after the first max_children of each
+            # client in type order, without asking for their info
+            kept = []
+            counts = defaultdict(int)
+            for child in sorted(children, key=lambda c: (id(c[0]), types.index(c[2]), c[5])):
+                counts[id(child[0])] += 1
+                if counts[id(child[0])] <= max_children:
+                    kept.append(child)
+                else:
+                    child[0]['more'] += 1
+            kept.sort(key=lambda c: c[5])
+            indices = set([c[5] for c in kept] +
+                          [c[5] + 1 for c in kept if should_read and c[2] in ['dataport', 'datarule']])
+            responses = dict(zip([i for i in range(len(calls)) if i in indices],
+                                 self._tree_calls([c for i, c in enumerate(calls) if i in indices])))
+            children = kept
+        else:
+            responses = self._tree_calls(calls)
+
+        listing = dict((id(node), OrderedDict((t, OrderedDict()) for t in types)) for node in nodes)
+        for node, rank, typ, rid, option, i in children:
+            if failed(node, rank + 1, calls[i][2], responses[i]):
+                continue
+            info = responses[i]['result']
+            info['listing_option'] = option
+            if should_read and typ in ['dataport', 'datarule']:
+                if failed(node, rank + 2, calls[i + 1][2], responses[i + 1]):
+                    continue
+                info['read'] = responses[i + 1]['result']
+            listing[id(node)][typ][rid] = info
+
+        for node in nodes:
+            node['fetched'] = True
+            if len(errors[id(node)]) > 0:
+                node['error'] = min(errors[id(node)], key=lambda e: e[0])[1]
+                continue
+            node['children'] = []
+            for typ in types:
+                typelisting = sorted(iteritems(listing[id(node)][typ]),
+                                     key=lambda x: x[1]['description']['name'].lower())
+                node['children'] += [(typ, rid, info) for rid, info in typelisting]
+            if max_level != -1 and node['level'] + 1 >= max_level:
+                continue
+            for typ, rid, info in node['children']:
+                if typ == 'client':
+                    # clients below the root are identified by the root's
+                    # key and their RID as client_id
+                    node['clients'].append(self._tree_node(
+                        rid, info, {auth_type: auth_str, 'client_id': rid},
+                        node['batched'] and info['listing_option'] == 'owned',
+                        node['level'] + 1))
+
+    def _tree_prefetch(self, node, ctx):
+        '''Returns node, which tree needs the children of next, and more
+           clients that haven't been fetched, in the order tree will need
+           them. The number of clients doubles each time, up to
+           TREE_PREFETCH_CLIENTS.'''
+        def unfetched(parent, index):
+            for client in parent['clients'][index:]:
+                if not client['fetched']:
+                    yield client
+                elif client['children'] is not None:
+                    for c in unfetched(client, 0):
+                        yield c
+        later = itertools.chain.from_iterable(
+            unfetched(parent, index) for parent, index in reversed(ctx['stack']))
+        nodes = [node] + list(itertools.islice(later, ctx['prefetch'] - 1))
+        ctx['prefetch'] = min(ctx['prefetch'] * 2, TREE_PREFETCH_CLIENTS)
+        return nodes
+
+    def _print_tree_children(self, node, cli_args, spacer, ctx):
+        '''Print the children of a client node, and theirs, and so on'''
+        if not node['fetched']:
+            self._tree_fetch(self._tree_prefetch(node, ctx), ctx)
+        auth = node['auth']
+        aliases = node['info']['aliases']
+        ex = node['error']
+        if isinstance(ex, pyonep.exceptions.OnePlatformException):
+            auth_type, auth_str = self.auth_dict_parts(auth)
             self._print_tree_line(
                 spacer +
                 "  └─listing for {0} failed. info['basic']['status'] is \
 probably not valid.".format(auth_str))
-        except ExoRPC.RPCException as ex:
+        elif ex is not None:
             if str(ex).startswith('locked ('):
                 self._print_tree_line(
                     spacer +
@@ -1915,52 +3043,60 @@ probably not valid.".format(auth_str))
                     spacer +
                     "  └─RPC error for {0}: {1}".format(json.dumps(auth), ex))
         else:
-            # calculate the maximum length of various things for all children,
-            # so we can make things line up in the output.
-            maxlen = {}
-            namelengths = [len(l[1]['description']['name']) for typ in types for l in iteritems(listing[typ])]
-            maxlen['name'] = 0 if len(namelengths) == 0 else max(namelengths)
-
-            typelengths = [len(l[1]['basic']['type']) for typ in types for l in iteritems(listing[typ])]
-            maxlen['type'] = 0 if len(typelengths) == 0 else max(typelengths)
-
-            formatlengths = [len(l[1]['description']['format'])
-                             for typ in types
-                             for l in iteritems(listing[typ])
-                             if 'format' in l[1]['description']]
-            maxlen['format'] = 0 if len(formatlengths) == 0 else max(formatlengths)
-
-            # print everything
-            for t_idx, t in enumerate(types):
-                typelisting = OrderedDict(sorted(iteritems(listing[t]), key=lambda x: x[1]['description']['name'].lower()))
-                islast_nonempty_type = (t_idx == len(types) - 1) or (all(len(listing[typ]) == 0 for typ in types[t_idx + 1:]))
-                for rid_idx, rid in enumerate(typelisting):
-                    info = typelisting[rid]
-                    islastoftype = rid_idx == len(typelisting) - 1
-                    islast = islast_nonempty_type and islastoftype
-                    if platform.system() != 'Windows':
-                        if islast:
-                            child_spacer = spacer + '    '
-                            own_spacer   = spacer + '  └─'
-                        else:
-                            child_spacer = spacer + '  │ '
-                            own_spacer   = spacer + '  ├─'
-                    else:
-                        # Windows executable
-                        if islast:
-                            child_spacer = spacer + '    '
-                            own_spacer   = spacer + '  +-'
-                        else:
-                            child_spacer = spacer + '  | '
-                            own_spacer   = spacer + '  +-'
-
+            children = node['children']
+            clients = dict((c['rid'], c) for c in node['clients'])
+            frame = [node, 0]
+            ctx['stack'].append(frame)
+            for start in range(0, len(children), TREE_ALIGN_ROWS):
+                block = children[start:start + TREE_ALIGN_ROWS]
+                # calculate the maximum length of various things for the
+                # children near each other, so we can make things line up
+                # in the output.
+                maxlen = {}
+                namelengths = [len(info['description']['name']) for typ, rid, info in block]
+                maxlen['name'] = 0 if len(namelengths) == 0 else max(namelengths)
+
+                typelengths = [len(info['basic']['type']) for typ, rid, info in block]
+                maxlen['type'] = 0 if len(typelengths) == 0 else max(typelengths)
+
+                formatlengths = [len(info['description']['format'])
+                                 for typ, rid, info in block
+                                 if 'format' in info['description']]
+                maxlen['format'] = 0 if len(formatlengths) == 0 else max(formatlengths)
+
+                # print everything
+                for idx, (t, rid, info) in enumerate(block):
+                    islast = start + idx == len(children) - 1 and node['more'] == 0
+                    own_spacer, child_spacer = self._tree_spacers(spacer, islast)
                     if t == 'client':
                         self._print_node(rid, auth, info, aliases, cli_args, own_spacer, islast, maxlen)
-                        if max_level == -1 or level < max_level:
-                            print((auth_type, auth_str, rid))
-                            self.tree({auth_type: auth_str, 'client_id': rid}, info['aliases'], cli_args, child_spacer, level=level + 1, info_options=info_options)
+                        if rid in clients:
+                            frame[1] += 1
+                            self._print_tree_children(clients[rid], cli_args, child_spacer, ctx)
                     else:
                         self._print_node(rid, auth, info, aliases, cli_args, own_spacer, islast, maxlen, values=info['read'] if 'read' in info else None)
+            ctx['stack'].pop()
+            if node['more'] > 0:
+                own_spacer, child_spacer = self._tree_spacers(spacer, True)
+                self._print_tree_line('{0}... {1} more'.format(own_spacer, node['more']))
+        # printed, so it's no longer needed
+        node['children'] = None
+        node['clients'] = []
+
+    def _tree_spacers(self, spacer, islast):
+        '''Returns the spacer for a child's line and the one for lines
+           below it'''
+        if platform.system() != 'Windows':
+            if islast:
+                return spacer + '  └─', spacer + '    '
+            else:
+                return spacer + '  ├─', spacer + '  │ '
+        else:
+            # Windows executable
+            if islast:
+                return spacer + '  +-', spacer + '    '
+            else:
+                return spacer + '  +-', spacer + '  | '
 
     def drop_all_children(self, auth):
         isok, listing = self.exo.listing(
@@ -2329,7 +3465,7 @@ probably not valid.".format(auth_str))
                     raise ExoException('''Copy does not yet support resources that use the "subscribe" feature, as RID {0} in the source client does.\nIf you're just copying a device into the same portal consider using the clone command.'''.format(rid));
                 return rid
             destcik = exoconfig.lookup_shortcut(destcik)
-            infotree = self._infotree(cik, options={}, nodeidfn=check_for_unsupported)
+            infotree = self._infotree_fast(cik, options={}, nodeidfn=check_for_unsupported)
 
         # check counts
         counts = self._counttypes(infotree)
@@ -2377,6 +3513,7 @@ probably not valid.".format(auth_str))
         return dct
 
     def _differences(self, dict1, dict2):
+        import difflib
         differ = difflib.Differ()
 
         s1 = json.dumps(dict1, indent=2, sort_keys=True).splitlines(1)
@@ -2384,102 +3521,178 @@ probably not valid.".format(auth_str))
 
         return list(differ.compare(s1, s2))
 
-    #def _infotree(self,
-    #              auth,
-    #              rid=None,
-    #              restype='client',
-    #              resinfo=None,
-    #              nodeidfn=lambda rid,
-    #              info: rid,
-    #              options={},
-    #              level=None,
-    #              raiseExceptions=True,
-    #              errorfn=lambda auth, msg: None):
-
     def _infotree_fast(self,
                        auth,
-                       nodeidfn=lambda rid, info: rid,
+                       rid=None,
+                       restype='client',
+                       resinfo=None,
+                       nodeidfn=lambda rid,
+                       info: rid,
                        options={},
                        level=None,
-                       listing_options={},
-                       visit=lambda tree, level, parentRID: None):
-        '''Faster version of _infotree that uses the new listing and breadth
-           first traversal to reduce the number of RPC calls.'''
-        rootnode = {'tree': {'type': 'client'}, 'par': None}
-        #if rid is not None:
-        #    # nodeidfn here?
-        #    rootnode['tree']['rid'] = rid
-        level = 0
-        gen = [rootnode]
-        nextgen = []
-        def callback(commandset, result):
-            # add the commandset results to the node
-            node = commandset['node']
-            tree = node['tree']
-            info_idx = 0
-            listing_idx = 1
-            lookup_idx = 2
-
-            # set node info
-            if result[info_idx]['status'] != 'ok':
-                tree['info'] = {'error': result[info_idx]}
-            else:
-                tree['info'] = result[info_idx]['result']
-
-            # lookup is only done for the root node when rid is not known
-            if len(result) == lookup_idx + 1:
-                # this would not be OK
-                assert(result[lookup_idx]['status'] == 'ok')
-                tree['rid'] = result[lookup_idx]['result']
-
-            tree['rid'] = nodeidfn(tree['rid'], tree['info'])
+                       raiseExceptions=True,
+                       errorfn=lambda auth, msg: None,
+                       previous=None):
+        '''Like _infotree, and returns the same nested dict, but gets it
+           a level at a time rather than a client at a time: listings for
+           every client at a level are sent together, then info for all
+           of their children (see _tree_calls). As in _infotree, each
+           client is listed, and its children's info requested, with
+           the client's own auth: the root's key with the client's RID
+           as client_id. That auth is also the one passed to errorfn and
+           put in exception nodes. With raiseExceptions=False, a resource whose
+           info fails becomes an exception node by itself, rather than
+           taking its parent client with it.
+
+           previous is an earlier tree of the same resource, with the
+           same options (including basic) and RIDs as ids. Info for the
+           dataports, datarules and dispatches of a client is taken from
+           it, rather than requested, if the client's basic.modified and
+           listing are the same as they were. Clients' info is always
+           requested.'''
+        if isinstance(auth, string_types):
+            auth = {'cik': auth}
+        auth_type, auth_str = self.auth_dict_parts(auth)
+        types = ['dataport', 'datarule', 'dispatch', 'client']
 
-            # set node listing
-            if tree['type'] == 'client':
-                if result[listing_idx]['status'] != 'ok':
-                    tree['children'] = {'error': result[listing_idx]}
-                else:
-                    children = []
-                    r = result[listing_idx]['result']
-                    for typ in r.keys():
-                        for rid in r[typ]:
-                            children.append({'rid': rid, 'type': typ})
-                    tree['children'] = children
-
-        def commandset(node):
-            rid = node['tree']['rid'] if 'rid' in node['tree'] else {'alias': ''}
-            types = ['client', 'dataport', 'datarule', 'dispatch']
-            commands = [
-                ['info', rid, options]
-            ]
-            if node['tree']['type'] == 'client':
-                commands.append(['listing', types, listing_options, rid])
-            if 'rid' not in node['tree']:
-                commands.append(['lookup', 'aliased', ''])
-            return {'node': node,
-                    'commands': commands,
-                    'callback': callback}
+        def modified(info):
+            return info.get('basic', {}).get('modified')
+
+        # info in previous of each client, by RID
+        before = {}
+        stack = [] if previous is None else [previous]
+        while len(stack) > 0:
+            node = stack.pop()
+            if 'info' in node and 'children' in node['info']:
+                before[node['rid']] = node['info']
+                stack.extend(node['info']['children'])
+
+        def check(response, command):
+            '''Raise an exception if response failed'''
+            if isinstance(response, Exception):
+                raise response
+            if response['status'] != 'ok':
+                raise ExoRPC.RPCException('{0} ({1})'.format(response['status'], command))
+            return response['result']
 
+        try:
+            if rid is None:
+                rid, resinfo = self._exomult(auth, [
+                    ['lookup', 'aliased', ''],
+                    ['info', {'alias': ''}, options]])
+                clientauth = auth
+            else:
+                if resinfo is None:
+                    resinfo = self._exomult(auth, [['info', rid, options]])[0]
+                clientauth = {auth_type: auth_str, 'client_id': rid}
+            root = {'rid': nodeidfn(rid, resinfo), 'info': resinfo}
+        except Exception as ex:
+            if raiseExceptions:
+                raise
+            return {'exception': ex, 'auth': auth, 'rid': rid}
+
+        if level is not None and level <= 0:
+            return root
+        root['info']['children'] = []
+        if restype != 'client':
+            return root
+
+        # clients to list the children of, (node, rid, auth)
+        gen = [(root, rid, clientauth)]
+        depth = 1
         while len(gen) > 0:
-            # set up commandsets with callbacks that modify the nodes in gen
-            commands = map(commandset, gen)
-
-            # get info, listing, etc. for each node at this level
-            results = self._exobatch(auth, commands)
-            results = list(results)
-
-            # now the nodes are populated, so build up the next generation
-            for node in gen:
-                visit(node['tree'], level, node['par']);
-                if 'children' in node['tree']:
-                    for child_tree in node['tree']['children']:
-                        nextgen.append({'tree': child_tree, 'par': node['tree']['rid']})
+            listcalls = [(node, nodeauth, ['listing', types, {}, {'alias': ''}])
+                         for node, noderid, nodeauth in gen]
+            listings = self._tree_calls(listcalls)
+
+            # (parent node, parent auth, type, rid, info from previous or
+            # None) for each child
+            children = []
+            calls = []
+            for (node, noderid, nodeauth), listing, call in zip(gen, listings, listcalls):
+                try:
+                    listing = check(listing, call[2])
+                except ExoRPC.RPCException as ex:
+                    listing = dict([(t, []) for t in types])
+                    errorfn(nodeauth, str(ex))
+                except Exception as ex:
+                    if raiseExceptions:
+                        raise
+                    node.clear()
+                    node.update({'exception': ex, 'auth': nodeauth, 'rid': noderid})
+                    continue
+                old = before.get(noderid)
+                kept = {}
+                if (old is not None and modified(old) is not None and
+                        modified(old) == modified(node['info']) and
+                        sorted([c['rid'] for c in old['children']]) ==
+                        sorted(itertools.chain(*[listing[t] for t in types]))):
+                    kept = dict((c['rid'], c['info']) for c in old['children'] if 'info' in c)
+                for typ in types:
+                    for childrid in listing[typ]:
+                        if typ != 'client' and childrid in kept:
+                            info = dict(kept[childrid])
+                            info.pop('children', None)
+                            children.append((node, nodeauth, typ, childrid, info))
+                        else:
+                            children.append((node, nodeauth, typ, childrid, None))
+                            calls.append((node, nodeauth, ['info', childrid, options]))
+            responses = iter(zip(self._tree_calls(calls), calls))
 
-            gen = nextgen
             nextgen = []
-            level += 1
+            for node, nodeauth, typ, childrid, info in children:
+                try:
+                    if info is None:
+                        response, call = next(responses)
+                        info = check(response, call[2])
+                    child = {'rid': nodeidfn(childrid, info), 'info': info}
+                except Exception as ex:
+                    if raiseExceptions:
+                        raise
+                    child = {'exception': ex, 'auth': nodeauth, 'rid': childrid}
+                else:
+                    if level is None or depth < level:
+                        info['children'] = []
+                        if typ == 'client':
+                            nextgen.append((child, childrid,
+                                            {auth_type: auth_str, 'client_id': childrid}))
+                node['info']['children'].append(child)
+            for node, noderid, nodeauth in gen:
+                if 'info' in node:
+                    node['info']['children'].sort(key=lambda x: x['rid'] if 'rid' in x else '')
+            gen = nextgen
+            depth += 1
+
+        return root
 
-        return rootnode['tree']
+    def snapshot(self,
+                 auth,
+                 filename,
+                 full=False,
+                 nodeidfn=lambda rid,
+                 info: rid,
+                 errorfn=lambda auth, msg: None):
+        '''Get the infotree of auth with SNAPSHOT_INFO_OPTIONS and save it
+           to filename. If filename has an earlier snapshot of auth, info
+           that hasn't changed is taken from it (see _infotree_fast),
+           unless full is True. nodeidfn must return the RID. Returns the
+           tree and the earlier one, or None.'''
+        snapshot = InfotreeSnapshot(filename)
+        previous = snapshot.tree
+        if previous is not None:
+            rid = self._exomult(auth, [['lookup', 'aliased', '']])[0]
+            if rid != snapshot.rid:
+                raise ExoException(
+                    'Snapshot {0} is of {1}, not {2}'.format(filename, snapshot.rid, rid))
+            if full or snapshot.options != SNAPSHOT_INFO_OPTIONS:
+                previous = None
+        tree = self._infotree_fast(auth,
+                                   nodeidfn=nodeidfn,
+                                   options=SNAPSHOT_INFO_OPTIONS,
+                                   errorfn=errorfn,
+                                   previous=previous)
+        snapshot.save(tree['rid'], SNAPSHOT_INFO_OPTIONS, tree)
+        return tree, snapshot.tree
 
     def _infotree(self,
                   auth,
@@ -2547,14 +3760,10 @@ probably not valid.".format(auth_str))
                     errorfn(auth, str(e))
                 rids = [rid for rid in list(itertools.chain.from_iterable([listing[t] for t in types]))]
                 # break info calls into chunks to prevent timeout
-                chunksize = 20
-                def chunks(l, n):
-                    '''Yield successive n-sized chunks from l.'''
-                    for i in range(0, len(l), n):
-                        yield l[i:i+n]
-                infos = []
-                for ridchunk in chunks(rids, chunksize):
-                    infos += self._exomult(auth, [['info', rid, options] for rid in ridchunk])
+                infos = self._exomult_batched(
+                    auth,
+                    [['info', rid, options] for rid in rids],
+                    self._batchsize('info', 20))
             else:
                 listing = []
 
@@ -2640,8 +3849,8 @@ probably not valid.".format(auth_str))
                 # prepend the name so that node names tend to sort (and so
                 # compare well)
                 return info['description']['name'] + '.' + rid
-            info1 = self._infotree(cik1, nodeidfn=name_prepend, options={})
-            info2 = self._infotree(cik2, nodeidfn=name_prepend, options={})
+            info1 = self._infotree_fast(cik1, nodeidfn=name_prepend, options={})
+            info2 = self._infotree_fast(cik2, nodeidfn=name_prepend, options={})
 
         if info1 == info2:
             return None
@@ -2704,6 +3913,7 @@ class ExoData():
             raise ExoException(str(ex))
 
     def read(self, cik, aliases):
+        import requests
         headers = {'X-Exosite-CIK': cik,
                    'Accept': 'application/x-www-form-urlencoded; charset=utf-8'}
         url = self.url + '/onep:v1/stack/alias?' + '&'.join(aliases)
@@ -2712,6 +3922,7 @@ class ExoData():
         return r.text
 
     def write(self, cik, alias_values):
+        import requests
         headers = {'X-Exosite-CIK': cik,
                    'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
         url = self.url + '/onep:v1/stack/alias'
@@ -2720,6 +3931,7 @@ class ExoData():
         return r.text
 
     def writeread(self, cik, alias_values, aliases):
+        import requests
         headers = {'X-Exosite-CIK': cik,
                    'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8',
                    'Accept': 'application/x-www-form-urlencoded; charset=utf-8'}
@@ -2729,6 +3941,7 @@ class ExoData():
         return r.text
 
     def ip(self):
+        import requests
         r = requests.get(self.url + '/ip')
         r.raise_for_status()
         return r.text
@@ -2754,6 +3967,7 @@ class ExoPortals():
     def invalidate(self, data):
         # This API is documented here:
         # https://i.exosite.com/display/DEVPORTALS/Portals+Cache+Invalidation+API
+        import requests
         data = json.dumps(data)
         #print('invalidating with ' + data)
         try:
@@ -2768,10 +3982,106 @@ class ExoPortals():
 
 
 class ExoUtilities():
+    regex_int = re.compile('^[-+]?[0-9]+$')
+    # ISO 8601 and YYYY-MM-DD HH:MM[:SS], with optional fractional
+    # seconds (ignored) and UTC offset, as read --timeformat=iso8601 and
+    # human write them
+    regex_iso = re.compile(
+        r'^(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d?):(\d\d)(?::(\d\d)(?:\.\d+)?)?'
+        r'(?:(Z)|([-+])(\d\d)(?::?(\d\d))?)?)?$')
+    # %m/%d/%y %H:%M:%S, as read --timeformat=excel writes it
+    regex_excel = re.compile(
+        r'^(\d\d?)/(\d\d?)/(\d\d|\d{4})(?: (\d\d?):(\d\d)(?::(\d\d))?)?$')
+    # UTC timestamp of the start of an hour of local time -> local UTC
+    # offset in seconds
+    _local_offsets = {}
+    _epoch_ordinal = date(1970, 1, 1).toordinal()
+    _this_year = None
+
+    @classmethod
+    def parse_timestamp(cls, s):
+        '''Parse a timestamp that's usually a unix timestamp, and only
+           use parse_ts if it's not.'''
+        if s is not None and cls.regex_int.match(s) is not None:
+            return int(s)
+        return cls.parse_ts(s)
 
     @classmethod
     def parse_ts(cls, s):
-        return None if s is None else ExoUtilities.parse_ts_tuple(parser.parse(s).timetuple())
+        '''Parse a date and time as a unix timestamp. Times without a
+           UTC offset are in local time.'''
+        if s is None:
+            return None
+        ts = cls._parse_ts_fast(s.strip())
+        if ts is not None:
+            return ts
+        from dateutil import parser
+        dt = parser.parse(s)
+        if dt.utcoffset() is not None:
+            return calendar.timegm(dt.utctimetuple())
+        return ExoUtilities.parse_ts_tuple(dt.timetuple())
+
+    @classmethod
+    def _parse_ts_fast(cls, s):
+        '''Parse the layouts Exoline writes without dateutil. Returns
+           None for anything else, including invalid dates.'''
+        m = cls.regex_iso.match(s)
+        if m is not None:
+            year, month, day, hour, minute, sec, z, sign, tzh, tzm = m.groups()
+        else:
+            m = cls.regex_excel.match(s)
+            if m is None:
+                return None
+            month, day, year, hour, minute, sec = m.groups()
+            z = sign = None
+            if len(year) == 2:
+                year = cls._expand_year(int(year))
+        try:
+            days = date(int(year), int(month), int(day)).toordinal() - cls._epoch_ordinal
+        except ValueError:
+            return None
+        hour, minute, sec = int(hour or 0), int(minute or 0), int(sec or 0)
+        if hour > 23 or minute > 59 or sec > 59:
+            return None
+        t = days * 86400 + hour * 3600 + minute * 60 + sec
+        if z is not None:
+            return t
+        if sign is not None:
+            offset = int(tzh) * 3600 + int(tzm or 0) * 60
+            return t - offset if sign == '+' else t + offset
+        return t - cls._local_offset(t)
+
+    @classmethod
+    def _local_offset(cls, t):
+        '''Returns the local UTC offset at local time t (in seconds
+           since the epoch, as if local time were UTC), remembering it
+           for t's hour unless the offset changes during the hour.'''
+        hour = t - t % 3600
+        offset = cls._local_offsets.get(hour)
+        if offset is None:
+            offset = cls._mktime_offset(hour)
+            if cls._mktime_offset(hour + 3599) != offset:
+                return cls._mktime_offset(t)
+            cls._local_offsets[hour] = offset
+        return offset
+
+    @classmethod
+    def _mktime_offset(cls, t):
+        return t - cls.parse_ts_tuple(time.gmtime(t)[:8] + (-1,))
+
+    @classmethod
+    def _expand_year(cls, year):
+        '''Expand a two digit year to within 50 years of now, like
+           dateutil'''
+        now = cls._this_year
+        if now is None:
+            now = cls._this_year = datetime.now().year
+        year += now // 100 * 100
+        if year >= now + 50:
+            year -= 100
+        elif year < now - 50:
+            year += 100
+        return year
 
     @classmethod
     def parse_ts_tuple(cls, t):
@@ -3026,11 +4336,35 @@ def read_cmd(er, auth, rids, args):
         'tz': tz
     }
 
-    lw = serieswriter.SeriesWriter(headers, options)
-    if headertype is not None:
-        # write headers
-        lw.write_headers()
+    if fmt in columnwriter.FORMATS:
+        if args['--outfile'] is None:
+            raise ExoException('--format={0} requires --outfile'.format(fmt))
+        if args['--follow']:
+            raise ExoException('--follow does not support --format={0}'.format(fmt))
+        if headertype != 'name':
+            infos = er._exomult(auth,
+                                [['info', r, {'description': True}] for r in rids])
+        lw = columnwriter.ColumnWriter(args['--outfile'],
+                                       headers,
+                                       [i['description'].get('format') for i in infos],
+                                       fmt)
+    else:
+        if args['--outfile'] is not None:
+            raise ExoException('--outfile is for parquet, arrow and npz formats')
+        lw = serieswriter.SeriesWriter(headers, options)
+        if headertype is not None:
+            # write headers
+            lw.write_headers()
+
+    try:
+        _read_write(er, auth, rids, args, lw, start, end, limit)
+    finally:
+        if fmt in columnwriter.FORMATS:
+            lw.close()
 
+
+def _read_write(er, auth, rids, args, lw, start, end, limit):
+    '''Read data for read_cmd and write it with lw'''
     timeout_milliseconds = 3000
     if args['--follow']:
         if len(rids) > 1:
@@ -3048,16 +4382,300 @@ def read_cmd(er, auth, rids, args):
                 lw.write(ts, v)
     else:
         chunksize = int(args['--chunksize'])
-        result = er.readmult(auth,
-                             rids,
-                             sort=args['--sort'],
-                             starttime=start,
-                             endtime=end,
-                             limit=limit,
-                             selection=args['--selection'],
-                             chunksize=chunksize)
-        for t, v in result:
-            lw.write(t, v)
+        use_cache = False
+        if not args['--no-cache']:
+            setting = os.getenv('EXO_CACHE', exoconfig.config.get('cache', False))
+            use_cache = args['--cache'] or str(setting).lower() in ['1', 'true', 'yes']
+        cache_size = os.getenv('EXO_CACHE_SIZE', exoconfig.config.get('cache_size', None))
+        if cache_size is None:
+            cache_size = seriescache.DEFAULT_MAX_BYTES
+        else:
+            # in megabytes
+            cache_size = int(float(cache_size) * 1024 * 1024)
+        ranges = args['--parallel-ranges']
+        ranges = 1 if ranges is None else int(ranges)
+        if ranges < 1:
+            raise ExoException('--parallel-ranges must be a positive integer')
+        cache = None
+        if use_cache and args['--selection'] == 'all' and ranges == 1:
+            cache = seriescache.SeriesCache(maxbytes=cache_size)
+            result = er.readmult_cached(cache,
+                                        auth,
+                                        rids,
+                                        sort=args['--sort'],
+                                        starttime=start,
+                                        endtime=end,
+                                        limit=limit,
+                                        chunksize=chunksize)
+        elif ranges > 1:
+            result = er.readmult_ranges(auth,
+                                        rids,
+                                        sort=args['--sort'],
+                                        starttime=start,
+                                        endtime=end,
+                                        limit=limit,
+                                        selection=args['--selection'],
+                                        chunksize=chunksize,
+                                        ranges=ranges,
+                                        balance=args['--balance-ranges'])
+        else:
+            result = er.readmult(auth,
+                                 rids,
+                                 sort=args['--sort'],
+                                 starttime=start,
+                                 endtime=end,
+                                 limit=limit,
+                                 selection=args['--selection'],
+                                 chunksize=chunksize)
+        try:
+            # write rows in chunks, so timestamps can be formatted
+            # together
+            result = iter(result)
+            while True:
+                rows = list(itertools.islice(result, READ_WRITE_ROWS))
+                if len(rows) == 0:
+                    break
+                lw.write_many([t for t, v in rows],
+                              [list(c) for c in zip(*[v for t, v in rows])])
+        finally:
+            if cache is not None:
+                cache.close()
+
+
+def csv_reader(infile):
+    '''Returns a reader for the CSV rows in infile'''
+    if sys.version_info < (3, 0):
+        return csv.reader(infile, encoding='utf-8')
+    else:
+        return csv.reader(infile)
+
+
+class OffsetLines():
+    '''Iterates over the lines of a file, counting the bytes read. A
+    csv reader reads only the lines it needs for each row, so after each
+    row offset is where the next row starts.'''
+
+    def __init__(self, infile, offset=0):
+        '''infile - file to read lines from, starting at offset'''
+        self.infile = infile
+        self.offset = 0
+        if offset > 0:
+            try:
+                infile.seek(offset)
+                self.offset = offset
+            except (AttributeError, IOError, OSError, ValueError):
+                # a pipe
+                for line in self:
+                    if self.offset >= offset:
+                        break
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.infile.readline()
+        if not line:
+            raise StopIteration
+        if isinstance(line, six.binary_type):
+            self.offset += len(line)
+            if six.PY3:
+                line = line.decode('utf-8')
+        else:
+            self.offset += len(line.encode('utf-8'))
+        return line
+
+    next = __next__
+
+
+class RecordCheckpoint():
+    '''Remembers how many bytes of record's input have been recorded,
+    in a JSON file.'''
+
+    def __init__(self, filename, rids):
+        self.filename = os.path.expanduser(filename)
+        self.rids = rids
+        self.offset = 0
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    saved = json.load(f)
+                self.offset = int(saved['offset'])
+            except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+                raise ExoException('Unable to read checkpoint {0}: {1}'.format(filename, ex))
+            if saved.get('rids') != json.loads(json.dumps(rids)):
+                raise ExoException(
+                    'Checkpoint {0} is for recording to {1}'.format(filename, saved.get('rids')))
+
+    def save(self, offset):
+        self.offset = offset
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'offset': offset, 'rids': self.rids}, f)
+        if platform.system() == 'Windows' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp, self.filename)
+
+
+class InfotreeSnapshot():
+    '''An infotree saved in a JSON file by the snapshot command, with the
+    RID of its root and the info options it has.'''
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self.rid = None
+        self.options = None
+        self.tree = None
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as f:
+                    saved = json.load(f)
+                self.rid = saved['rid']
+                self.options = saved['options']
+                self.tree = saved['tree']
+            except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+                raise ExoException('Unable to read snapshot {0}: {1}'.format(filename, ex))
+
+    def save(self, rid, options, tree):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'rid': rid, 'options': options, 'timestamp': int(time.time()),
+                       'tree': tree}, f)
+        if platform.system() == 'Windows' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp, self.filename)
+
+    @staticmethod
+    def changes(previous, tree):
+        '''Returns the number of resources in tree that aren't in previous,
+        that are only in previous, and whose info is different'''
+        def infos(tree):
+            r = {}
+            stack = [tree]
+            while len(stack) > 0:
+                node = stack.pop()
+                info = dict(node['info'])
+                stack.extend(info.pop('children', []))
+                r[node['rid']] = info
+            return r
+        before = infos(previous)
+        after = infos(tree)
+        return (len([rid for rid in after if rid not in before]),
+                len([rid for rid in before if rid not in after]),
+                len([rid for rid in after if rid in before and after[rid] != before[rid]]))
+
+
+def record_csv(er, auth, rids, infile, chunksize, checkpoint=None):
+    '''Record rows of timestamp and a value for each of rids from CSV
+    file infile. Rows are read one at a time, and points are recorded
+    as soon as there are enough for a request (starting at chunksize and
+    adapting to how long requests take), so memory use doesn't grow
+    with the size of infile. Each request records to all of the rids.
+
+    Up to er.parallel requests are sent at once. If checkpoint (a
+    RecordCheckpoint) is passed, recording starts at its offset into
+    infile, and the offset is saved as each request, and every one
+    before it, completes.'''
+    # sized in points, starting at chunksize rows
+    size = chunksize * max(1, len(rids))
+    recordsize = er._batchsize('record', size, maxsize=max(size, RECORD_MAX_POINTS))
+
+    def send(points):
+        er._with_retries(lambda: er.record_multiple(auth, rids, points, recordsize))
+
+    if er.parallel > 1 and er._pool is None:
+        from multiprocessing.pool import ThreadPool
+        er._pool = ThreadPool(er.parallel)
+    # (offset after chunk, job) for requests in flight, oldest first
+    pending = collections.deque()
+
+    def finish_oldest():
+        offset, job = pending.popleft()
+        if job is not None:
+            job.get()
+        if checkpoint is not None:
+            checkpoint.save(offset)
+
+    def record(points, offset):
+        if er.parallel > 1:
+            pending.append((offset, er._pool.apply_async(send, (points,))))
+        else:
+            send(points)
+            pending.append((offset, None))
+        while len(pending) >= er.parallel:
+            finish_oldest()
+
+    lines = OffsetLines(infile, 0 if checkpoint is None else checkpoint.offset)
+    # (index into rids, point) in the order read
+    points = []
+    parse = ExoUtilities.parse_timestamp
+    try:
+        for row in csv_reader(lines):
+            if len(row) == 0:
+                continue
+            ts = parse(row[0])
+            # TODO: How to deal with an empty cell should be a cmdline option.
+            # skip it, or record a default number or empty string?
+            for idx, value in enumerate(row[1:len(rids) + 1]):
+                points.append((idx, [ts, value]))
+            if len(points) >= recordsize.size:
+                record(points, lines.offset)
+                points = []
+        if len(points) > 0:
+            record(points, lines.offset)
+        while len(pending) > 0:
+            finish_oldest()
+    finally:
+        # wait for requests in flight, without saving their offsets
+        # after an error
+        for offset, job in pending:
+            if job is not None:
+                job.wait()
+
+
+def record_cmd(er, auth, rids, args):
+    '''Record command'''
+    interval = args['--interval']
+    if interval is None:
+        # split timestamp, value
+        if not args['--value']:
+            checkpoint = None
+            if args['--checkpoint'] is not None:
+                checkpoint = RecordCheckpoint(args['--checkpoint'], rids)
+            # bytes, so offsets in the checkpoint are exact
+            infile = getattr(sys.stdin, 'buffer', sys.stdin)
+            record_csv(er, auth, rids, infile, int(args['--chunksize']), checkpoint)
+        else:
+            entries = []
+            has_errors = False
+            tvalues = args['--value']
+            reentry = re.compile('(-?\d+),(.*)')
+            for tv in tvalues:
+                match = reentry.match(tv)
+                if match is None:
+                    try:
+                        t, v = tv.split(',')
+                        entries.append([ExoUtilities.parse_timestamp(t), v])
+                    except Exception:
+                        sys.stderr.write(
+                            'Line not in <timestamp>,<value> format: {0}'.format(tv))
+                        has_errors = True
+                else:
+                    g = match.groups()
+                    entries.append([ExoUtilities.parse_timestamp(g[0]), g[1]])
+
+            if has_errors or len(entries) == 0:
+                raise ExoException("Problems with input.")
+            else:
+                er.record(auth, rids[0], entries)
+    else:
+        if args['-']:
+            values = [v.strip() for v in sys.stdin.readlines()]
+        else:
+            values = args['--value']
+        interval = int(interval)
+        if interval <= 0:
+            raise ExoException("--interval must be positive")
+        er.record_backdate(auth, rids[0], interval, values)
 
 
 def plain_print(arg):
@@ -3080,14 +4698,35 @@ def handle_args(cmd, args):
     if port is None:
         port = DEFAULT_PORT_HTTPS if use_https else DEFAULT_PORT
 
-    er = ExoRPC(
-        host=args['--host'],
-        port=port,
-        https=use_https,
-        httptimeout=args['--httptimeout'],
-        logrequests=args['--clearcache'],
-        user_agent=args['--useragent'],
-        curldebug=args['--curl'])
+    rpc_options = {
+        'host': args['--host'],
+        'port': port,
+        'https': use_https,
+        'httptimeout': args['--httptimeout'],
+        'logrequests': args['--clearcache'],
+        'user_agent': args['--useragent'],
+        'curldebug': args['--curl'],
+        'parallel': args['--parallel'],
+        'infocache': args['--infocache'],
+        'infocachefile': args['--infocachefile'],
+        'recordrpc': args['--recordrpc'],
+        'replayrpc': args['--replayrpc']}
+    # exo daemon reuses connections between commands, except where
+    # requests are logged for --clearcache
+    keep_rpc = daemon_rpcs is not None and not args['--clearcache']
+    if keep_rpc:
+        rpc_key = json.dumps(rpc_options, sort_keys=True)
+        if rpc_key not in daemon_rpcs:
+            daemon_rpcs[rpc_key] = ExoRPC(**rpc_options)
+        er = daemon_rpcs[rpc_key]
+        # cached responses are only kept between commands with
+        # --infocachefile, the same as without the daemon
+        if er.rpccache is not None:
+            er.rpccache.clear()
+            if er.rpccache.filename is not None:
+                er.rpccache.load()
+    else:
+        er = ExoRPC(**rpc_options)
 
     pop = provision.Provision(
         host=args['--host'],
@@ -3170,82 +4809,7 @@ def handle_args(cmd, args):
             else:
                 er.write(auth, rids[0], args['--value'])
         elif cmd == 'record':
-            interval = args['--interval']
-            if interval is None:
-                # split timestamp, value
-                if not args['--value']:
-                    headers = ['timestamp'] + [x for x in range(0,len(rids))]
-                    if sys.version_info < (3, 0):
-                        dr = csv.DictReader(sys.stdin, headers, encoding='utf-8')
-                    else:
-                        dr = csv.DictReader(sys.stdin, headers)
-                    rows = list(dr)
-                    chunkcnt=0
-                    entries=[[] for x in range(0,len(rids))]
-                    for row in rows:
-                        s = row['timestamp']
-                        if s is not None and re.match('^[-+]?[0-9]+$', s) is not None:
-                            ts = int(s)
-                        else:
-                            ts = ExoUtilities.parse_ts(s)
-                        for column in range(0,len(rids)):
-                            value = row[column]
-                            # TODO: How to deal with an empty cell should be a cmdline option.
-                            # skip it, or record a default number or empty string?
-                            if value is not None:
-                                entries[column].append([ts, value])
-                        chunkcnt += 1
-                        if chunkcnt > int(args['--chunksize']):
-                            for idx in range(0,len(rids)):
-                                er.record(auth, rids[idx], entries[idx])
-                            chunkcnt = 0
-                            entries=[[] for x in range(0,len(rids))]
-
-                    for idx in range(0,len(rids)):
-                        if len(entries[idx]) > 0:
-                            er.record(auth, rids[idx], entries[idx])
-
-                else:
-                    entries = []
-                    has_errors = False
-                    tvalues = args['--value']
-                    reentry = re.compile('(-?\d+),(.*)')
-                    for tv in tvalues:
-                        match = reentry.match(tv)
-                        if match is None:
-                            try:
-                                t, v = tv.split(',')
-                                if t is not None and re.match('^[-+]?[0-9]+$', t) is not None:
-                                    ts = int(t)
-                                else:
-                                    ts = ExoUtilities.parse_ts(t)
-                                entries.append([ts, v])
-                            except Exception:
-                                sys.stderr.write(
-                                    'Line not in <timestamp>,<value> format: {0}'.format(tv))
-                                has_errors = True
-                        else:
-                            g = match.groups()
-                            s = g[0]
-                            if s is not None and re.match('^[-+]?[0-9]+$', s) is not None:
-                                ts = int(s)
-                            else:
-                                ts = ExoUtilities.parse_ts(s)
-                            entries.append([ts, g[1]])
-
-                    if has_errors or len(entries) == 0:
-                        raise ExoException("Problems with input.")
-                    else:
-                        er.record(auth, rids[0], entries)
-            else:
-                if args['-']:
-                    values = [v.strip() for v in sys.stdin.readlines()]
-                else:
-                    values = args['--value']
-                interval = int(interval)
-                if interval <= 0:
-                    raise ExoException("--interval must be positive")
-                er.record_backdate(auth, rids[0], interval, values)
+            record_cmd(er, auth, rids, args)
         elif cmd == 'create':
             typ = args['--type']
             ridonly = args['--ridonly']
@@ -3438,6 +5002,19 @@ def handle_args(cmd, args):
                             nochildren=args['--no-children'])
             if diffs is not None:
                 print(diffs)
+        elif cmd == 'snapshot':
+            tree, previous = er.snapshot(auth, args['<file>'], full=args['--full'])
+            count = sum(er._counttypes(tree, counts=defaultdict(int)).values())
+            if previous is None:
+                print('Saved {0} resources to {1}'.format(count, args['<file>']))
+            else:
+                print('Saved {0} resources to {1}: {2} added, {3} removed, {4} changed'.format(
+                    count, args['<file>'], *InfotreeSnapshot.changes(previous, tree)))
+        elif cmd == 'daemon':
+            path = args['--socket']
+            if path is None:
+                path = os.environ.get('EXO_DAEMON_SOCKET', exodaemon.DEFAULT_SOCKET)
+            serve_daemon(path)
         elif cmd == 'ip':
             pr(ed.ip())
         elif cmd == 'data':
@@ -3548,35 +5125,38 @@ def handle_args(cmd, args):
             # search plugins
             handled = False
             exitcode = 1
-            for plugin in plugins:
-                if cmd in plugin.command():
-                    options = {
-                            'auth': auth,
-                            'rids': rids,
-                            'rpc': er,
-                            'provision': pop,
-                            'exception': ExoException,
-                            'provision-exception': pyonep.exceptions.ProvisionException,
-                            'utils': ExoUtilities,
-                            'config': exoconfig
-                            }
-                    try:
-                        options['data'] = ed
-                    except NameError:
-                        # no problem
-                        pass
-
-                    if cmd == "switches":
-                        options['doc'] = cmd_doc
-                    exitcode = plugin.run(cmd, args, options)
-                    handled = True
-                    break
+            plugin = find_plugin(cmd)
+            if plugin is not None:
+                options = {
+                        'auth': auth,
+                        'rids': rids,
+                        'rpc': er,
+                        'provision': pop,
+                        'exception': ExoException,
+                        'provision-exception': pyonep.exceptions.ProvisionException,
+                        'utils': ExoUtilities,
+                        'config': exoconfig
+                        }
+                try:
+                    options['data'] = ed
+                except NameError:
+                    # no problem
+                    pass
+
+                if cmd == "switches":
+                    options['doc'] = cmd_doc
+                exitcode = plugin.run(cmd, args, options)
+                handled = True
             if not handled:
                 raise ExoException("Command not handled")
             return exitcode
     finally:
+        if keep_rpc:
+            er.save()
+        else:
+            er.close()
         if args['--clearcache']:
-            for req in er.exo.loggedrequests():
+            for req in er.loggedrequests():
                 procs = [c['procedure'] for c in req['calls']]
                 # if operation will invalidate the Portals cache...
                 if len([p for p in procs if p in ExoPortals.writeprocs]) > 0:
@@ -3617,6 +5197,12 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
     if stdout is not None:
         sys.stdout = stdout
 
+    # exo --help lists plugin commands, so load them if it may be asked
+    # for. Anything else that looks like it has -h loads them, too.
+    if len([a for a in sys.argv[1:] if isinstance(a, six.string_types) and
+            (re.match('^-[^-]*h', a) or (len(a) > 3 and '--help'.startswith(a)))]) > 0:
+        load_plugins()
+
     # add the first line of the detailed documentation to
     # the exo --help output. Some lines span newlines.
     max_cmd_length = max(len(cmd) for cmd in cmd_doc)
@@ -3645,6 +5231,8 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
     # get command args
     cmd = args['<command>']
     argv = [cmd] + args['<args>']
+    if cmd not in cmd_doc:
+        load_plugins()
     if cmd in cmd_doc:
         # if doc expects yet another command, pass options_first=True
         options_first = True if re.search(
@@ -3675,8 +5263,11 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
             alt_msg = 'Did you mean {0}? '.format(' or '.join(alts))
         print('Unknown command {0}. {1}Try "exo --help"'.format(cmd, alt_msg))
         return 1
-    # merge command-specific arguments into general arguments
-    args.update(args_cmd)
+    # merge command-specific arguments into general arguments. Options
+    # that are also general options (e.g. record --parallel) only
+    # override them if they're passed.
+    args.update(dict([(k, v) for k, v in args_cmd.items()
+                      if not (v is None and k in args)]))
     # turn on stdout/stderr filtering
     if args['--discreet']:
         sys.stdout = DiscreetFilter(sys.stdout)
@@ -3696,6 +5287,9 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
         args['--port'] = os.environ.get('EXO_PORT', None)
 
     exoconfig.mingleArguments(args)
+    perf = None
+    if args['--perf'] or args['--perf-out'] is not None:
+        perf = PerfReport(cmd)
     try:
         exitcode = handle_args(cmd, args)
         if exitcode is None:
@@ -3734,10 +5328,68 @@ def cmd(argv=None, stdin=None, stdout=None, stderr=None):
     except KeyboardInterrupt:
         if args['--debug']:
             raise
+    finally:
+        if perf is not None:
+            perf.finish(show=args['--perf'], filename=args['--perf-out'])
 
     return 0
 
 
+def serve_daemon(path, stop=None):
+    '''Run commands sent to the Unix socket at path until interrupted, or
+       until stop (a threading.Event) is set'''
+    global daemon_rpcs
+    if daemon_rpcs is not None:
+        raise ExoException('exo daemon is already running in this process')
+    if not hasattr(exodaemon.socket, 'AF_UNIX'):
+        raise ExoException('exo daemon needs Unix sockets, which are not available on this platform')
+    daemon_rpcs = {}
+    # plugins are those found when the daemon starts
+    load_plugins()
+    try:
+        exodaemon.serve(path, run_forwarded, stop)
+    finally:
+        for er in daemon_rpcs.values():
+            er.close()
+        daemon_rpcs = None
+
+
+def run_forwarded(request, stdout, stderr):
+    '''Run a command sent to exo daemon in the sender's working
+    directory and with its EXO_* environment variables. Returns
+    the exit code.'''
+    old = {'argv': sys.argv, 'stdin': sys.stdin, 'stdout': sys.stdout,
+           'stderr': sys.stderr, 'cwd': os.getcwd(),
+           'environ': dict(os.environ)}
+    try:
+        os.chdir(request['cwd'])
+        # requests are decoded JSON, so strings are unicode. Python 2
+        # wants native str for argv (docopt) and the environment.
+        native = (lambda s: s) if six.PY3 else (
+            lambda s: s.encode('utf-8') if isinstance(s, six.text_type) else s)
+        for name in [k for k in os.environ if k.startswith('EXO_')]:
+            del os.environ[name]
+        os.environ.update([(native(k), native(v)) for k, v in iteritems(request['env'])])
+        dotpath = os.path.join(request['cwd'], '.env')
+        if os.path.exists(dotpath):
+            os.environ.update(Dotenv(dotpath))
+        stdin = StringIO()
+        stdin.write(native(request['stdin']))
+        stdin.seek(0)
+        return cmd(argv=[native(a) for a in request['argv']], stdin=stdin, stdout=stdout, stderr=stderr)
+    finally:
+        # the daemon runs until interrupted, so don't keep requests
+        # (and their auths) once the command's --perf report is done
+        del PERF_DATA[:]
+        os.chdir(old['cwd'])
+        os.environ.clear()
+        os.environ.update(old['environ'])
+        sys.argv = old['argv']
+        sys.stdin = old['stdin']
+        sys.stdout = old['stdout']
+        sys.stderr = old['stderr']
+
+
 class CmdResult():
     def __init__(self, exitcode, stdout, stderr):
         self.exitcode = exitcode
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''Run exo commands in a long running process (exo daemon), and send
+commands to it from exo. This module only uses the standard library, so
+that exo can import it and hand off a command before doing its own,
+slower, imports.
+
+Messages are JSON objects, each preceded by its length as a 4 byte big
+endian integer. The client sends one request:
+    {"argv": [...], "stdin": "...", "cwd": "...", "env": {"EXO_...": ...}}
+and the daemon sends output as it is written:
+    {"stdout": "..."} or {"stderr": "..."}
+followed by the command's exit code:
+    {"exitcode": 0}
+'''
+from __future__ import unicode_literals
+import os
+import sys
+import json
+import socket
+import struct
+import traceback
+
+DEFAULT_SOCKET = '~/.exoline.sock'
+
+# output is sent to the client in pieces of about this many characters
+WRITE_BUFFER = 4096
+
+# seconds between checks for a request to stop serving
+STOP_POLL = 0.2
+
+
+def send(conn, message):
+    data = json.dumps(message).encode('utf-8')
+    conn.sendall(struct.pack('>I', len(data)) + data)
+
+
+def _recvall(conn, size):
+    chunks = []
+    while size > 0:
+        chunk = conn.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv(conn):
+    size = struct.unpack('>I', _recvall(conn, 4))[0]
+    return json.loads(_recvall(conn, size).decode('utf-8'))
+
+
+class MessageWriter:
+    '''File-like object that sends what is written to it to a client
+    as {name: text} messages'''
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.buf = []
+        self.size = 0
+
+    def write(self, s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= WRITE_BUFFER:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self.size > 0:
+            text = ''.join(self.buf)
+            self.buf = []
+            self.size = 0
+            send(self.conn, {self.name: text})
+
+    def isatty(self):
+        return False
+
+
+def serve(path, run, stop=None):
+    '''Run commands sent by clients to the Unix socket at path, one at a
+       time. run(request, stdout, stderr) runs a command and returns its
+       exit code. Runs until interrupted, or until stop (a
+       threading.Event) is set.'''
+    path = os.path.expanduser(path)
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user may connect
+    oldmask = os.umask(0o077)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(oldmask)
+    sock.listen(16)
+    if stop is not None:
+        # wake up now and then to check for stop
+        sock.settimeout(STOP_POLL)
+    try:
+        while stop is None or not stop.is_set():
+            try:
+                conn, address = sock.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            try:
+                request = recv(conn)
+                stdout = MessageWriter(conn, 'stdout')
+                stderr = MessageWriter(conn, 'stderr')
+                try:
+                    exitcode = run(request, stdout, stderr)
+                except Exception:
+                    stderr.write(traceback.format_exc())
+                    exitcode = 1
+                stdout.flush()
+                stderr.flush()
+                send(conn, {'exitcode': exitcode})
+            except (socket.error, EOFError, ValueError):
+                # client went away
+                pass
+            finally:
+                conn.close()
+    finally:
+        sock.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def reads_stdin(argv):
+    '''Returns True if the command in argv reads stdin. That is update,
+       and commands passed - (or --file=-) to read a value, description
+       or file from stdin.'''
+    return ('update' in argv[1:] or
+            len([a for a in argv[1:] if a == '-' or a.endswith('=-')]) > 0)
+
+
+def streams_stdin(argv):
+    '''Returns True for record commands that read CSV from stdin as it
+       arrives (record without --value)'''
+    return 'record' in argv[1:] and len([a for a in argv if a.startswith('--value')]) == 0
+
+
+def forward(path, argv, stdin=None, stdout=None, stderr=None):
+    '''Send a command to the daemon listening at path, and write its
+       output. Returns the command's exit code, or None if the command
+       should run locally instead, because no daemon is listening or the
+       command doesn't suit the daemon.'''
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+
+    # daemon itself, commands that run until interrupted and commands
+    # that stream stdin stay local
+    if ('daemon' in argv[1:] or len([a for a in argv if a.startswith('--follow')]) > 0 or
+            streams_stdin(argv)):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(os.path.expanduser(path))
+    except socket.error:
+        conn.close()
+        return None
+
+    try:
+        # stdin is only read for commands that use it, so it's left alone
+        # for, e.g., the rest of a while read loop
+        data = stdin.read() if reads_stdin(argv) else ''
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        send(conn, {'argv': [a if not isinstance(a, bytes) else a.decode('utf-8') for a in argv],
+                    'stdin': data,
+                    'cwd': os.getcwd(),
+                    'env': dict([(k, v) for k, v in os.environ.items() if k.startswith('EXO_')])})
+        while True:
+            message = recv(conn)
+            if 'exitcode' in message:
+                return message['exitcode']
+            for name, out in [('stdout', stdout), ('stderr', stderr)]:
+                if name in message:
+                    text = message[name]
+                    if sys.version_info < (3, 0):
+                        text = text.encode('utf-8')
+                    out.write(text)
+                    out.flush()
+    except (socket.error, EOFError, ValueError) as ex:
+        stderr.write('Lost connection to exo daemon: {0}\n'.format(ex))
+        return 1
+    finally:
+        conn.close()
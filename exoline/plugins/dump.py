@@ -5,7 +5,12 @@ Usage:
     exo [options] dump <auth> <filename>
 
 Command Options:
-    --silent  Don't show search progress
+    --silent                 Don't show search progress
+    --parallel-ranges=<n>    Read each dataport's history as <n> time windows,
+                             up to --parallel at the same time
+    --snapshot=<file>        Get infotree.json from a snapshot saved in <file>,
+                             bringing it up to date first (see exo snapshot
+                             --help)
 
 Output file is a zip with this structure:
     dump.json
@@ -47,6 +52,9 @@ class Plugin():
             return rid
 
         MAX_POINTS = 100000000
+        ranges = 1 if args['--parallel-ranges'] is None else int(args['--parallel-ranges'])
+        if ranges < 1:
+            raise ExoException('--parallel-ranges must be a positive integer')
         progress = {
             'current': 0
         }
@@ -64,14 +72,24 @@ class Plugin():
                 progress['current'] += 1
                 sys.stderr.write('\r{0}.json'.format(resource['rid']))
                 sys.stderr.flush()
-                data = rpc.readmult(
-                    auth,
-                    [resource['rid']],
-                    MAX_POINTS,
-                    sort='asc',
-                    starttime=None,
-                    endtime=nowts,
-                    progress=lambda count: seriesprogress(resource['rid'], count))
+                if ranges > 1:
+                    data = rpc.readmult_ranges(
+                        auth,
+                        [resource['rid']],
+                        MAX_POINTS,
+                        sort='asc',
+                        starttime=None,
+                        endtime=nowts,
+                        ranges=ranges)
+                else:
+                    data = rpc.readmult(
+                        auth,
+                        [resource['rid']],
+                        MAX_POINTS,
+                        sort='asc',
+                        starttime=None,
+                        endtime=nowts,
+                        progress=lambda count: seriesprogress(resource['rid'], count))
                 # pull out just data for this resource
                 ts = [[d[0], d[1][0]] for d in data]
                 if len(ts) == MAX_POINTS:
@@ -99,13 +117,20 @@ class Plugin():
                 'msg': msg
             })
             sys.stderr.write("\nERROR: {0} {1}\n".format(msg, auth))
-        tree = rpc._infotree(
-            auth,
-            options={"description": True, "key": True, "basic": True, "aliases": True},
-            nodeidfn=treeprogress if not args['--silent'] else lambda rid, info: rid,
-            level=None,
-            raiseExceptions=True,
-            errorfn=errorfn)
+        if args['--snapshot'] is not None:
+            tree, previous = rpc.snapshot(
+                auth,
+                args['--snapshot'],
+                nodeidfn=treeprogress if not args['--silent'] else lambda rid, info: rid,
+                errorfn=errorfn)
+        else:
+            tree = rpc._infotree_fast(
+                auth,
+                options={"description": True, "key": True, "basic": True, "aliases": True},
+                nodeidfn=treeprogress if not args['--silent'] else lambda rid, info: rid,
+                level=None,
+                raiseExceptions=True,
+                errorfn=errorfn)
         sys.stderr.write('\n')
 
         zf = zipfile.ZipFile(args['<filename>'], 'w', compression=zipfile.ZIP_DEFLATED)
@@ -83,7 +83,7 @@ class Plugin():
 
         # This craps out too easily.
         # TODO: Need to switch to using the nodeidfn
-        tree = rpc._infotree(auth, level=level)
+        tree = rpc._infotree_fast(auth, level=level)
         # TODO: this looks suspect in the cik -> auth naming change
         # Should there be a check that auth is a string?
         tree['info']['key'] = auth
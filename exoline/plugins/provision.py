@@ -10,6 +10,7 @@ import fnmatch
 import six
 if six.PY3:
 	import urllib.parse as urlparse
+	import urllib.request
 	pathname2url = urllib.request.pathname2url
 	unquote = urllib.parse.unquote
 else:
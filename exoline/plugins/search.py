@@ -5,10 +5,15 @@ Usage:
     exo [options] search <auth> <query-regex>
 
 Command Options:
-    --matchcase   Match case when searching
-    --nocolor     Turn off output color (implicit in Windows
-                  and Python < 2.7)
-    --silent      Don't show search progress
+    --matchcase        Match case when searching
+    --nocolor          Turn off output color (implicit in Windows
+                       and Python < 2.7)
+    --silent           Don't show search progress
+    --snapshot=<file>  Search a snapshot saved in <file> (see exo snapshot
+                       --help), using an index of it saved in <file>.index.
+                       They're created if they don't exist. Otherwise
+                       nothing is requested unless --refresh is passed.
+    --refresh          Bring the --snapshot up to date before searching
 '''
 from __future__ import unicode_literals
 import os
@@ -36,114 +41,217 @@ class Plugin():
             sys.stderr.flush()
             return rid
 
-        reflags = re.IGNORECASE if args['--matchcase'] else 0
-        def searchnodes(node, path, aliases):
-            if platform.system() == 'Windows' or sys.version_info < (2, 7):
-                args['--nocolor'] = True
-            query = args['<query-regex>']
-            matches = False
-
-            name = node['info']['description']['name']
-            matchColor = '\033[32m'
-            resetColor = '\033[0m'
-
-            # search name
-            if (re.search(query, name, flags=reflags)):
-                if not args['--nocolor']:
-                    name = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, name, flags=reflags)
-                matches = True
-
-            # search alias
-            alias = aliases[0] if len(aliases) > 0 else None
-            for i in range(len(aliases)):
-                if re.search(query, aliases[i], flags=reflags):
-                    alias = aliases[i]
-                    if not args['--nocolor']:
-                        aliases[i] = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, aliases[i], flags=reflags)
-                    matches = True
-
-            # search serial number
+        if platform.system() == 'Windows' or sys.version_info < (2, 7):
+            args['--nocolor'] = True
+        try:
+            query = re.compile(args['<query-regex>'], 0 if args['--matchcase'] else re.IGNORECASE)
+        except re.error as ex:
+            raise ExoException('Invalid <query-regex> {0}: {1}'.format(args['<query-regex>'], ex))
+        if args['--refresh'] and args['--snapshot'] is None:
+            raise ExoException('--refresh requires --snapshot')
+
+        def gettree(getfn):
+            tree = getfn(progress if not args['--silent'] else lambda rid, info: rid)
+            sys.stderr.write('\r')
+            sys.stderr.flush()
+            if 'exception' not in tree:
+                tree['info']['key'] = cik
+            return tree
+
+        if args['--snapshot'] is not None:
+            filename = args['--snapshot']
+            index = SearchIndex(filename + '.index')
+            if args['--refresh'] or index.cik != cik or not os.path.exists(filename):
+                tree = gettree(lambda nodeidfn: rpc.snapshot(cik, filename, nodeidfn=nodeidfn)[0])
+                index.build(tree, filename)
+                index.save()
+            elif not index.indexes(filename):
+                # the snapshot was updated some other way
+                with open(filename) as f:
+                    tree = json.load(f)['tree']
+                tree['info']['key'] = cik
+                index.build(tree, filename)
+                index.save()
+        else:
+            tree = gettree(lambda nodeidfn: rpc._infotree_fast(
+                cik,
+                options={"description": True, "key": True, "basic": True, "aliases": True},
+                nodeidfn=nodeidfn,
+                level=None,
+                raiseExceptions=False))
+            if 'exception' in tree:
+                print('Exception was: ' + str(tree))
+                return
+            index = SearchIndex()
+            index.build(tree)
+
+        for line in index.search(query, not args['--nocolor']):
+            print(line)
+
+
+def serial_number(meta):
+    '''Returns model#sn from a client's Portals metadata, or None
+    http://developers.exosite.com/display/POR/Developing+for+Portals'''
+    try:
+        device = json.loads(meta)['device']
+        if device['type'] == 'vendor':
+            return device['model'] + '#' + device['sn']
+    except Exception:
+        # ignore bad meta
+        pass
+    return None
+
+
+class SearchIndex():
+    '''The resources of an infotree, with the values search looks at
+    (names, aliases, serial numbers and scripts) indexed, so a query is
+    tried once for each distinct value rather than for each resource.
+    With a filename, the index is saved there and read back by later
+    searches.'''
+
+    FIELDS = ['name', 'alias', 'sn', 'script']
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # CIK of the root, and [mtime, size] of the snapshot indexed
+        self.cik = None
+        self.source = None
+        # [rid, cik, index of parent, name, aliases, sn, script] in the
+        # order search prints them
+        self.records = []
+        # field -> value -> indexes of records with that value
+        self.values = dict((f, {}) for f in self.FIELDS)
+        # word in a script -> indexes of records whose script has it
+        self.tokens = {}
+        if filename is not None and os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    saved = json.load(f)
+                self.cik = saved['cik']
+                self.source = saved['source']
+                self.records = saved['records']
+                self.values = saved['values']
+                self.tokens = saved['tokens']
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                # build it again
+                self.cik = None
+
+    def _source(self, snapshot):
+        return [os.path.getmtime(snapshot), os.path.getsize(snapshot)]
+
+    def indexes(self, snapshot):
+        '''Returns True if the index is of snapshot as it is now'''
+        return self.source == self._source(snapshot)
+
+    def build(self, tree, snapshot=None):
+        '''Index tree, with key set for the root'''
+        self.cik = tree['info']['key']
+        self.source = None if snapshot is None else self._source(snapshot)
+        self.records = []
+        self.values = dict((f, {}) for f in self.FIELDS)
+        self.tokens = {}
+        stack = [(tree, None, [])]
+        while len(stack) > 0:
+            node, parent, aliases = stack.pop()
+            info = node['info']
+            description = info['description']
+            cik = info['key'] if 'key' in info else None
             sn = None
-            if 'key' in node['info'] and node['info']['key'] is not None:
-                try:
-                    # search serial number in portals metadata if present
-                    # http://developers.exosite.com/display/POR/Developing+for+Portals
-                    if len(node['info']['description']['meta']) > 0:
-                        meta = json.loads(node['info']['description']['meta'])
-                        if 'device' in meta:
-                            device = meta['device']
-                            if device['type'] == 'vendor':
-                                sn = device['model'] + '#' + device['sn']
-                                m = re.search(query, sn, flags=reflags)
-                                if m is not None:
-                                    if not args['--nocolor']:
-                                        sn = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, sn, flags=reflags)
-                                else:
-                                    sn = None
-
-                except Exception as ex:
-                    # ignore bad meta
-                    pass
-
-            # search script content
+            if cik is not None and len(description['meta']) > 0:
+                sn = serial_number(description['meta'])
             script = None
-            description = node['info']['description']
             if 'rule' in description and 'script' in description['rule']:
-                if re.search(query, description['rule']['script'], flags=reflags):
-                    script = description['rule']['script']
-                    if not args['--nocolor']:
-                        script = re.sub('(' + query + ')', matchColor + r'\1' + resetColor, script, flags=reflags)
-                    matches = True
-
-            cik = node['info']['key'] if 'key' in node['info'] else None
-            if matches:
-                p = path[:]
-                if cik is None:
-                    p = ['cik:' + c[:5] + '...' for c in p[:-1]] + ['cik:' + p[-1]]
-                else:
-                    p = ['cik:' + c[:5] + '...' for c in p]
-                    p.append('cik:' + cik)
-                if len(aliases) == 0:
-                    if cik is None:
-                        p.append('rid:' + node['rid'])
-                    a = ''
-                else:
-                    a = ' > alias:' + alias + ' '
-                print('{0}{1} name:{2}{3}{4}'.format(
-                    ' > '.join(p),
-                    a,
-                    name,
-                    ' sn:' + sn if sn is not None else '',
-                    '\n' + script if script is not None else ''))
-
-            children = node['info']['children']
-            for child in children:
+                script = description['rule']['script']
+
+            i = len(self.records)
+            self.records.append([node['rid'], cik, parent, description['name'], aliases, sn, script])
+            for field, values in [('name', [description['name']]), ('alias', aliases),
+                                  ('sn', [sn]), ('script', [script])]:
+                for value in set(values):
+                    if value is not None:
+                        self.values[field].setdefault(value, []).append(i)
+            if script is not None:
+                for token in set(re.findall(r'\w+', script, flags=re.UNICODE)):
+                    self.tokens.setdefault(token, []).append(i)
+
+            children = []
+            for child in info['children']:
                 if 'exception' in child:
                     sys.stderr.write('Skipped a resource due to an exception: {0}\n'.format(str(child)))
                 else:
-                    rid = child['rid']
-                    if rid in node['info']['aliases']:
-                        aliases = node['info']['aliases'][rid]
-                    else:
-                        aliases = []
-                    p = path[:]
-                    p.append(cik)
-                    searchnodes(child, p, aliases)
-
-        # These are pretty slow
-        #info = rpc.info(cik, options={"counts": True})
-        #counts = info['counts']
-        #total = counts['client'] + counts['dispatch'] + counts['dataport'] + counts['datarule']
-        tree = rpc._infotree(
-            cik,
-            options={"description": True, "key": True, "basic": True, "aliases": True},
-            nodeidfn=progress if not args['--silent'] else lambda rid, info: rid,
-            level=None,
-            raiseExceptions=False)
-        sys.stderr.write('\r')
-        sys.stderr.flush()
-        if 'exception' in tree:
-            print('Exception was: ' + str(tree))
+                    children.append((child, i, info['aliases'].get(child['rid'], [])))
+            stack.extend(reversed(children))
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'cik': self.cik, 'source': self.source, 'records': self.records,
+                       'values': self.values, 'tokens': self.tokens}, f)
+        if platform.system() == 'Windows' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp, self.filename)
+
+    def _scripts(self, query):
+        '''Returns the distinct scripts to try query on. A query that's
+        a single word can only match scripts with a word containing it.'''
+        if re.match(r'^\w+$', query.pattern, flags=re.UNICODE) is None:
+            return self.values['script']
+        word = query.pattern
+        if query.flags & re.IGNORECASE:
+            word = word.lower()
+        indexes = set()
+        for token, records in self.tokens.items():
+            if word in (token.lower() if query.flags & re.IGNORECASE else token):
+                indexes.update(records)
+        return set([self.records[i][6] for i in indexes])
+
+    def search(self, query, color):
+        '''Returns a line of output for each resource that matches query,
+        a compiled regex, in tree order'''
+        matched = set()
+        for field in ['name', 'alias', 'sn']:
+            for value, indexes in self.values[field].items():
+                if query.search(value):
+                    matched.update(indexes)
+        for script in self._scripts(query):
+            if query.search(script):
+                matched.update(self.values['script'][script])
+        highlight = re.compile('(' + query.pattern + ')', query.flags)
+        return [self._line(self.records[i], query, highlight, color) for i in sorted(matched)]
+
+    def _line(self, record, query, highlight, color):
+        rid, cik, parent, name, aliases, sn, script = record
+        def mark(value):
+            return highlight.sub('\033[32m' + r'\1' + '\033[0m', value) if color else value
+        if query.search(name):
+            name = mark(name)
+        alias = aliases[0] if len(aliases) > 0 else None
+        for a in aliases:
+            if query.search(a):
+                alias = a
+        if sn is not None:
+            sn = mark(sn) if query.search(sn) else None
+        if script is not None:
+            script = mark(script) if query.search(script) else None
+
+        path = []
+        while parent is not None:
+            path.insert(0, self.records[parent][1])
+            parent = self.records[parent][2]
+        if cik is None:
+            p = ['cik:' + c[:5] + '...' for c in path[:-1]] + ['cik:' + path[-1]]
+        else:
+            p = ['cik:' + c[:5] + '...' for c in path]
+            p.append('cik:' + cik)
+        if len(aliases) == 0:
+            if cik is None:
+                p.append('rid:' + rid)
+            a = ''
         else:
-            tree['info']['key'] = cik
-            searchnodes(tree, [], [])
+            a = ' > alias:' + alias + ' '
+        return '{0}{1} name:{2}{3}{4}'.format(
+            ' > '.join(p),
+            a,
+            name,
+            ' sn:' + sn if sn is not None else '',
+            '\n' + script if script is not None else '')
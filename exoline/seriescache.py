@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''Local cache of dataport data for read --cache'''
+from __future__ import unicode_literals
+import os
+import json
+import time
+import sqlite3
+
+DEFAULT_CACHE_DIR = '~/.exoline-cache'
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+# earlier than any timestamp. Used as the start of a read with no --start.
+MIN_TS = -2 ** 53
+
+# points newer than this many seconds ago are not cached, since more
+# points may still be recorded at those timestamps
+SETTLE_SECONDS = 60
+
+
+class SeriesCache:
+    '''Caches points read from dataports in a SQLite database. For each
+    dataport it keeps a single time range, low to high, for which it has
+    every point. A later read fetches only the points newer than high
+    (and older than low, if it needs them) and answers the rest locally.
+
+    Points recorded later with timestamps inside a cached range are not
+    seen until the dataport is evicted from the cache, so reads that
+    need them should not use the cache.'''
+
+    def __init__(self, path=None, maxbytes=DEFAULT_MAX_BYTES):
+        '''path - SQLite database file
+           maxbytes - approximate size above which least recently used
+                      dataports are evicted'''
+        if path is None:
+            path = os.path.join(os.path.expanduser(DEFAULT_CACHE_DIR), 'series.sqlite')
+        cachedir = os.path.dirname(path)
+        if cachedir and not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        self.maxbytes = maxbytes
+        # keys include CIKs, so only the user may read the cache
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        # several exo processes may share the cache
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS series (
+                                 key TEXT PRIMARY KEY,
+                                 low INTEGER,
+                                 high INTEGER,
+                                 bytes INTEGER,
+                                 accessed REAL)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS points (
+                                 key TEXT,
+                                 t INTEGER,
+                                 v TEXT)''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS points_key_t ON points (key, t)')
+
+    def close(self):
+        self.db.close()
+
+    def key(self, auth, rid):
+        '''Returns the cache key for rid, as seen from auth'''
+        return json.dumps([auth, rid], sort_keys=True)
+
+    def _coverage(self, key):
+        row = self.db.execute('SELECT low, high FROM series WHERE key = ?',
+                              (key,)).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def _store(self, key, points, low, high, replace=False):
+        '''Add points to key and set its cached range to low..high. If
+           replace is True, any points already cached for key are
+           dropped first.'''
+        rows = [(key, p[0], json.dumps(p[1])) for p in points]
+        size = sum([len(r[2]) + 16 for r in rows])
+        with self.db:
+            if replace:
+                self.db.execute('DELETE FROM points WHERE key = ?', (key,))
+                self.db.execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)',
+                                (key, low, high, size, time.time()))
+            else:
+                self.db.execute('''UPDATE series
+                                   SET low = ?, high = ?, bytes = bytes + ?, accessed = ?
+                                   WHERE key = ?''',
+                                (low, high, size, time.time(), key))
+            self.db.executemany('INSERT INTO points VALUES (?, ?, ?)', rows)
+
+    def _points(self, key, start, end, sort, limit):
+        '''Returns cached points for key from start to end'''
+        order = 'DESC' if sort == 'desc' else 'ASC'
+        cur = self.db.execute(
+            '''SELECT t, v FROM points
+               WHERE key = ? AND t >= ? AND t <= ?
+               ORDER BY t {0}, rowid {0}
+               LIMIT ?'''.format(order),
+            (key, start, end, -1 if limit is None else limit))
+        return [[t, json.loads(v)] for t, v in cur]
+
+    def _covered(self, points, limit, sort, start, end):
+        '''Returns the range (low, high) that a read from start to end
+           is known to have every point for. If the read stopped at
+           limit, that's only up to the last point returned, not
+           including its timestamp, since there may have been more
+           points at it.'''
+        if limit is None or len(points) < limit:
+            return start, end
+        if sort == 'desc':
+            return points[-1][0] + 1, end
+        return start, min(end, points[-1][0] - 1)
+
+    def _evict(self):
+        '''Drop least recently used dataports until the cache is no
+           bigger than maxbytes'''
+        total = self.db.execute('SELECT SUM(bytes) FROM series').fetchone()[0]
+        if total is None or total <= self.maxbytes:
+            return
+        lru = self.db.execute('SELECT key, bytes FROM series ORDER BY accessed').fetchall()
+        with self.db:
+            for key, size in lru:
+                self.db.execute('DELETE FROM points WHERE key = ?', (key,))
+                self.db.execute('DELETE FROM series WHERE key = ?', (key,))
+                total -= size
+                if total <= self.maxbytes:
+                    break
+
+    def read(self, fetch, keys, limit, sort, start, end):
+        '''Returns a list with up to limit points for each key in keys,
+           from start to end in sort order ('asc' or 'desc').
+
+           Points are read from the cache where possible. The rest come
+           from fetch(requests), where requests is a list of
+           (index, limit, sort, start, end) tuples, index is a position
+           in keys and limit None means no limit. fetch returns a list of
+           points for each request.'''
+        if limit == 0:
+            return [[] for key in keys]
+        settled = int(time.time()) - SETTLE_SECONDS
+        covs = [self._coverage(key) for key in keys]
+        results = [None for key in keys]
+        # points too new to cache, for each key
+        recent = [[] for key in keys]
+
+        # First read everything for keys with nothing useful cached, and
+        # the points newer than the cached range for the others.
+        fresh = []
+        newer = []
+        for i, cov in enumerate(covs):
+            if cov is None or end < cov[0] - 1 or start > cov[1] + 1:
+                fresh.append(i)
+            elif end > cov[1]:
+                newer.append(i)
+        requests = [(i, limit, sort, start, end) for i in fresh]
+        responses = fetch(requests) if len(requests) > 0 else []
+        for (i, lim, srt, s, e), points in zip(requests, responses):
+            results[i] = points
+            low, high = self._covered(points, lim, srt, s, min(e, settled))
+            if low <= high:
+                self._store(keys[i],
+                            [p for p in points if low <= p[0] <= high],
+                            low, high, replace=True)
+
+        # The newer points are read oldest first, limit at a time, and
+        # each chunk is added to the cached range before the next is read.
+        nextstart = dict((i, covs[i][1] + 1) for i in newer)
+        chunks = dict((i, limit) for i in newer)
+        while len(newer) > 0:
+            requests = [(i, chunks[i], 'asc', nextstart[i], end) for i in newer]
+            responses = fetch(requests)
+            newer = []
+            for (i, lim, srt, s, e), points in zip(requests, responses):
+                low, high = covs[i]
+                _, readto = self._covered(points, lim, srt, s, e)
+                if readto < s:
+                    # a whole chunk at one timestamp, so read past it
+                    chunks[i] = None
+                    newer.append(i)
+                    continue
+                top = max(high, min(readto, settled))
+                self._store(keys[i], [p for p in points if p[0] <= top], low, top)
+                recent[i] += [p for p in points if top < p[0] <= readto]
+                covs[i] = (low, top)
+                if readto < e:
+                    nextstart[i] = readto + 1
+                    newer.append(i)
+
+        # Then answer from the cache, reading anything needed that's
+        # older than the cached range.
+        requests = []
+        with self.db:
+            for i, cov in enumerate(covs):
+                if results[i] is not None:
+                    continue
+                low, high = cov
+                self.db.execute('UPDATE series SET accessed = ? WHERE key = ?',
+                                (time.time(), keys[i]))
+                cached = self._points(keys[i], max(start, low), min(end, high), sort, limit)
+                if sort == 'desc':
+                    results[i] = (list(reversed(recent[i])) + cached)[:limit]
+                else:
+                    results[i] = (cached + recent[i])[:limit]
+                if start < low:
+                    if sort == 'desc' and (limit is None or len(results[i]) < limit):
+                        requests.append((i,
+                                         None if limit is None else limit - len(results[i]),
+                                         'desc', start, low - 1))
+                    elif sort == 'asc':
+                        requests.append((i, limit, 'asc', start, low - 1))
+        responses = fetch(requests) if len(requests) > 0 else []
+        for (i, lim, srt, s, e), points in zip(requests, responses):
+            low, high = covs[i]
+            newlow, _ = self._covered(points, lim, srt, s, e)
+            if srt == 'desc':
+                results[i] = results[i] + points
+                if newlow <= e:
+                    self._store(keys[i], [p for p in points if p[0] >= newlow], newlow, high)
+            elif lim is None or len(points) < lim:
+                # read all the way up to the cached range
+                results[i] = (points + results[i])[:limit]
+                self._store(keys[i], points, s, high)
+            else:
+                results[i] = points
+
+        self._evict()
+        return results
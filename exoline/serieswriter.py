@@ -1,6 +1,7 @@
 import sys
 from datetime import datetime
 import re
+import time
 import platform
 
 import pytz
@@ -18,6 +19,107 @@ except:
     from exoline.exocommon import ExoException
 
 
+_numpy = None
+
+
+def numpy():
+    '''Returns the numpy module, or False if it's not installed. It's
+    imported the first time it's needed, since most commands don't.'''
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+# HH:MM: for each minute of the day, and SS for each second of a minute
+_HOURS_MINUTES = ['%02d:%02d:' % (m // 60, m % 60) for m in range(24 * 60)]
+_SECONDS = ['%02d' % sec for sec in range(60)]
+
+
+class TimestampFormatter:
+    '''Formats unix timestamps as strings for a timeformat. Consecutive
+    timestamps are usually on the same day with the same UTC offset, so
+    for whole second timestamps it remembers the text before and after
+    the time of day (e.g. "2015-06-30 " and "-05:00") for the current
+    day and only formats the time of day. On days with a DST change it
+    remembers an hour (or minute) at a time instead. Timestamps with
+    fractional seconds are formatted the slow way.'''
+
+    def __init__(self, timeformat, tz=pytz.utc):
+        self.timeformat = timeformat
+        self.tz = tz
+        # where the time of day starts in formatted timestamps
+        self._time_at = 9 if timeformat == 'excel' else 11
+        # the day, hour or minute being cached, as UTC timestamps
+        # low <= t < high, and the UTC timestamp of its day's midnight
+        self._low = self._high = self._midnight = 0
+        self._before = self._after = None
+        # UTC timestamps of a minute that can't be cached
+        self._slowlow = self._slowhigh = 0
+        self._last = None
+
+    def format_slow(self, timestamp):
+        '''Format a timestamp without the cache'''
+        if self.timeformat in ['iso8601', 'excel'] and type(timestamp) in six.integer_types:
+            return time.strftime('%Y-%m-%dT%H:%M:%S+00:00' if self.timeformat == 'iso8601'
+                                 else '%m/%d/%y %H:%M:%S', time.gmtime(timestamp))
+        dt = pytz.utc.localize(datetime.utcfromtimestamp(timestamp))
+        if self.timeformat == 'iso8601':
+            return datetime.isoformat(dt)
+        elif self.timeformat == 'excel':
+            # This date format works for Excel scatter plots
+            return dt.strftime('%m/%d/%y %H:%M:%S')
+        else:
+            return str(dt.astimezone(self.tz))
+
+    def format(self, timestamp):
+        if self.timeformat == 'unix':
+            return str(timestamp)
+        if self._low <= timestamp < self._high and type(timestamp) in six.integer_types:
+            t = timestamp - self._midnight
+            return self._before + _HOURS_MINUTES[t // 60] + _SECONDS[t % 60] + self._after
+        return self._format_day(timestamp)
+
+    def _matches(self, timestamp, midnight, before, after):
+        '''Returns True if timestamp formats as before + time of day
+           since midnight + after'''
+        t = timestamp - midnight
+        return self.format_slow(timestamp) == (
+            before + _HOURS_MINUTES[t // 60] + _SECONDS[t % 60] + after)
+
+    def _format_day(self, timestamp):
+        '''Format a timestamp, and cache its day if possible'''
+        s = self.format_slow(timestamp)
+        last, self._last = self._last, timestamp
+        # caching a day takes at least two more slow formats, so only do
+        # it when the timestamps are close together
+        if (type(timestamp) not in six.integer_types
+                or last is None or abs(timestamp - last) >= 86400
+                or self._slowlow <= timestamp < self._slowhigh):
+            return s
+        i = self._time_at
+        before, after = s[:i], s[i + 8:]
+        h, m, sec = [int(x) for x in s[i:i + 8].split(':')]
+        midnight = timestamp - (h * 3600 + m * 60 + sec)
+        # Cache the day if it has one date and UTC offset throughout.
+        # Otherwise it has a DST change, so cache the hour or minute.
+        for low, size in [(midnight, 86400),
+                          (timestamp - m * 60 - sec, 3600),
+                          (timestamp - sec, 60)]:
+            high = low + size
+            if self._matches(low, midnight, before, after) and \
+                    self._matches(high - 1, midnight, before, after):
+                self._low, self._high, self._midnight = low, high, midnight
+                self._before, self._after = before, after
+                return s
+        self._slowlow, self._slowhigh = timestamp - sec, timestamp - sec + 60
+        return s
+
+
 class SeriesWriter:
     headers = None
     dw = None
@@ -56,8 +158,10 @@ class SeriesWriter:
         if 'timeformat' not in options:
             options['timeformat'] = 'human'
 
+        self.formatter = TimestampFormatter(options['timeformat'], tz)
+
         if options['format'] == 'csv':
-            self.dw = csv.DictWriter(sys.stdout, headers)
+            self.dw = csv.writer(sys.stdout)
         if options['format'] == 'human' and len(headers) > 2:
             raise Exception('format: human only supported for single value output')
 
@@ -77,38 +181,41 @@ class SeriesWriter:
         else:
             print(values[0])
 
-    def _write_other(self, timestamp, values):
-        if self.options['timeformat'] == 'unix':
-            dt = timestamp
-        elif self.options['timeformat'] == 'iso8601':
-            dt = datetime.isoformat(
-                pytz.utc.localize(datetime.utcfromtimestamp(timestamp))
-            )
-        elif self.options['timeformat'] == 'excel':
-            # This date format works for Excel scatter plots
-            dt = pytz.utc.localize(
-                datetime.utcfromtimestamp(timestamp)
-            ).strftime('%m/%d/%y %H:%M:%S')
-        else:
-            dt = pytz.utc.localize(
-                datetime.utcfromtimestamp(timestamp)
-            ).astimezone(self.options['tz'])
+    def _format_timestamps(self, timestamps):
+        '''Format a chunk of timestamps for csv output'''
+        timeformat = self.options['timeformat']
+        if timeformat == 'unix':
+            return [str(t) for t in timestamps]
+        # the formatter's cache works for timestamps close together, and
+        # numpy is faster for ones far apart
+        if (timeformat in ['iso8601', 'excel'] and len(timestamps) > 1
+                and abs(timestamps[-1] - timestamps[0]) > 3600 * len(timestamps)
+                and all(type(t) in six.integer_types for t in timestamps)):
+            np = numpy()
+            if np:
+                # e.g. 2015-06-30T23:59:59
+                iso = np.datetime_as_string(
+                    np.array(timestamps, dtype='int64').astype('datetime64[s]'),
+                    unit='s').tolist()
+                if timeformat == 'iso8601':
+                    return [s + '+00:00' for s in iso]
+                return [s[5:7] + '/' + s[8:10] + '/' + s[2:4] + ' ' + s[11:]
+                        for s in iso]
+        fmt = self.formatter.format
+        return [fmt(t) for t in timestamps]
 
+    def _stripcarriage(self, s):
+        # strip carriage returns not followed by a newline
+        if isinstance(s, six.string_types):
+            return self.recarriage.sub('', s)
+        else:
+            return s
 
-        def stripcarriage(s):
-            # strip carriage returns not followed
-            if isinstance(s, six.string_types):
-                return self.recarriage.sub('', s)
-            else:
-                return s
+    def _write_other(self, timestamp, values):
+        dt = self.formatter.format(timestamp)
 
         if self.options['format'] == 'csv':
-            row = {'timestamp': str(dt)}
-            values_dict = dict(
-                [(str(self.headers[i + 1]), stripcarriage(values[i]))
-                    for i in range(len(self.headers) - 1)])
-            row.update(values_dict)
-            self.dw.writerow(row)
+            self.dw.writerow([str(dt)] + [self._stripcarriage(v) for v in values])
         else:
             # human
             nocolor = platform.system() == 'Windows'
@@ -128,6 +235,22 @@ class SeriesWriter:
         else:
             self._write_other(timestamp, values)
 
+    def write_many(self, timestamps, columns):
+        '''Write a chunk of rows. timestamps is a list of timestamps and
+        columns has a list of values for each column after the
+        timestamp, e.g.:
+            write_many([1, 2], [['a', 'b'], [10, 20]])'''
+        if self.options['format'] != 'csv':
+            for i, timestamp in enumerate(timestamps):
+                self.write(timestamp, [column[i] for column in columns])
+            return
+        formatted = self._format_timestamps(timestamps)
+        strip = self._stripcarriage
+        columns = [[strip(v) if isinstance(v, six.string_types) and '\r' in v else v
+                    for v in column]
+                   for column in columns]
+        self.dw.writerows(zip(formatted, *columns))
+
     def write_headers(self):
         if self.options['format'] == 'csv':
-            self.dw.writerow(dict([(h, h) for h in self.headers]))
+            self.dw.writerow(self.headers)
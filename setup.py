@@ -57,6 +57,9 @@ setup(
     scripts=['bin/exo', 'bin/exoline'],
     keywords=['exosite', 'onep', 'one platform', 'm2m', 'iot', 'cli'],
     install_requires=required,
+    extras_require={
+        # read --format=parquet|arrow|npz
+        'columnar': ['numpy', 'pyarrow']},
     zip_safe=False,
     #always_unzip=True,
 	console=['exoline/exo.py'],
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Benchmark Exoline commands against the stand-in One Platform server.
+
+Each scenario runs exo.run() in a fresh Python process against a
+synthetic portal served by test/mockserver.py, and reports wall time
+(median of the runs), RPC requests and calls, bytes sent and received,
+and peak memory (RSS) of the process running the command.
+
+Usage:
+    bench.py [options] [<scenario> ...]
+    bench.py --compare <baseline.json> <results.json> [--threshold=<percent>]
+    bench.py --list
+
+Options:
+    --scale=<n>            multiply the size of the synthetic portal
+                           [default: 1]
+    --runs=<n>             times to run each scenario [default: 3]
+    --out=<file>           save results as JSON to <file>
+    --baseline=<file>      compare results with a saved run
+    --threshold=<percent>  how much worse than the baseline a result may
+                           be before it's reported as a regression
+                           [default: 25]
+    --list                 list scenarios
+
+With --compare or --baseline, exits with status 1 if any scenario
+regressed. For example, to check a change against the last release:
+
+    $ git checkout 0.10.0 && python test/bench.py --out=base.json
+    $ git checkout master && python test/bench.py --baseline=base.json
+'''
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from mockserver import MockServer, synthetic_portal
+
+# results compared with the baseline
+METRICS = ['seconds', 'rpc_requests', 'rpc_calls', 'request_bytes',
+           'response_bytes', 'peak_rss_kb']
+
+# scenarios that get slower by less than this aren't regressions, since
+# short times vary a lot from run to run
+MIN_SECONDS = 0.1
+
+
+class Portal():
+    '''Synthetic portals for the scenarios to run against'''
+
+    def __init__(self, server, scale):
+        self.server = server
+        self.platform = server.platform
+        self.tmpdir = tempfile.mkdtemp()
+        # wide: many devices each with a few dataports
+        self.wide = synthetic_portal(self.platform, devices=200 * scale,
+                                     dataports=5, points=100)
+        # deep: devices under several levels of clients
+        self.deep = synthetic_portal(self.platform, devices=64 * scale,
+                                     dataports=3, points=10, depth=3)
+        # dense: one device with long dataport histories
+        dense = synthetic_portal(self.platform, devices=1, dataports=9,
+                                 points=20000 * scale)
+        self.dense = self.client_key(dense, 'device0')
+        self.device = self.client_key(self.wide, 'device0')
+        self.device2 = self.client_key(self.wide, 'device1')
+        self.scale = scale
+
+    def client_key(self, cik, alias):
+        portal = self.platform.keys[cik]
+        return self.platform.resources[portal.aliases[alias]].key
+
+    def new_client(self):
+        '''Returns the key of a new, empty client'''
+        return self.platform.new('client', {'name': 'bench'}).key
+
+    def new_dataport(self, cik, alias, fmt='integer'):
+        client = self.platform.keys[cik]
+        dp = self.platform.new('dataport', {'name': alias, 'format': fmt}, client)
+        client.aliases[alias] = dp.rid
+        return dp.rid
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def close(self):
+        shutil.rmtree(self.tmpdir)
+
+
+def _record_csv(p):
+    alias = 'recorded{0}'.format(len(p.platform.resources))
+    p.new_dataport(p.dense, alias)
+    rows = ['{0},{1}'.format(1000000000 + i * 10, i) for i in range(50000 * p.scale)]
+    return ['record', p.dense, alias], '\n'.join(rows) + '\n'
+
+
+def _spec(p):
+    filename = p.path('spec.yaml')
+    with open(filename, 'w') as f:
+        f.write('dataports:\n')
+        for i, fmt in enumerate(['integer', 'float', 'string', 'integer', 'float']):
+            f.write('    - alias: dp{0}\n      format: {1}\n'.format(i, fmt))
+    return ['spec', p.device, filename], None
+
+
+# name -> function returning (exo arguments, stdin) for a Portal
+SCENARIOS = [
+    ('read', lambda p: (['read', p.dense, 'dp0', '--limit=100000'], None)),
+    ('read-multi', lambda p: (['read', p.dense] + ['dp{0}'.format(i) for i in range(9)] +
+                              ['--limit=20000'], None)),
+    ('record-csv', _record_csv),
+    ('tree-wide', lambda p: (['tree', p.wide], None)),
+    ('twee-wide', lambda p: (['twee', p.wide, '--nocolor'], None)),
+    ('tree-deep', lambda p: (['tree', p.deep], None)),
+    ('twee-deep', lambda p: (['twee', p.deep, '--nocolor'], None)),
+    ('search', lambda p: (['search', p.wide, 'dataport 4', '--silent', '--nocolor'], None)),
+    ('dump', lambda p: (['dump', p.device, p.path('dump.zip'), '--silent'], None)),
+    ('copy', lambda p: (['copy', p.device, p.new_client()], None)),
+    ('diff', lambda p: (['diff', p.device, p.device2], None)),
+    ('info-deep', lambda p: (['info', p.deep, '--recursive'], None)),
+    ('spec', _spec),
+]
+
+
+def run_child():
+    '''Run one command, as described by JSON on stdin, and print the
+       results as JSON'''
+    from exoline import exo
+    job = json.loads(sys.stdin.read())
+    start = time.time()
+    r = exo.run(job['argv'], stdin=job['stdin'])
+    seconds = time.time() - start
+    rss = None
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if platform.system() == 'Darwin':
+            # bytes on OS X, kilobytes elsewhere
+            rss = rss // 1024
+    print(json.dumps({'seconds': seconds, 'exitcode': r.exitcode,
+                      'peak_rss_kb': rss, 'stderr': r.stderr[-1000:]}))
+
+
+def run_scenario(portal, name, setup, runs, env):
+    results = []
+    for i in range(runs):
+        args, stdin = setup(portal)
+        portal.server.reset_stats()
+        job = json.dumps({'argv': ['exo'] + portal.server.exo_args() + args,
+                          'stdin': stdin})
+        p = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child'],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env)
+        out, err = p.communicate(job.encode('utf-8'))
+        try:
+            result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            # exo raised an exception instead of returning
+            result = {'seconds': None, 'exitcode': None, 'peak_rss_kb': None,
+                      'stderr': err.decode('utf-8')[-1000:]}
+        result.update(dict(('rpc_' + k if k in ['requests', 'calls'] else k, v)
+                           for k, v in portal.server.stats.items()))
+        results.append(result)
+        if result['exitcode'] != 0:
+            sys.stderr.write('{0} failed: {1}\n'.format(name, result['stderr']))
+            break
+    result = results[-1]
+    if result['exitcode'] == 0:
+        times = sorted([r['seconds'] for r in results])
+        result['seconds'] = times[len(times) // 2]
+    result['runs'] = len(results)
+    del result['stderr']
+    return result
+
+
+def compare(baseline, results, threshold):
+    '''Print results next to baseline. Returns the names of regressed
+       scenarios.'''
+    regressed = []
+    print('{0:<12} {1:<15} {2:>12} {3:>12} {4:>8}'.format(
+        'scenario', 'metric', 'baseline', 'result', 'change'))
+    for name in results['scenarios']:
+        if name not in baseline['scenarios']:
+            continue
+        base = baseline['scenarios'][name]
+        new = results['scenarios'][name]
+        if new['exitcode'] != 0:
+            print('{0:<12} failed'.format(name))
+            regressed.append(name)
+            continue
+        for metric in METRICS:
+            b = base.get(metric)
+            n = new.get(metric)
+            if b is None or n is None:
+                continue
+            change = (n - b) * 100.0 / b if b else 0.0
+            flag = ''
+            if change > threshold and not (metric == 'seconds' and n - b < MIN_SECONDS):
+                flag = ' <- regression'
+                if name not in regressed:
+                    regressed.append(name)
+            print('{0:<12} {1:<15} {2:>12} {3:>12} {4:>+7.1f}%{5}'.format(
+                name, metric, _fmt(b), _fmt(n), change, flag))
+    return regressed
+
+
+def _fmt(v):
+    if v is None:
+        return '-'
+    return '{0:.3f}'.format(v) if isinstance(v, float) else str(v)
+
+
+def main():
+    if '--child' in sys.argv:
+        run_child()
+        return 0
+
+    from docopt import docopt
+    args = docopt(__doc__)
+    names = [name for name, setup in SCENARIOS]
+    if args['--list']:
+        print('\n'.join(names))
+        return 0
+    threshold = float(args['--threshold'])
+    if args['--compare']:
+        with open(args['<baseline.json>']) as f:
+            baseline = json.load(f)
+        with open(args['<results.json>']) as f:
+            results = json.load(f)
+        return 1 if len(compare(baseline, results, threshold)) > 0 else 0
+
+    for name in args['<scenario>']:
+        if name not in names:
+            sys.stderr.write('Unknown scenario {0}. Scenarios are: {1}\n'.format(
+                name, ', '.join(names)))
+            return 1
+    selected = [(n, s) for n, s in SCENARIOS
+                if len(args['<scenario>']) == 0 or n in args['<scenario>']]
+
+    # run exo without the user's configuration, caches or daemon
+    env = dict((k, v) for k, v in os.environ.items() if not k.startswith('EXO_'))
+    server = MockServer()
+    server.start()
+    portal = Portal(server, int(args['--scale']))
+    env['EXO_CONFIG'] = portal.path('exoline-config')
+    results = {'time': int(time.time()),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'scale': int(args['--scale']),
+               'scenarios': {}}
+    try:
+        from exoline import __version__
+        results['exoline'] = __version__
+        print('{0:<12} {1:>9} {2:>9} {3:>9} {4:>12} {5:>12} {6:>10}'.format(
+            'scenario', 'seconds', 'requests', 'calls', 'sent', 'received', 'rss (KB)'))
+        for name, setup in selected:
+            r = run_scenario(portal, name, setup, int(args['--runs']), env)
+            results['scenarios'][name] = r
+            print('{0:<12} {1:>9} {2:>9} {3:>9} {4:>12} {5:>12} {6:>10}{7}'.format(
+                name, _fmt(r['seconds']), r['rpc_requests'], r['rpc_calls'],
+                r['request_bytes'], r['response_bytes'], _fmt(r['peak_rss_kb']),
+                '' if r['exitcode'] == 0 else ' (failed)'))
+    finally:
+        server.stop()
+        portal.close()
+
+    if args['--out']:
+        with open(args['--out'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args['--baseline']:
+        with open(args['--baseline']) as f:
+            baseline = json.load(f)
+        print('')
+        if len(compare(baseline, results, threshold)) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,689 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Stand-in One Platform JSON-RPC server for running Exoline offline.
+
+Keeps a resource tree and time series in memory and answers the RPC
+procedures Exoline uses. It's meant for tests and benchmarks, so it
+checks less than the real One Platform does (for example, resource
+limits and most permissions aren't enforced).
+
+Usage:
+    mockserver.py [options]
+
+Options:
+    --port=<port>       port to listen on [default: 8080]
+    --devices=<n>       devices in the synthetic portal [default: 10]
+    --dataports=<n>     dataports per device [default: 5]
+    --points=<n>        points per dataport [default: 100]
+    --depth=<n>         levels of clients between portal and devices [default: 0]
+    --seed=<n>          seed for generated values [default: 0]
+
+Prints the portal's CIK, then serves until interrupted. For example:
+
+    $ python test/mockserver.py --devices=1000 &
+    $ exo --host=127.0.0.1 --port=8080 --http tree <portal cik>
+
+From Python, MockServer runs the server in a background thread:
+
+    server = MockServer()
+    cik = synthetic_portal(server.platform, devices=100)
+    server.start()
+    exo.run(['exo', '--host=127.0.0.1', '--port={0}'.format(server.port),
+             '--http', 'tree', cik])
+    server.stop()
+'''
+from __future__ import unicode_literals, print_function
+import sys
+import copy
+import json
+import time
+import bisect
+import hashlib
+import itertools
+import threading
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+RPC_PATH = '/onep:v1/rpc/process'
+
+TYPES = ['client', 'dataport', 'datarule', 'dispatch']
+COUNT_TYPES = TYPES + ['disk', 'email', 'http', 'share', 'sms', 'xmpp']
+INFO_KEYS = ['aliases', 'basic', 'comments', 'counts', 'description', 'key',
+             'shares', 'subscribers', 'tags', 'usage']
+
+
+class RPCError(Exception):
+    '''A call failed with status, e.g. 'invalid' or 'restricted' '''
+    def __init__(self, status, message=''):
+        Exception.__init__(self, message or status)
+        self.status = status
+
+
+class Series():
+    '''Points for a dataport, sorted by timestamp. A generated series
+    computes its points until it is first changed, so that synthetic
+    portals with many points don't use much memory.'''
+
+    def __init__(self):
+        self.times = []
+        self.values = []
+        # (start, interval, count, value function) for a generated series
+        self.generated = None
+
+    def generate(self, start, interval, count, value):
+        self.times = []
+        self.values = []
+        self.generated = (start, interval, count, value)
+
+    def _materialize(self):
+        if self.generated is not None:
+            start, interval, count, value = self.generated
+            self.times = [start + i * interval for i in range(count)]
+            self.values = [value(i) for i in range(count)]
+            self.generated = None
+
+    def __len__(self):
+        if self.generated is not None:
+            return self.generated[2]
+        return len(self.times)
+
+    def point(self, i):
+        if self.generated is not None:
+            start, interval, count, value = self.generated
+            return [start + i * interval, value(i)]
+        return [self.times[i], self.values[i]]
+
+    def indexes(self, start, end):
+        '''Returns the range of indexes of points from start to end'''
+        if self.generated is not None:
+            first, interval, count, value = self.generated
+            lo = 0 if start <= first else min(count, -(-(start - first) // interval))
+            hi = 0 if end < first else min(count, (end - first) // interval + 1)
+            return lo, max(lo, hi)
+        return bisect.bisect_left(self.times, start), bisect.bisect_right(self.times, end)
+
+    def add(self, t, v):
+        '''Add a point. A point already at timestamp t is replaced.'''
+        self._materialize()
+        i = bisect.bisect_left(self.times, t)
+        if i < len(self.times) and self.times[i] == t:
+            self.values[i] = v
+        else:
+            self.times.insert(i, t)
+            self.values.insert(i, v)
+
+    def flush(self, newerthan=None, olderthan=None):
+        '''Remove points newer than newerthan and older than olderthan,
+           or all points if neither is passed'''
+        self._materialize()
+        keep = [(t, v) for t, v in zip(self.times, self.values)
+                if (newerthan is not None and t <= newerthan)
+                or (olderthan is not None and t >= olderthan)]
+        self.times = [t for t, v in keep]
+        self.values = [v for t, v in keep]
+
+    def copy(self):
+        s = Series()
+        s.times = list(self.times)
+        s.values = list(self.values)
+        s.generated = self.generated
+        return s
+
+
+class Resource():
+    def __init__(self, rid, typ, description, parent):
+        self.rid = rid
+        self.type = typ
+        self.description = description
+        self.parent = parent
+        self.children = []
+        self.created = int(time.time())
+        self.modified = self.created
+        self.status = 'activated'
+        self.comments = []
+        self.tags = []
+        # clients only
+        self.key = None
+        self.aliases = {}
+        # dataports and datarules only
+        self.series = Series()
+
+
+class OnePlatform():
+    '''In-memory One Platform. handle(auth, calls) answers a JSON-RPC
+    request.'''
+
+    def __init__(self):
+        self.resources = {}
+        self.keys = {}
+        self.shares = {}
+        self._ids = itertools.count()
+        self.lock = threading.RLock()
+        # notified when points are added, for wait
+        self.changed = threading.Condition(self.lock)
+        # most points a read returns, whatever its limit. None for no cap.
+        self.maxread = None
+        # if True, a resource can only be named by RID by itself or the
+        # client that owns it directly. Clients further down are reached
+        # with client_id in the auth.
+        self.directowner = False
+
+    def newid(self):
+        '''Returns a new RID, CIK or share code'''
+        return hashlib.sha1('mockserver{0}'.format(next(self._ids)).encode('utf-8')).hexdigest()
+
+    def new(self, typ, description, parent=None):
+        '''Create a resource owned by parent. Returns the Resource.'''
+        r = Resource(self.newid(), typ, self._describe(typ, description), parent)
+        self.resources[r.rid] = r
+        if typ == 'client':
+            r.key = self.newid()
+            self.keys[r.key] = r
+        if parent is not None:
+            parent.children.append(r)
+        return r
+
+    def _describe(self, typ, description):
+        '''Fill in defaults for a resource description'''
+        desc = {'meta': '', 'name': '', 'public': False}
+        if typ == 'client':
+            desc['limits'] = dict((t, 'inherit') for t in COUNT_TYPES)
+            desc['locked'] = False
+        elif typ in ['dataport', 'datarule']:
+            desc.update({'format': 'string', 'preprocess': [],
+                         'retention': {'count': 'infinity', 'duration': 'infinity'},
+                         'subscribe': None})
+            if typ == 'datarule':
+                desc['rule'] = {}
+        desc.update(copy.deepcopy(description))
+        return desc
+
+    # Request handling
+
+    def handle(self, auth, calls):
+        '''Returns the response to a JSON-RPC request, either a list of
+           call responses or a request error'''
+        with self.lock:
+            try:
+                client = self._authenticate(auth)
+            except RPCError as ex:
+                return {'error': {'code': 401, 'message': 'Invalid', 'context': 'auth'}}
+            responses = []
+            for call in calls:
+                response = {'id': call.get('id')}
+                try:
+                    proc = getattr(self, 'rpc_' + call['procedure'], None)
+                    if proc is None:
+                        raise RPCError('invalid', 'unknown procedure')
+                    response['result'] = proc(client, *call['arguments'])
+                    response['status'] = 'ok'
+                except RPCError as ex:
+                    response['status'] = ex.status
+                except (TypeError, ValueError, KeyError, IndexError) as ex:
+                    response['status'] = 'invalid'
+                    response['error'] = {'message': str(ex)}
+                if response.get('result', 0) is None:
+                    del response['result']
+                responses.append(response)
+            return responses
+
+    def _authenticate(self, auth):
+        if not isinstance(auth, dict):
+            auth = {'cik': auth}
+        key = auth.get('cik', auth.get('token'))
+        if key not in self.keys:
+            raise RPCError('invalid')
+        client = self.keys[key]
+        if 'client_id' in auth:
+            client = self._owned(client, auth['client_id'])
+            if client.type != 'client':
+                raise RPCError('invalid')
+        return client
+
+    def _owned(self, client, rid):
+        '''Returns rid if client or one of its descendants owns it'''
+        r = self.resources.get(rid)
+        ancestor = r
+        while ancestor is not None and ancestor is not client:
+            ancestor = ancestor.parent
+        if r is None or ancestor is None:
+            raise RPCError('restricted')
+        return r
+
+    def _resource(self, client, resource):
+        '''Returns the Resource identified by resource, a RID or an alias
+           object like {"alias": "temperature"}'''
+        if isinstance(resource, dict):
+            alias = resource['alias']
+            if alias == '':
+                return client
+            if alias not in client.aliases:
+                raise RPCError('invalid')
+            return self.resources[client.aliases[alias]]
+        r = self._owned(client, resource)
+        if self.directowner and r is not client and r.parent is not client:
+            raise RPCError('restricted')
+        return r
+
+    def _descendants(self, r):
+        yield r
+        for c in r.children:
+            for d in self._descendants(c):
+                yield d
+
+    def _parse_value(self, r, value):
+        fmt = r.description.get('format', 'string')
+        try:
+            if fmt == 'integer':
+                return int(float(value)) if isinstance(value, six.string_types) else int(value)
+            if fmt == 'float':
+                return float(value)
+        except (TypeError, ValueError):
+            raise RPCError('fail', 'value does not match format')
+        return value if isinstance(value, six.string_types) else json.dumps(value)
+
+    def _add(self, r, points):
+        if r.type not in ['dataport', 'datarule']:
+            raise RPCError('invalid')
+        for t, v in points:
+            r.series.add(int(t), self._parse_value(r, v))
+        r.modified = int(time.time())
+        self.changed.notify_all()
+
+    # Procedures. Arguments follow the One Platform RPC API.
+
+    def rpc_info(self, client, resource, options={}):
+        r = self._resource(client, resource)
+        keys = [k for k in INFO_KEYS if options.get(k)] if len(options) > 0 else INFO_KEYS
+        info = {}
+        for k in keys:
+            if k == 'aliases':
+                aliases = {}
+                for alias, rid in six.iteritems(r.aliases):
+                    aliases.setdefault(rid, []).append(alias)
+                info['aliases'] = dict((rid, sorted(a)) for rid, a in six.iteritems(aliases))
+            elif k == 'basic':
+                info['basic'] = {'type': r.type, 'status': r.status,
+                                 'created': r.created, 'modified': r.modified,
+                                 'subscribers': 0}
+            elif k == 'comments':
+                info['comments'] = copy.deepcopy(r.comments)
+            elif k in ['counts', 'usage']:
+                counts = dict((t, 0) for t in COUNT_TYPES)
+                for c in r.children:
+                    counts[c.type] += 1
+                info[k] = counts
+            elif k == 'description':
+                info['description'] = copy.deepcopy(r.description)
+            elif k == 'key':
+                if r.key is not None:
+                    info['key'] = r.key
+            elif k == 'shares':
+                info['shares'] = [{'code': code, 'meta': s['meta']}
+                                  for code, s in six.iteritems(self.shares)
+                                  if s['rid'] == r.rid]
+            elif k in ['subscribers', 'tags']:
+                info[k] = []
+        if options.get('storage'):
+            count = len(r.series)
+            info['storage'] = {'count': count,
+                               'first': r.series.point(0)[0] if count > 0 else 0,
+                               'last': r.series.point(count - 1)[0] if count > 0 else 0,
+                               'size': count * 16}
+        return info
+
+    def rpc_listing(self, client, types, options=None, resource={'alias': ''}):
+        r = self._resource(client, resource)
+        if options is None:
+            # legacy form returns a list for each type
+            return [[c.rid for c in r.children if c.type == t] for t in types]
+        listing = dict((t, []) for t in types)
+        aliased = set(r.aliases.values())
+        if options.get('activated'):
+            for s in self.shares.values():
+                if s['activator'] == r.rid and s['rid'] in self.resources:
+                    typ = self.resources[s['rid']].type
+                    if typ in listing:
+                        listing[typ].append(s['rid'])
+            return listing
+        for c in r.children:
+            if c.type not in listing:
+                continue
+            if options.get('aliased') and c.rid not in aliased:
+                continue
+            if options.get('public') and not c.description.get('public'):
+                continue
+            listing[c.type].append(c.rid)
+        return listing
+
+    def rpc_create(self, client, typ, description):
+        if typ == 'clone':
+            return self._clone(client, description)
+        if typ not in TYPES:
+            raise RPCError('invalid')
+        return self.new(typ, description, client).rid
+
+    def _clone(self, client, options):
+        if 'code' in options:
+            if options['code'] not in self.shares:
+                raise RPCError('invalid')
+            source = self.resources[self.shares[options['code']]['rid']]
+        else:
+            source = self._resource(client, options['rid'])
+
+        def clone(r, parent):
+            c = self.new(r.type, r.description, parent)
+            c.comments = copy.deepcopy(r.comments)
+            if not options.get('nohistorical'):
+                c.series = r.series.copy()
+            for child in r.children:
+                copied = clone(child, c)
+                if not options.get('noaliases'):
+                    for alias, rid in six.iteritems(r.aliases):
+                        if rid == child.rid:
+                            c.aliases[alias] = copied.rid
+            return c
+        return clone(source, client).rid
+
+    def rpc_drop(self, client, resource):
+        r = self._resource(client, resource)
+        if r is client:
+            raise RPCError('restricted')
+        r.parent.children.remove(r)
+        for alias in [a for a, rid in six.iteritems(r.parent.aliases) if rid == r.rid]:
+            del r.parent.aliases[alias]
+        for d in list(self._descendants(r)):
+            del self.resources[d.rid]
+            if d.key is not None:
+                del self.keys[d.key]
+
+    def rpc_update(self, client, resource, description):
+        r = self._resource(client, resource)
+        r.description.update(copy.deepcopy(description))
+        r.modified = int(time.time())
+
+    def rpc_comment(self, client, resource, visibility, comment):
+        self._resource(client, resource).comments.append([visibility, comment])
+
+    def rpc_map(self, client, mapping, resource, alias):
+        r = self._resource(client, resource)
+        if alias in client.aliases and client.aliases[alias] != r.rid:
+            raise RPCError('invalid', 'alias already mapped')
+        client.aliases[alias] = r.rid
+
+    def rpc_unmap(self, client, mapping, alias):
+        if alias not in client.aliases:
+            raise RPCError('invalid')
+        del client.aliases[alias]
+
+    def rpc_lookup(self, client, typ, mapping):
+        if typ in ['alias', 'aliased']:
+            return self._resource(client, {'alias': mapping}).rid
+        if typ == 'owner':
+            r = self._resource(client, mapping)
+            if r.parent is None:
+                raise RPCError('restricted')
+            return r.parent.rid
+        if typ == 'shared':
+            if mapping not in self.shares:
+                raise RPCError('invalid')
+            return self.shares[mapping]['rid']
+        raise RPCError('invalid')
+
+    def rpc_move(self, client, resource, destination, options={'aliases': True}):
+        r = self._resource(client, resource)
+        dest = self._resource(client, destination)
+        if r is client or dest.type != 'client':
+            raise RPCError('invalid')
+        aliases = [a for a, rid in six.iteritems(r.parent.aliases) if rid == r.rid]
+        for a in aliases:
+            del r.parent.aliases[a]
+        if options.get('aliases', True):
+            for a in aliases:
+                dest.aliases[a] = r.rid
+        r.parent.children.remove(r)
+        dest.children.append(r)
+        r.parent = dest
+
+    def rpc_read(self, client, resource, options={}):
+        r = self._resource(client, resource)
+        start = int(options.get('starttime', 0))
+        end = int(options.get('endtime', time.time()))
+        limit = int(options.get('limit', 1))
+        if self.maxread is not None:
+            limit = min(limit, self.maxread)
+        lo, hi = r.series.indexes(start, end)
+        if options.get('selection') == 'autowindow' and hi - lo > limit > 1:
+            # spread points evenly across the window
+            step = (hi - lo - 1) / float(limit - 1)
+            indexes = [lo + int(round(i * step)) for i in range(limit)]
+        else:
+            indexes = list(range(lo, hi))
+        if options.get('sort', 'desc') == 'desc':
+            indexes.reverse()
+        return [r.series.point(i) for i in indexes[:limit]]
+
+    def rpc_record(self, client, resource, entries, options={}):
+        self._add(self._resource(client, resource), entries)
+
+    def rpc_write(self, client, resource, value, options={}):
+        self._add(self._resource(client, resource), [[int(time.time()), value]])
+
+    def rpc_flush(self, client, resource, options={}):
+        r = self._resource(client, resource)
+        r.series.flush(options.get('newerthan'), options.get('olderthan'))
+
+    def rpc_wait(self, client, resource, options={}):
+        '''Wait for a point newer than since (default now) for up to
+           timeout milliseconds (default 30 seconds)'''
+        r = self._resource(client, resource)
+        since = options.get('since', int(time.time()))
+        deadline = time.time() + options.get('timeout', 30000) / 1000.0
+        while True:
+            lo, hi = r.series.indexes(since + 1, 2 ** 62)
+            if hi > lo:
+                return r.series.point(hi - 1)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RPCError('expire')
+            self.changed.wait(remaining)
+
+    def rpc_usage(self, client, resource, metric, starttime, endtime):
+        r = self._resource(client, resource)
+        if metric == 'disk':
+            return sum([len(d.series) * 16 for d in self._descendants(r)])
+        return len([d for d in self._descendants(r) if d.type == metric and d is not r])
+
+    def rpc_share(self, client, resource, options={}):
+        r = self._resource(client, resource)
+        code = options.get('share')
+        if code is None:
+            code = self.newid()
+        elif code not in self.shares:
+            raise RPCError('invalid')
+        self.shares[code] = {'rid': r.rid, 'meta': options.get('meta', ''),
+                             'activator': None}
+        return code
+
+    def rpc_activate(self, client, codetype, code):
+        if codetype == 'share':
+            if code not in self.shares:
+                raise RPCError('invalid')
+            self.shares[code]['activator'] = client.rid
+        elif codetype == 'client':
+            self.keys[code].status = 'activated'
+        else:
+            raise RPCError('invalid')
+
+    def rpc_deactivate(self, client, codetype, code):
+        if codetype == 'share':
+            if code not in self.shares:
+                raise RPCError('invalid')
+            self.shares[code]['activator'] = None
+        elif codetype == 'client':
+            self.keys[code].status = 'notactivated'
+        else:
+            raise RPCError('invalid')
+
+    def rpc_revoke(self, client, codetype, code):
+        if codetype == 'share':
+            if code not in self.shares:
+                raise RPCError('invalid')
+            del self.shares[code]
+        elif codetype == 'client':
+            r = self.keys.pop(code)
+            r.key = self.newid()
+            self.keys[r.key] = r
+            return r.key
+        else:
+            raise RPCError('invalid')
+
+
+def synthetic_portal(platform, devices=10, dataports=5, points=100, depth=0,
+                     seed=0, interval=60, end=None):
+    '''Create a portal client with devices, each with dataports with
+    points recorded interval seconds apart up to end (default now).
+    With depth > 0, devices are spread across that many levels of
+    clients between the portal and the devices. Returns the portal's
+    CIK.
+
+    devices=10000, dataports=9 makes a portal with 100k resources.'''
+    if end is None:
+        end = int(time.time())
+    start = end - (points - 1) * interval
+    formats = ['integer', 'float', 'string']
+
+    def values(fmt, n):
+        # cheap deterministic values that differ between dataports
+        if fmt == 'integer':
+            return lambda i: (n * 7919 + i * 104729) % 1000
+        if fmt == 'float':
+            return lambda i: ((n * 7919 + i * 104729) % 10000) / 10.0
+        return lambda i: 'value {0}'.format((n * 7919 + i * 104729) % 1000)
+
+    with platform.lock:
+        portal = platform.new('client', {'name': 'Synthetic Portal'})
+        # intermediate clients, e.g. groups of devices
+        parents = [portal]
+        width = max(1, int(round(devices ** (1.0 / (depth + 1))))) if depth > 0 else 1
+        for level in range(depth):
+            parents = [platform.new('client', {'name': 'group {0}.{1}'.format(level, i)}, p)
+                       for p in parents for i in range(width)]
+        n = seed * 1000003
+        for d in range(devices):
+            parent = parents[d % len(parents)]
+            device = platform.new('client', {'name': 'device {0}'.format(d)}, parent)
+            parent.aliases['device{0}'.format(d)] = device.rid
+            for p in range(dataports):
+                fmt = formats[p % len(formats)]
+                dp = platform.new('dataport',
+                                  {'name': 'dataport {0}'.format(p), 'format': fmt},
+                                  device)
+                device.aliases['dp{0}'.format(p)] = dp.rid
+                n += 1
+                if points > 0:
+                    dp.series.generate(start, interval, points, values(fmt, n))
+    return portal.key
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, so without this each
+    # response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server.mockserver
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != RPC_PATH:
+            self.send_error(404)
+            return
+        calls = []
+        try:
+            request = json.loads(body.decode('utf-8'))
+            calls = request['calls']
+            response = server.platform.handle(request['auth'], calls)
+        except (ValueError, KeyError, TypeError) as ex:
+            response = {'error': {'code': 400, 'message': 'Parse error', 'context': str(ex)}}
+        data = json.dumps(response).encode('utf-8')
+        with server.statslock:
+            server.stats['requests'] += 1
+            server.stats['calls'] += len(calls)
+            server.stats['request_bytes'] += len(body)
+            server.stats['response_bytes'] += len(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockServer():
+    '''Serves a OnePlatform over HTTP. Pass port 0 to use any free port;
+    the port used is in the port attribute.'''
+
+    def __init__(self, port=0, host='127.0.0.1', platform=None):
+        self.platform = OnePlatform() if platform is None else platform
+        self.httpd = _ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.mockserver = self
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self.statslock = threading.Lock()
+        self.reset_stats()
+        self._thread = None
+
+    def reset_stats(self):
+        '''Reset the counts of requests, calls and bytes'''
+        with self.statslock:
+            self.stats = {'requests': 0, 'calls': 0,
+                          'request_bytes': 0, 'response_bytes': 0}
+
+    def exo_args(self):
+        '''Returns the exo global options for connecting to the server'''
+        return ['--host={0}'.format(self.host), '--port={0}'.format(self.port), '--http']
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+    server = MockServer(port=int(args['--port']))
+    cik = synthetic_portal(server.platform,
+                           devices=int(args['--devices']),
+                           dataports=int(args['--dataports']),
+                           points=int(args['--points']),
+                           depth=int(args['--depth']),
+                           seed=int(args['--seed']))
+    print(cik)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
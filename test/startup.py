@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measure how long exo takes to start up.
+
+Runs commands that don't make any requests in a fresh interpreter
+several times each and reports the fastest and median wall time. The
+first run uses an empty home directory, so it includes building the
+plugin manifest.
+
+Usage:
+    python test/startup.py [--runs=<n>] [--exo=<path>]
+
+To compare with another version, pass --exo with the path to its
+exo.py, e.g. from a checkout of an earlier release.
+'''
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+COMMANDS = [
+    ['--version'],
+    ['--help'],
+    ['read', '--help'],
+    ['switches', 'read'],
+    ['spec', '--help'],
+]
+
+
+def run(exo, args, env):
+    start = time.time()
+    p = subprocess.Popen([sys.executable, exo] + args, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    p.communicate()
+    return time.time() - start
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description='Measure exo startup time')
+    ap.add_argument('--runs', type=int, default=10)
+    ap.add_argument('--exo', default=os.path.join(here, '..', 'exoline', 'exo.py'))
+    opts = ap.parse_args()
+
+    home = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['EXO_CONFIG'] = os.path.join(home, '.exoline')
+    env.pop('EXO_DAEMON_SOCKET', None)
+    try:
+        first = run(opts.exo, COMMANDS[0], env)
+        print('{0:<20} {1:8.1f} ms'.format('first run', first * 1000))
+        print('{0:<20} {1:>8} {2:>8}'.format('command', 'min', 'median'))
+        total = 0
+        for args in COMMANDS:
+            times = sorted([run(opts.exo, args, env) for i in range(opts.runs)])
+            total += times[len(times) // 2]
+            print('{0:<20} {1:8.1f} {2:8.1f} ms'.format(
+                ' '.join(args), times[0] * 1000, times[len(times) // 2] * 1000))
+        print('{0:<20} {1:>8} {2:8.1f} ms'.format('total', '', total * 1000))
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
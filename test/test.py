@@ -19,16 +19,22 @@ import os
 import random
 import string
 import filecmp
+import shutil
 import tempfile
+import threading
 import zipfile
 
 import ruamel.yaml as yaml
 from six import iteritems
+from six import StringIO
 from dateutil import parser
 from nose.plugins.attrib import attr
 from tzlocal import get_localzone
 
 from exoline import exo
+from exoline import exodaemon
+from exoline import seriescache
+from .mockserver import MockServer, synthetic_portal
 from exoline.exo import ExolineOnepV1
 from pyonep import provision
 
@@ -528,6 +534,99 @@ class TestRPC(TestCase):
                 _recordAndVerify(r, on_stdin)
                 _flush(r)
 
+    def record_csv_test(self):
+        '''Record CSV from stdin in several chunks'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=3, points=0)
+        server.start()
+        try:
+            g = server.exo_args()
+            devcik = json.loads(rpc(*(g + ['info', cik, 'device0', '--include=key'])).stdout)['key']
+            # the string dataport has no value in every third row
+            lines = ['{0},{1}{2}'.format(1000 + t, t, '' if t % 3 == 0 else ',x{0}'.format(t))
+                     for t in range(100)]
+            r = rpc(*(g + ['record', devcik, 'dp0', 'dp2', '-', '--chunksize=7']),
+                    stdin='\n'.join(lines) + '\n\n')
+            self.ok(r, 'record CSV')
+            r = rpc(*(g + ['read', devcik, 'dp0', '--start=1000', '--limit=1000', '--timeformat=unix']))
+            self.assertEqual(len(r.stdout.splitlines()), 100, 'all of first column recorded')
+            r = rpc(*(g + ['read', devcik, 'dp2', '--start=1000', '--limit=1000',
+                           '--timeformat=unix', '--sort=asc']))
+            self.assertEqual(r.stdout.splitlines(),
+                             ['{0},x{1}'.format(1000 + t, t) for t in range(100) if t % 3 != 0],
+                             'second column recorded')
+            r = rpc(*(g + ['record', devcik, 'dp0', 'dp1', 'dp2', '-']),
+                    stdin='2000,1,notafloat,a\n')
+            self.notok(r, 'record string to float dataport', search='dp1')
+            r = rpc(*(g + ['read', devcik, 'dp0', 'dp2', '--timeformat=unix']))
+            self.ok(r, 'other dataports in the request were recorded', search='2000,1,a')
+        finally:
+            server.stop()
+
+    def record_checkpoint_test(self):
+        '''Record CSV with requests in parallel, resuming from a checkpoint'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=3, points=0)
+        server.start()
+        checkpoint = tempfile.NamedTemporaryFile(delete=False)
+        checkpoint.close()
+        os.remove(checkpoint.name)
+        try:
+            g = server.exo_args()
+            devcik = json.loads(rpc(*(g + ['info', cik, 'device0', '--include=key'])).stdout)['key']
+            lines = ['{0},{1}'.format(1000 + t, t) for t in range(100)]
+            options = ['--chunksize=7', '--parallel=3', '--checkpoint=' + checkpoint.name]
+            r = rpc(*(g + ['record', devcik, 'dp0', '-'] + options),
+                    stdin='\n'.join(lines[:60]) + '\n')
+            self.ok(r, 'record first part')
+            with open(checkpoint.name) as f:
+                offset = json.load(f)['offset']
+            self.assertEqual(offset, len('\n'.join(lines[:60]) + '\n'), 'checkpoint at end of input')
+            server.reset_stats()
+            r = rpc(*(g + ['record', devcik, 'dp0', '-'] + options),
+                    stdin='\n'.join(lines) + '\n')
+            self.ok(r, 'resume recording')
+            self.assertTrue(server.stats['calls'] <= 6, 'first part not recorded again')
+            r = rpc(*(g + ['read', devcik, 'dp0', '--start=1000', '--limit=1000',
+                           '--timeformat=unix', '--sort=asc']))
+            self.assertEqual(r.stdout.splitlines(), lines, 'all rows recorded')
+            r = rpc(*(g + ['record', devcik, 'dp1', '-'] + options), stdin='2000,1\n')
+            self.notok(r, 'checkpoint for other dataports', search='Checkpoint')
+        finally:
+            server.stop()
+            if os.path.exists(checkpoint.name):
+                os.remove(checkpoint.name)
+
+    def record_timeformat_test(self):
+        '''Record CSV read with --timeformat=iso8601 and human'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=3, points=0)
+        server.start()
+        try:
+            g = server.exo_args()
+            devcik = json.loads(rpc(*(g + ['info', cik, 'device0', '--include=key'])).stdout)['key']
+            # spans the change to daylight saving time in the US
+            timestamps = [str(1394330400 + t * 97) for t in range(200)]
+            r = rpc(*(g + ['record', devcik, 'dp0', '-']),
+                    stdin=''.join(['{0},{1}\n'.format(ts, i) for i, ts in enumerate(timestamps)]))
+            self.ok(r, 'record unix timestamps')
+            for timeformat, alias in [('iso8601', 'dp1'), ('human', 'dp2')]:
+                r = rpc(*(g + ['read', devcik, 'dp0', '--start=1394330400', '--limit=1000',
+                               '--timeformat=' + timeformat, '--tz=America/Chicago']))
+                self.ok(r, 'read with --timeformat=' + timeformat)
+                r = rpc(*(g + ['record', devcik, alias, '-']), stdin=r.stdout)
+                self.ok(r, 'record timestamps formatted as ' + timeformat)
+                r = rpc(*(g + ['read', devcik, alias, '--start=1394330400', '--limit=1000',
+                               '--timeformat=unix', '--sort=asc']))
+                self.assertEqual([line.split(',')[0] for line in r.stdout.splitlines()], timestamps,
+                                 'recorded at the same timestamps from ' + timeformat)
+            parse_ts = exo.ExoUtilities.parse_ts
+            self.assertEqual(parse_ts('2014-03-09T01:00:00Z'), 1394326800)
+            self.assertEqual(parse_ts('2014-03-08 19:00:00-06:00'), 1394326800)
+            self.assertEqual(parse_ts('2014-03-09T02:30:00+0130'), 1394326800)
+        finally:
+            server.stop()
+
     def run_tree_tsts(self, treecmd='tree', options=[]):
         cik = self.client.cik()
 
@@ -592,6 +691,190 @@ class TestRPC(TestCase):
         '''Twee command'''
         self.run_tree_tsts('twee', ['--nocolor'])
 
+    @attr('tree')
+    def tree_batched_test(self):
+        '''Tree and twee request clients' children together'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=20, dataports=2, points=1, depth=1)
+        server.start()
+        try:
+            g = server.exo_args()
+            for treecmd, options in [('tree', []), ('twee', ['--nocolor'])]:
+                server.reset_stats()
+                r = rpc(*(g + [treecmd, cik] + options))
+                self.ok(r, treecmd + ' of synthetic portal')
+                # get_terminal_size prints "default" when there's no terminal
+                lines = [line for line in r.stdout.splitlines() if line != 'default']
+                # portal, 4 groups of devices, 20 devices, 40 dataports
+                self.assertEqual(len(lines), 65, 'one line per resource')
+                # one request at a time would take 4 for each client
+                self.assertTrue(server.stats['requests'] <= 20,
+                                '{0} requests'.format(server.stats['requests']))
+            r = rpc(*(g + ['tree', cik, '--level=1']))
+            lines = [line for line in r.stdout.splitlines() if line != 'default']
+            self.assertEqual(len(lines), 5, 'tree --level=1')
+            r = rpc(*(g + ['tree', cik, '--max-children=2']))
+            self.ok(r, 'tree --max-children')
+            if sys.version_info < (3, 0):
+                r.stdout = r.stdout.decode('utf-8')
+            lines = [line for line in r.stdout.splitlines() if line != 'default']
+            # 2 of 4 groups, 2 of 5 devices in each, and both dataports
+            self.assertEqual(len(lines), 18, 'tree --max-children=2')
+            self.assertTrue(lines[-1].endswith('└─... 2 more'), 'groups left out')
+            self.assertTrue(lines[-2].endswith('└─... 3 more'), 'devices left out')
+        finally:
+            server.stop()
+
+    def infotree_fast_test(self):
+        '''_infotree_fast matches _infotree'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=20, dataports=2, points=1, depth=2)
+        server.start()
+        try:
+            er = exo.ExoRPC(host=server.host, port=server.port, https=False)
+            def nodeid(rid, info):
+                return info['description']['name'] + '.' + rid
+            for level in [2, 1, 0, None]:
+                server.reset_stats()
+                slow = er._infotree(cik, nodeidfn=nodeid, level=level)
+                slow_requests = server.stats['requests']
+                server.reset_stats()
+                fast = er._infotree_fast(cik, nodeidfn=nodeid, level=level)
+                self.assertEqual(fast, slow, 'same tree with level {0}'.format(level))
+                self.assertTrue(server.stats['requests'] <= slow_requests,
+                                '{0} requests, not {1}'.format(
+                                    server.stats['requests'], slow_requests))
+
+            # clients are only reachable by RID from the client that owns
+            # them, so each client has to be asked about with its own auth
+            server.platform.directowner = True
+            expected = er._infotree(cik, raiseExceptions=False)
+            self.assertFalse('exception' in json.dumps(expected, default=str), 'no exceptions')
+            parallel = exo.ExoRPC(host=server.host, port=server.port, https=False, parallel=4)
+            try:
+                for r in [er, parallel]:
+                    self.assertEqual(r._infotree_fast(cik, raiseExceptions=False), expected,
+                                     'same tree when owners matter (parallel {0})'.format(r.parallel))
+            finally:
+                parallel.close()
+
+            expected = json.loads(json.dumps(er._infotree(cik)))
+            r = rpc(*(server.exo_args() + ['info', cik, '--recursive']))
+            self.ok(r, 'info --recursive')
+            self.assertEqual(json.loads(r.stdout), expected, 'info --recursive')
+            server.platform.directowner = False
+
+            def unsupported(rid, info):
+                raise exo.ExoException('unsupported ' + rid)
+            try:
+                er._infotree_fast(cik, nodeidfn=unsupported)
+                self.fail('nodeidfn exception is raised')
+            except exo.ExoException:
+                pass
+            tree = er._infotree_fast(cik, nodeidfn=unsupported, raiseExceptions=False)
+            self.assertTrue('exception' in tree, 'exception node')
+        finally:
+            server.stop()
+
+    def snapshot_test(self):
+        '''Snapshot saves an info tree and refreshes it with what changed'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=20, dataports=3, points=1, depth=1)
+        server.start()
+        snapshot = tempfile.NamedTemporaryFile(delete=False)
+        snapshot.close()
+        os.remove(snapshot.name)
+        try:
+            g = server.exo_args()
+            server.reset_stats()
+            r = rpc(*(g + ['snapshot', cik, snapshot.name]))
+            self.ok(r, 'first snapshot')
+            # portal, 4 groups, 20 devices, 60 dataports
+            self.assertEqual(r.stdout.strip(), 'Saved 85 resources to ' + snapshot.name)
+            calls = server.stats['calls']
+
+            server.reset_stats()
+            r = rpc(*(g + ['snapshot', cik, snapshot.name]))
+            self.ok(r, 'unchanged snapshot')
+            self.assertTrue(r.stdout.strip().endswith('0 added, 0 removed, 0 changed'), r.stdout)
+            # only clients' info and listings are requested
+            self.assertTrue(server.stats['calls'] < calls / 2,
+                            '{0} calls, not {1}'.format(server.stats['calls'], calls))
+
+            devcik = json.loads(rpc(*(g + ['info', cik, '--recursive'])).stdout)
+            devcik = [c for c in devcik['info']['children'][0]['info']['children']
+                      if c['info']['basic']['type'] == 'client'][0]['info']['key']
+            r = rpc(*(g + ['create', devcik, '--type=dataport', '--format=integer', '--alias=added']))
+            self.ok(r, 'create dataport')
+            r = rpc(*(g + ['snapshot', cik, snapshot.name]))
+            self.ok(r, 'snapshot after create')
+            # the new dataport, and the device's aliases
+            self.assertTrue(r.stdout.strip().endswith('1 added, 0 removed, 1 changed'), r.stdout)
+
+            r = rpc(*(g + ['search', cik, 'added', '--silent', '--nocolor',
+                           '--snapshot=' + snapshot.name]))
+            self.ok(r, 'search snapshot')
+            self.assertEqual(r.stdout, rpc(*(g + ['search', cik, 'added', '--silent',
+                                                  '--nocolor'])).stdout)
+            self.assertTrue('alias:added' in r.stdout, 'found new dataport')
+
+            r = rpc(*(g + ['snapshot', devcik, snapshot.name]))
+            self.notok(r, 'snapshot of another client', search='Snapshot')
+        finally:
+            server.stop()
+            if os.path.exists(snapshot.name):
+                os.remove(snapshot.name)
+
+    def search_index_test(self):
+        '''Search an indexed snapshot without requests'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=10, dataports=2, points=1)
+        portal = server.platform.keys[cik]
+        device = portal.children[0]
+        device.description['meta'] = json.dumps(
+            {'device': {'type': 'vendor', 'model': 'mymodel', 'sn': 'ABC123'}})
+        server.platform.new('datarule', {'name': 'rule', 'rule': {'script': 'local Threshold = 5'}},
+                            device)
+        server.start()
+        snapshot = tempfile.NamedTemporaryFile(delete=False)
+        snapshot.close()
+        os.remove(snapshot.name)
+        try:
+            g = server.exo_args() + ['search', cik]
+            options = ['--silent', '--nocolor', '--snapshot=' + snapshot.name]
+            for query, extra in itertools.product(
+                    ['device 1', 'DP1', 'dp1', 'Threshold', 'threshold', 'thresh', 'abc12', 'device 0|ABC'],
+                    [[], ['--matchcase']]):
+                r = rpc(*(g + [query, '--silent', '--nocolor'] + extra))
+                self.ok(r, 'search ' + query)
+                server.reset_stats()
+                r2 = rpc(*(g + [query] + options + extra))
+                self.ok(r2, 'search snapshot for ' + query)
+                self.assertEqual(r2.stdout, r.stdout, 'same results for ' + query)
+            self.assertEqual(server.stats['requests'], 0, 'searched the saved index')
+            r = rpc(*(g + ['threshold', '--silent', '--nocolor']))
+            self.ok(r, 'search ignores case', search='name:rule')
+            r = rpc(*(g + ['threshold', '--matchcase'] + options))
+            self.assertEqual(r.stdout, '', 'case matters with --matchcase')
+            r = rpc(*(g + ['Threshold', '--matchcase'] + options))
+            self.ok(r, 'search --matchcase', search='name:rule')
+            r = rpc(*(g + ['abc12', '--silent', '--nocolor']))
+            self.ok(r, 'search serial number', search='name:device 0 sn:mymodel#ABC123$')
+
+            server.platform.new('dataport', {'name': 'added'}, device)
+            r = rpc(*(g + ['added'] + options))
+            self.assertEqual(r.stdout, '', 'not refreshed')
+            r = rpc(*(g + ['added', '--refresh'] + options))
+            self.ok(r, 'search --refresh', search='name:added')
+
+            r = rpc(*(g + ['added', '--refresh']))
+            self.notok(r, '--refresh without --snapshot', search='--snapshot')
+        finally:
+            server.stop()
+            for filename in [snapshot.name, snapshot.name + '.index']:
+                if os.path.exists(filename):
+                    os.remove(filename)
+
     def map_test(self):
         '''Map/unmap commands'''
         stdports = self._createDataports()
@@ -901,6 +1184,105 @@ class TestRPC(TestCase):
         r = rpc('read', '--start=2013-07-20T3:00:08', '--end=2013-07-20T3:00:08', '--timeformat=unix', cik)
         self.ok(r, 'read all RIDs', match='timestamp,' + ','.join(['.*' for rid in rids]) + '\n[0-9]+' + ','.join(['.*' for rid in rids]))
 
+    def readmultiple_chunks_test(self):
+        '''Read multiple RIDs with different amounts of data in chunks'''
+        cik = self.client.cik()
+        dense, sparse = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'dense'}),
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'sparse'})])
+        r = rpc('record', cik, dense,
+                *['--value={0},{1}'.format(t, t) for t in range(1000, 1020)])
+        self.ok(r, 'record dense data')
+        r = rpc('record', cik, sparse, '--value=1001,1', '--value=1030,2')
+        self.ok(r, 'record sparse data')
+
+        expected = dict([(t, [t, '']) for t in range(1000, 1020)])
+        expected[1001][1] = 1
+        expected[1030] = ['', 2]
+        for sort in ['asc', 'desc']:
+            for limit in [5, 21, 100]:
+                r = rpc('read', cik, dense, sparse,
+                        '--start=1000', '--end=1100', '--timeformat=unix',
+                        '--chunksize=3', '--limit={0}'.format(limit),
+                        '--sort={0}'.format(sort))
+                self.ok(r, 'read {0} {1}'.format(sort, limit))
+                ts = sorted(expected.keys(), reverse=(sort == 'desc'))[:limit]
+                self.assertEqual(
+                    r.stdout.splitlines(),
+                    ['{0},{1},{2}'.format(t, *expected[t]) for t in ts],
+                    'no series is cut short ({0} {1})'.format(sort, limit))
+
+    def readmultiple_capped_test(self):
+        '''Read multiple RIDs when the platform returns fewer points than asked for'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=2, points=40)
+        server.platform.maxread = 4
+        server.start()
+        try:
+            r = rpc(*(server.exo_args() + ['lookup', cik, 'device0']))
+            devrid = r.stdout.strip()
+            r = rpc(*(server.exo_args() + ['info', cik, devrid, '--include=key']))
+            devcik = json.loads(r.stdout)['key']
+            for sort in ['asc', 'desc']:
+                r = rpc(*(server.exo_args() + ['read', devcik, 'dp0', 'dp1', '--limit=40',
+                                               '--chunksize=3', '--timeformat=unix',
+                                               '--sort={0}'.format(sort)]))
+                self.ok(r, 'read {0} with reads capped'.format(sort))
+                self.assertEqual(len(r.stdout.splitlines()), 40,
+                                 'reads cut short by the platform continue ({0})'.format(sort))
+        finally:
+            server.stop()
+
+    def readmult_ranges_test(self):
+        '''Read windows of time no more than --parallel at a time'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=2, points=200)
+        server.start()
+        try:
+            er = exo.ExoRPC(host=server.host, port=server.port, https=False, parallel=2)
+            devcik = er.info(cik, er.lookup(cik, 'device0'), {'key': True})['key']
+            rids = [er.lookup(devcik, alias) for alias in ['dp0', 'dp1']]
+            expected = list(er.readmult(devcik, rids, 1000, chunksize=7))
+            self.assertEqual(len(expected), 200)
+
+            readmult = er.readmult
+            inflight = {'now': 0, 'max': 0}
+            lock = threading.Lock()
+            def countedreadmult(*args, **kwargs):
+                with lock:
+                    inflight['now'] += 1
+                    inflight['max'] = max(inflight['max'], inflight['now'])
+                try:
+                    for row in readmult(*args, **kwargs):
+                        yield row
+                finally:
+                    with lock:
+                        inflight['now'] -= 1
+            er.readmult = countedreadmult
+            try:
+                for sort in ['asc', 'desc']:
+                    rows = list(er.readmult_ranges(devcik, rids, 1000, sort=sort,
+                                                   chunksize=7, ranges=6))
+                    self.assertEqual(rows, expected if sort == 'asc' else expected[::-1],
+                                     'same rows in {0} order'.format(sort))
+                self.assertEqual(inflight['max'], 2, 'two windows read at a time')
+            finally:
+                er.close()
+        finally:
+            server.stop()
+
+    def batchsize_test(self):
+        '''Batch sizes are kept for each initial size'''
+        er = exo.ExoRPC(host='127.0.0.1', port=1, https=False)
+        try:
+            sizer = er._batchsize('read', 3, maxsize=10000)
+            self.assertTrue(er._batchsize('read', 3, maxsize=10000) is sizer, 'same sizer for the same size')
+            other = er._batchsize('read', 50, maxsize=10000)
+            self.assertFalse(other is sizer, 'new sizer for a different size')
+            self.assertEqual(other.size, 50, 'starts at the size asked for')
+        finally:
+            er.close()
+
     def clone_test(self):
         '''Clone command'''
         stdports = self._createDataports()
@@ -1087,6 +1469,213 @@ class TestRPC(TestCase):
         r = rpc('--port=88', 'info', cik)
         self.notok(r, 'wrong port', match='JSON RPC Request Exception.*')
 
+    def parallel_test(self):
+        '''Send batched requests in parallel'''
+        cik = self.client.cik()
+        self._createMultiple(cik, [
+            Resource(cik, 'client', {'name': 'parallel' + str(i)}) for i in range(30)])
+
+        r = rpc('find', cik, '--match', 'type=client', '--show', 'key')
+        self.ok(r, 'find without --parallel')
+        serial = sorted(r.stdout.splitlines())
+        self.assertEqual(len(serial), 30, 'found all clients')
+
+        r = rpc('--parallel=4', 'find', cik, '--match', 'type=client', '--show', 'key')
+        self.ok(r, 'find with --parallel')
+        self.assertEqual(sorted(r.stdout.splitlines()), serial, 'same clients found with --parallel')
+
+        r = rpc('--parallel=0', 'info', cik)
+        self.notok(r, '--parallel must be positive', match='Command line error.*')
+
+    def infocache_test(self):
+        '''Remember info and listing responses'''
+        cik = self.client.cik()
+        tmpdir = tempfile.mkdtemp()
+        cachefile = os.path.join(tmpdir, 'cachefile')
+        try:
+            r = rpc('--infocache=60', '--infocachefile=' + cachefile, 'listing', cik, '--types=dataport', '--plain')
+            self.ok(r, 'listing with cache file')
+            self.assertEqual(r.stdout, '', 'no dataports yet')
+            r = rpc('--infocache=60', '--infocachefile=' + cachefile, 'create', cik, '--type=dataport', '--format=integer', '--alias=cached')
+            self.ok(r, 'create clears the cache')
+            r = rpc('--infocache=60', '--infocachefile=' + cachefile, 'listing', cik, '--types=dataport', '--plain')
+            self.ok(r, 'listing after create', match='[0-9a-f]{40}')
+            r = rpc('--infocache=0', 'listing', cik, '--types=dataport', '--plain')
+            self.ok(r, 'listing without cache', match='[0-9a-f]{40}')
+            r = rpc('--infocache=-1', 'listing', cik)
+            self.notok(r, 'negative cache time fails')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def recordrpc_test(self):
+        '''Record requests and replay them offline'''
+        cik = self.client.cik()
+        tmpdir = tempfile.mkdtemp()
+        recording = os.path.join(tmpdir, 'recording')
+        try:
+            live = rpc('--recordrpc=' + recording, 'tree', cik)
+            self.ok(live, 'tree while recording')
+            r = rpc('--replayrpc=' + recording, '--host=127.0.0.1', '--port=9', '--http',
+                    'tree', cik)
+            self.ok(r, 'tree from recording')
+            self.assertEqual(r.stdout, live.stdout, 'same output from recording')
+            r = rpc('--replayrpc=' + recording, '--host=127.0.0.1', '--port=9', '--http',
+                    'drop', cik, '--all-children')
+            self.notok(r, 'no response recorded for drop')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def mockserver_test(self):
+        '''Run commands against the stand-in One Platform server'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=3, dataports=2, points=10)
+        server.start()
+        try:
+            r = rpc(*(server.exo_args() + ['twee', cik, '--nocolor']))
+            if sys.version_info < (3, 0):
+                r.stdout = r.stdout.decode('utf-8')
+            self.ok(r, 'twee synthetic portal', search='device 2')
+            r = rpc(*(server.exo_args() + ['read', cik, 'device0', '--limit=1']))
+            self.ok(r, 'read synthetic portal')
+            r = rpc(*(server.exo_args() + ['lookup', cik, 'device0']))
+            devrid = r.stdout.strip()
+            r = rpc(*(server.exo_args() + ['info', cik, devrid, '--include=key']))
+            devcik = json.loads(r.stdout)['key']
+            r = rpc(*(server.exo_args() + ['record', devcik, 'dp0', '--value=1000,42']))
+            self.ok(r, 'record to synthetic dataport')
+            r = rpc(*(server.exo_args() + ['read', devcik, 'dp0', '--start=1000', '--end=1000']))
+            self.ok(r, 'read recorded point', search=',42')
+            self.assertTrue(server.stats['requests'] > 0, 'server counted requests')
+        finally:
+            server.stop()
+
+    def perf_test(self):
+        '''Report requests made by a command'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=3, dataports=2, points=10)
+        server.start()
+        tmpdir = tempfile.mkdtemp()
+        perfout = os.path.join(tmpdir, 'perf.json')
+        try:
+            r = rpc(*(server.exo_args() + ['--perf', '--perf-out=' + perfout,
+                                           'twee', cik, '--nocolor']))
+            if sys.version_info < (3, 0):
+                r.stdout = r.stdout.decode('utf-8')
+            self.ok(r, 'twee with --perf', search='device 2')
+            self.assertTrue('perf: listing' in r.stderr, 'report shows listing requests')
+            with open(perfout) as f:
+                reports = [json.loads(line) for line in f]
+            self.assertEqual(len(reports), 1, 'one report per command')
+            report = reports[0]
+            self.assertEqual(report['command'], 'twee')
+            self.assertEqual(report['requests'], server.stats['requests'],
+                             'report counts every request')
+            self.assertTrue(report['calls'] >= report['requests'])
+            self.assertTrue(report['procedures']['listing']['p50'] <=
+                            report['procedures']['listing']['p99'])
+        finally:
+            server.stop()
+            shutil.rmtree(tmpdir)
+
+    def plugin_manifest_test(self):
+        '''Find plugin commands without importing plugins'''
+        plugin_path = os.path.join(os.path.dirname(exo.__file__), 'plugins')
+        tmpdir = tempfile.mkdtemp()
+        manifest = os.path.join(tmpdir, 'plugins.json')
+        try:
+            commands = exo.plugin_manifest([plugin_path], manifest)
+            self.assertTrue(os.path.exists(manifest), 'manifest was saved')
+            names = [c[0] for c in commands]
+            for name in ['spec', 'dump', 'model', 'sn', 'content']:
+                self.assertTrue(name in names, 'found plugin command ' + name)
+            self.assertEqual(exo.plugin_manifest([plugin_path], manifest), commands,
+                             'same commands from saved manifest')
+            # plugin commands are only looked up when they're needed
+            exo.plugins_loaded = False
+            r = rpc('--version', noconfig=True)
+            self.ok(r, 'exo --version')
+            self.assertFalse(exo.plugins_loaded, 'no plugins loaded for exo --version')
+            r = rpc('switches', 'spec')
+            self.ok(r, 'plugin runs', search='--check')
+            self.assertTrue(exo.plugins_loaded, 'plugins loaded for a plugin command')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _start_daemon(self):
+        '''Start exo daemon in a thread. Returns its socket path and an
+           event that stops it.'''
+        path = os.path.join(tempfile.mkdtemp(), 'exo.sock')
+        stop = threading.Event()
+        daemon = threading.Thread(target=exo.serve_daemon, args=(path, stop))
+        daemon.daemon = True
+        daemon.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        return path, stop, daemon
+
+    def _stop_daemon(self, path, stop, daemon):
+        stop.set()
+        daemon.join()
+        shutil.rmtree(os.path.dirname(path))
+        self.assertTrue(exo.daemon_rpcs is None, 'daemon cleaned up')
+
+    def daemon_test(self):
+        '''Run commands in exo daemon'''
+        cik = self.client.cik()
+        rid = self.client.rid
+        argv = ['exo', '--host', config['host'], '--port', config['port']]
+        if not config['https']:
+            argv.append('--http')
+        path, stop, daemon = self._start_daemon()
+        try:
+            for args in [['info', cik, '--include=basic'],
+                         ['write', cik, rid, '--value=1'],
+                         ['read', cik, rid, '--limit=1'],
+                         ['read', cik, 'nonexistent']]:
+                r = rpc(*args)
+                stdout = StringIO()
+                stderr = StringIO()
+                exitcode = exodaemon.forward(path, argv + args, stdin=StringIO(),
+                                             stdout=stdout, stderr=stderr)
+                self.assertEqual(exitcode, r.exitcode, 'same exit code from daemon for {0}'.format(args[0]))
+                self.assertEqual(stdout.getvalue().strip(), r.stdout, 'same output from daemon for {0}'.format(args[0]))
+
+            self.assertEqual(exodaemon.forward(path + '.missing', argv + ['info', cik]), None,
+                             'no daemon listening')
+            self.assertEqual(len(exo.PERF_DATA), 0, 'daemon keeps no requests between commands')
+            self.assertEqual(exodaemon.forward(path, argv + ['read', cik, rid, '--follow']), None,
+                             '--follow runs locally')
+            self.assertEqual(exodaemon.forward(path, argv + ['record', cik, rid], stdin=StringIO('1,2\n')), None,
+                             'record from stdin runs locally')
+
+            # stdin is left alone for commands that don't read it
+            stdin = StringIO('next line\n')
+            exodaemon.forward(path, argv + ['info', cik, '--include=basic'], stdin=stdin,
+                              stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(stdin.read(), 'next line\n', 'stdin not read by info')
+        finally:
+            self._stop_daemon(path, stop, daemon)
+
+    def daemon_infocache_test(self):
+        '''exo daemon doesn't keep cached responses between commands'''
+        server = MockServer()
+        cik = synthetic_portal(server.platform, devices=1, dataports=1, points=1)
+        server.start()
+        path, stop, daemon = self._start_daemon()
+        try:
+            argv = ['exo', '--infocache=60'] + server.exo_args() + ['info', cik, '--include=description']
+            def name():
+                stdout = StringIO()
+                exitcode = exodaemon.forward(path, argv, stdin=StringIO(), stdout=stdout, stderr=StringIO())
+                self.assertEqual(exitcode, 0, 'info in daemon')
+                return json.loads(stdout.getvalue())['description']['name']
+            self.assertEqual(name(), 'Synthetic Portal')
+            server.platform.keys[cik].description['name'] = 'Renamed'
+            self.assertEqual(name(), 'Renamed', 'next command sees the change')
+        finally:
+            self._stop_daemon(path, stop, daemon)
+            server.stop()
+
     def info_test(self):
         '''Info command'''
         allkeys = ['aliases', 'basic', 'counts', 'description', 'key',
@@ -1170,6 +1759,154 @@ class TestRPC(TestCase):
         r = rpc('read', cik, rid, '--start=1', '--end=10', '--timeformat=unix', '--limit=2', '--selection=givenwindow')
         self.ok(r, 'read with --selection set', match=r'8,f\r?\n1,a')
 
+    @attr('read')
+    def read_parallel_ranges_test(self):
+        '''Read --parallel-ranges option'''
+        cik = self.client.cik()
+        rid1, rid2 = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'}),
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port2'})])
+        r = rpc('record', cik, rid1,
+                *['--value={0},{1}'.format(t, t) for t in range(100, 300, 2)])
+        self.ok(r, 'record values')
+        r = rpc('record', cik, rid2,
+                *['--value={0},{1}'.format(t, t) for t in range(100, 300, 7)])
+        self.ok(r, 'record values')
+        for sort in ['asc', 'desc']:
+            for limit in ['1', '20', '1000']:
+                readcmd = ['read', cik, rid1, rid2, '--start=1', '--end=1000',
+                           '--timeformat=unix', '--chunksize=10',
+                           '--limit=' + limit, '--sort=' + sort]
+                expected = rpc(*readcmd)
+                self.ok(expected, 'read without --parallel-ranges')
+                for ranges in [['--parallel-ranges=3'],
+                               ['--parallel=2', '--parallel-ranges=4', '--balance-ranges']]:
+                    r = rpc(*(readcmd + ranges))
+                    self.ok(r, 'read with ' + ' '.join(ranges))
+                    self.assertEqual(r.stdout, expected.stdout,
+                        'same output with ' + ' '.join(ranges))
+        r = rpc('read', cik, rid1, '--parallel-ranges=0')
+        self.notok(r, 'zero ranges fails')
+
+    @attr('read')
+    def read_timeformat_test(self):
+        '''Read with each --timeformat'''
+        cik = self.client.cik()
+        rid1, rid2 = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'}),
+            Resource(cik, 'dataport', {'format': 'string', 'name': 'str_port'})])
+        r = rpc('record', cik, rid1, '--value=1000000000,1', '--value=1000000061,2')
+        self.ok(r, 'record integers')
+        r = rpc('record', cik, rid2, '--value=1000000061,a\rb')
+        self.ok(r, 'record string')
+        expected = {
+            'unix': ['1000000061,2,ab', '1000000000,1,'],
+            'iso8601': ['2001-09-09T01:47:41+00:00,2,ab', '2001-09-09T01:46:40+00:00,1,'],
+            'excel': ['09/09/01 01:47:41,2,ab', '09/09/01 01:46:40,1,']}
+        for timeformat, lines in expected.items():
+            r = rpc('read', cik, rid1, rid2, '--start=1000000000', '--end=1000000100',
+                    '--limit=10', '--timeformat=' + timeformat)
+            self.ok(r, 'read with --timeformat=' + timeformat)
+            self.assertEqual(r.stdout.splitlines(), lines,
+                             'timestamps formatted as ' + timeformat)
+
+    @attr('read')
+    def read_columnar_test(self):
+        '''Read with --format=npz'''
+        try:
+            import numpy as np
+        except ImportError:
+            from nose.plugins.skip import SkipTest
+            raise SkipTest('numpy is not installed')
+        cik = self.client.cik()
+        rid1, rid2 = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'}),
+            Resource(cik, 'dataport', {'format': 'string', 'name': 'str_port'})])
+        r = rpc('record', cik, rid1, '--value=1000,1', '--value=1001,2')
+        self.ok(r, 'record integers')
+        r = rpc('record', cik, rid2, '--value=1001,你好')
+        self.ok(r, 'record string')
+        tmpdir = tempfile.mkdtemp()
+        outfile = os.path.join(tmpdir, 'read.npz')
+        try:
+            r = rpc('read', cik, rid1, rid2, '--start=1000', '--end=1001', '--limit=10',
+                    '--header=name', '--format=npz', '--outfile=' + outfile)
+            self.ok(r, 'read --format=npz')
+            data = np.load(outfile)
+            self.assertEqual(data['timestamp'].tolist(), [1001, 1000])
+            self.assertEqual(data['int_port'].tolist(), [2, 1])
+            self.assertEqual(data['str_port'][0], '你好')
+            self.assertEqual(data['str_port.mask'].tolist(), [False, True])
+        finally:
+            shutil.rmtree(tmpdir)
+        r = rpc('read', cik, rid1, '--format=npz')
+        self.notok(r, '--format=npz requires --outfile')
+
+    @attr('read')
+    def read_cache_test(self):
+        '''Read --cache option'''
+        cik = self.client.cik()
+        rid = self._createMultiple(cik, [
+            Resource(cik, 'dataport', {'format': 'integer', 'name': 'int_port'})])[0]
+        now = int(time.time())
+        r = rpc('record', cik, rid,
+                *['--value={0},{1}'.format(t, t) for t in range(now - 3600, now - 120, 60)])
+        self.ok(r, 'record values')
+        readcmd = ['read', cik, rid, '--timeformat=unix', '--limit=100']
+        expected = rpc(*(readcmd + ['--no-cache']))
+        for i in range(2):
+            r = rpc(*(readcmd + ['--cache']))
+            self.ok(r, 'read with --cache')
+            self.assertEqual(r.stdout, expected.stdout, 'same output with --cache')
+        r = rpc('write', cik, rid, '--value=42')
+        self.ok(r, 'write a new value')
+        expected = rpc(*(readcmd + ['--no-cache']))
+        self.assertTrue(expected.stdout.splitlines()[0].endswith(',42'))
+        r = rpc(*(readcmd + ['--cache', '--start={0}'.format(now - 600)]))
+        self.ok(r, 'read new value with --cache', match=r'[0-9]+,42\r?\n.*')
+        r = rpc(*(readcmd + ['--cache']))
+        self.assertEqual(r.stdout, expected.stdout, 'cache picks up new value')
+
+    def seriescache_test(self):
+        '''Read cache file permissions and covered ranges'''
+        path = os.path.join(tempfile.mkdtemp(), 'series.sqlite')
+        cache = seriescache.SeriesCache(path)
+        try:
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600, 'only the user may read the cache')
+            points = [[t, t] for t in range(100, 110)]
+            self.assertEqual(cache._covered(points, 10, 'asc', 0, 105), (0, 105),
+                             'ascending read at limit covers no more than end')
+            self.assertEqual(cache._covered(points, 10, 'asc', 0, 200), (0, 108))
+            self.assertEqual(cache._covered(points[::-1], 10, 'desc', 0, 200), (101, 200))
+            self.assertEqual(cache._covered(points[:5], 10, 'asc', 0, 200), (0, 200))
+
+            series = [[t, t] for t in range(1000, 1100)]
+            requests = []
+            def fetch(reqs):
+                requests.extend(reqs)
+                responses = []
+                for i, lim, srt, s, e in reqs:
+                    found = [p for p in series if s <= p[0] <= e]
+                    if srt == 'desc':
+                        found.reverse()
+                    responses.append(found if lim is None else found[:lim])
+                return responses
+            key = cache.key('auth', 'rid')
+            self.assertEqual(cache.read(fetch, [key], 10, 'desc', 1000, 1049),
+                             [series[49:39:-1]])
+            del requests[:]
+            self.assertEqual(cache.read(fetch, [key], 10, 'desc', 1000, 1099),
+                             [series[99:89:-1]], 'newest points after the cached range')
+            self.assertTrue(all([r[1] == 10 for r in requests]),
+                            'newer points read limit at a time')
+            self.assertEqual(cache._coverage(key), (1041, 1099), 'newer points cached')
+            del requests[:]
+            self.assertEqual(cache.read(fetch, [key], 100, 'asc', 1041, 1099),
+                             [series[41:]])
+            self.assertEqual(requests, [], 'read from the cache')
+        finally:
+            cache.close()
+
     def utf8_test(self):
         '''Read a string with UTF8 characters'''
         cik = self.client.cik()
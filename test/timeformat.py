@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measure how fast read output timestamps are formatted.
+
+Formats a series of timestamps with serieswriter.TimestampFormatter,
+with and without its cache, for each --timeformat, and reports
+microseconds per timestamp. Dense timestamps are a few seconds apart,
+as from a high frequency dataport, and sparse ones are days apart.
+
+Then parses the formatted timestamps back with
+ExoUtilities.parse_timestamp, as record does, and with dateutil.
+
+Usage:
+    python test/timeformat.py [--count=<n>] [--tz=<TZ>]
+'''
+from __future__ import unicode_literals, print_function
+import os
+import sys
+import time
+import argparse
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from exoline import serieswriter
+from exoline.exo import ExoUtilities
+
+
+def measure(fn, timestamps):
+    start = time.time()
+    for t in timestamps:
+        fn(t)
+    return (time.time() - start) * 1000000 / len(timestamps)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Measure timestamp formatting')
+    ap.add_argument('--count', type=int, default=200000)
+    ap.add_argument('--tz', default='America/Chicago')
+    opts = ap.parse_args()
+
+    # spans the 2014 change to daylight saving time in the US
+    start = 1394164800
+    series = [
+        ('dense', [start + i * 3 for i in range(opts.count)]),
+        ('sparse', [start + i * 86400 * 3 for i in range(opts.count // 10)])]
+    print('{0:<10} {1:<8} {2:>10} {3:>10} {4:>8}'.format(
+        'timeformat', 'series', 'slow (us)', 'cached', 'speedup'))
+    for timeformat in ['human', 'iso8601', 'excel']:
+        for name, timestamps in series:
+            slow = measure(serieswriter.TimestampFormatter(
+                timeformat, pytz.timezone(opts.tz)).format_slow, timestamps)
+            cached = measure(serieswriter.TimestampFormatter(
+                timeformat, pytz.timezone(opts.tz)).format, timestamps)
+            print('{0:<10} {1:<8} {2:>10.2f} {3:>10.2f} {4:>7.1f}x'.format(
+                timeformat, name, slow, cached, slow / cached))
+
+    from dateutil import parser
+    print('')
+    print('{0:<10} {1:<8} {2:>10} {3:>10} {4:>8}'.format(
+        'timeformat', 'series', 'dateutil', 'parse', 'speedup'))
+    for timeformat in ['human', 'iso8601', 'excel']:
+        for name, timestamps in series:
+            formatter = serieswriter.TimestampFormatter(timeformat, pytz.timezone(opts.tz))
+            strings = [formatter.format(t) for t in timestamps]
+            slow = measure(parser.parse, strings)
+            fast = measure(ExoUtilities.parse_timestamp, strings)
+            print('{0:<10} {1:<8} {2:>10.2f} {3:>10.2f} {4:>7.1f}x'.format(
+                timeformat, name, slow, fast, slow / fast))
+
+
+if __name__ == '__main__':
+    main()